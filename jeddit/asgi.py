@@ -13,4 +13,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "jeddit.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from posts import asynchronous, live  # noqa: E402, needs the settings configured
+
+asynchronous.use_pool()
+
+
+async def application(scope, receive, send):
+    # Live update streams stay open, so they're served outside Django
+    if scope["type"] == "http" and scope["path"] == live.PATH:
+        return await live.stream(scope, receive, send)
+    return await django_application(scope, receive, send)
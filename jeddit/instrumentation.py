@@ -0,0 +1,214 @@
+"""Sampled per-request timings for when the debug toolbar isn't around.
+
+``InstrumentationMiddleware`` picks ``INSTRUMENTATION_SAMPLE_RATE`` of the
+requests and records their query count, time spent in the database, time
+spent rendering templates and total time. Each sample is sent three ways:
+
+* a ``Server-Timing`` response header, shown by browser dev tools
+* a JSON log line on the ``jeddit.instrumentation`` logger
+* a rolling histogram of the latest samples per view, kept in this process
+  and served to staff by the ``timings`` view
+
+Queries are timed by an execute wrapper added to every connection as it's
+opened, which hands them to the sampled request's timings through a context
+variable. That way the queries an async view runs in other threads are
+counted too. The middleware itself runs as a coroutine under ASGI, so it
+doesn't push every request through Django's single thread for sync code.
+
+With a sample rate of 0 the middleware removes itself from the stack.
+Otherwise unsampled requests cost one call to ``random.random``, and each of
+their queries a context variable lookup.
+"""
+import functools
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import JsonResponse
+from django.template.backends.django import Template
+
+from jeddit.middleware import ContextMiddleware
+
+logger = logging.getLogger(__name__)
+
+# Samples kept per view, and the upper bounds in ms of the histogram buckets
+WINDOW = 1000
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# The timings of the sampled request being handled, if any
+active = ContextVar("timings", default=None)
+
+
+class Timings:
+    """Totals for one request, also its database execute wrapper."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.templates = 0.0
+        self.rendering = False
+        self.started = time.perf_counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - started
+            self.queries += 1
+
+
+def forward(execute, sql, params, many, context):
+    timings = active.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    return timings(execute, sql, params, many, context)
+
+
+def instrument_connection(sender=None, connection=None, **kwargs):
+    # Wrappers outlive reconnections, so only add it the first time
+    if forward not in connection.execute_wrappers:
+        connection.execute_wrappers.append(forward)
+
+
+def instrument_connections():
+    """Time queries on every connection, whichever thread opens it."""
+    connection_created.connect(instrument_connection)
+    for connection in connections.all():
+        instrument_connection(connection=connection)
+
+
+def timed_render(render):
+    @functools.wraps(render)
+    def wrapper(self, *args, **kwargs):
+        timings = active.get()
+        # Templates rendered from inside another one are already being timed
+        if timings is None or timings.rendering:
+            return render(self, *args, **kwargs)
+        timings.rendering = True
+        started = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            timings.templates += time.perf_counter() - started
+            timings.rendering = False
+
+    wrapper.timed = True
+    return wrapper
+
+
+def instrument_templates():
+    """Time renders of the Django template backend, once per process."""
+    if not getattr(Template.render, "timed", False):
+        Template.render = timed_render(Template.render)
+
+
+def percentile(ordered, percent):
+    return ordered[min(int(len(ordered) * percent / 100), len(ordered) - 1)]
+
+
+class Histogram:
+    """The latest ``window`` samples of each view."""
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def add(self, view, sample):
+        samples = self.samples.get(view)
+        if samples is None:
+            with self.lock:
+                samples = self.samples.setdefault(view, deque(maxlen=self.window))
+        samples.append(sample)
+
+    def clear(self):
+        with self.lock:
+            self.samples = {}
+
+    def summary(self):
+        """Percentiles, means and bucket counts per view, in milliseconds."""
+        summary = {}
+        for view, samples in list(self.samples.items()):
+            samples = list(samples)
+            totals = sorted(sample["total_ms"] for sample in samples)
+            buckets = dict.fromkeys([f"<={bound}" for bound in BUCKETS] + ["inf"], 0)
+            for total in totals:
+                bound = next((bound for bound in BUCKETS if total <= bound), None)
+                buckets["inf" if bound is None else f"<={bound}"] += 1
+            summary[view] = {
+                "count": len(samples),
+                "p50_ms": percentile(totals, 50),
+                "p95_ms": percentile(totals, 95),
+                "max_ms": totals[-1],
+                "mean_queries": sum(s["queries"] for s in samples) / len(samples),
+                "max_queries": max(s["queries"] for s in samples),
+                "mean_db_ms": sum(s["db_ms"] for s in samples) / len(samples),
+                "mean_template_ms": sum(s["template_ms"] for s in samples)
+                / len(samples),
+                "buckets": buckets,
+            }
+        return summary
+
+
+histogram = Histogram()
+
+
+class InstrumentationMiddleware(ContextMiddleware):
+    context = active
+
+    def __init__(self, get_response):
+        self.rate = getattr(settings, "INSTRUMENTATION_SAMPLE_RATE", 0)
+        self.header = getattr(settings, "INSTRUMENTATION_SERVER_TIMING", True)
+        if self.rate <= 0:
+            raise MiddlewareNotUsed
+        instrument_templates()
+        instrument_connections()
+        super().__init__(get_response)
+
+    def start(self, request):
+        if random.random() < self.rate:
+            return Timings()
+        return None
+
+    def finish(self, request, response, timings):
+        total = time.perf_counter() - timings.started
+
+        match = request.resolver_match
+        sample = {
+            "view": match.view_name if match else None,
+            "method": request.method,
+            "status": response.status_code,
+            "queries": timings.queries,
+            "db_ms": round(timings.db * 1000, 2),
+            "template_ms": round(timings.templates * 1000, 2),
+            "total_ms": round(total * 1000, 2),
+        }
+        histogram.add(sample["view"] or "unresolved", sample)
+        logger.info(json.dumps(sample))
+        if self.header:
+            response["Server-Timing"] = (
+                f'db;dur={sample["db_ms"]};desc="{timings.queries} queries", '
+                f'tpl;dur={sample["template_ms"]}, total;dur={sample["total_ms"]}'
+            )
+        return response
+
+
+@staff_member_required
+def timings(request):
+    """The rolling histogram of this process, as JSON."""
+    return JsonResponse(
+        {
+            "sample_rate": getattr(settings, "INSTRUMENTATION_SAMPLE_RATE", 0),
+            "views": histogram.summary(),
+        }
+    )
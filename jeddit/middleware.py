@@ -0,0 +1,59 @@
+"""A base for middleware that runs as a coroutine under ASGI.
+
+Django only awaits a middleware that is a coroutine function, otherwise it
+sends the rest of the stack through its single thread for sync code. A
+``ContextMiddleware`` is both: it handles a request in ``__call__`` under
+WSGI and in ``acall`` under ASGI, with the same steps either way.
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+
+class ContextMiddleware:
+    """Holds a per-request state in the ``context`` variable for the request.
+
+    Subclasses set ``context`` to a ``ContextVar`` and override ``start``,
+    which returns the state or ``None`` to leave the request alone, and
+    ``finish``, which gets the state back along with the response. By
+    default every request is left alone.
+    """
+
+    sync_capable = True
+    async_capable = True
+    context = None
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            # Marks the instance as a coroutine function, as MiddlewareMixin does
+            markcoroutinefunction(self)
+
+    def start(self, request):
+        return None
+
+    def finish(self, request, response, state):
+        return response
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.acall(request)
+        state = self.start(request)
+        if state is None:
+            return self.get_response(request)
+        token = self.context.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            self.context.reset(token)
+        return self.finish(request, response, state)
+
+    async def acall(self, request):
+        state = self.start(request)
+        if state is None:
+            return await self.get_response(request)
+        token = self.context.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.context.reset(token)
+        return self.finish(request, response, state)
@@ -0,0 +1,14 @@
+"""Settings with a read replica, for trying out posts.replicas locally.
+
+Two SQLite files stand in for a primary and its replica, the ``replica``
+database that ``jeddit.settings`` declares but doesn't read from. The
+replica is as current as the last ``copyreplicas``, which can keep copying
+on an interval to stand in for replication lag::
+
+    export DJANGO_SETTINGS_MODULE=jeddit.replica_settings
+    python manage.py migrate --run-syncdb
+    python manage.py copyreplicas --interval 5
+"""
+from jeddit.settings import *  # noqa: F401, F403
+
+DATABASE_REPLICAS = ["replica"]
@@ -49,6 +49,8 @@ if DEBUG:
     INSTALLED_APPS.append("debug_toolbar")
 
 MIDDLEWARE = [
+    "jeddit.instrumentation.InstrumentationMiddleware",
+    "posts.replicas.ReplicaMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -63,6 +65,44 @@ if DEBUG:
 else:
     MIDDLEWARE.append("whitenoise.middleware.WhiteNoiseMiddleware")
 
+# Share of requests timed by InstrumentationMiddleware, the debug toolbar
+# covers development
+INSTRUMENTATION_SAMPLE_RATE = 0.0 if DEBUG else 0.01
+INSTRUMENTATION_SERVER_TIMING = True
+
+# Buffer votes in each process and write them in batches, see posts.votebuffer
+VOTE_BUFFER = False
+VOTE_BUFFER_INTERVAL = 2.0
+VOTE_BUFFER_SIZE = 400
+
+# Threads the async views run their database work in, see posts.asynchronous
+ASYNC_DATABASE_THREADS = 8
+
+# Live score and comment count streams, see posts.live. LIVE_HISTORY should
+# cover the age of a cached page, and LIVE_SPOOL be set to a directory when
+# votes and streams are served by separate processes
+LIVE_TICK = 1.0
+LIVE_HISTORY = 120.0
+LIVE_MAX_POSTS = 100
+LIVE_SPOOL = None
+
+# Pick /r/random categories in proportion to their post counts, rather than
+# uniformly, see posts.sampling
+RANDOM_CATEGORY_WEIGHTED = False
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        "jeddit.instrumentation": {
+            "handlers": ["console"],
+            "level": "INFO",
+            "propagate": False,
+        },
+    },
+}
+
 ROOT_URLCONF = "jeddit.urls"
 
 TEMPLATES = [
@@ -92,9 +132,61 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": os.path.join(BASE_DIR, "db.sqlite3"),
-    }
+    },
+    # A stand-in replica, kept current by copyreplicas, unused until it's
+    # listed in DATABASE_REPLICAS
+    "replica": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.path.join(BASE_DIR, "db-replica.sqlite3"),
+        # Tests read the test primary through it rather than a copy
+        "TEST": {"MIRROR": "default"},
+    },
+}
+
+# Aliases of read replicas of the default database. The listing views read
+# from them, see posts.replicas, and jeddit.replica_settings turns one on
+DATABASE_REPLICAS = []
+DATABASE_ROUTERS = ["posts.replicas.ReplicaRouter"]
+
+# Seconds a visitor who wrote something reads from the primary afterwards
+REPLICA_PIN_SECONDS = 5
+
+
+# Caches
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "jeddit",
+    },
+    # Rendered post rows and comments, see posts/templatetags/fragments.py.
+    # Point this at memcached or redis to share them between processes.
+    "fragments": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "fragments",
+        "OPTIONS": {"MAX_ENTRIES": 20000},
+    },
+    # Category heads and home feeds, see posts.feeds, kept apart so pages
+    # and fragments don't push them out
+    "feeds": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "feeds",
+        "OPTIONS": {"MAX_ENTRIES": 20000},
+    },
 }
 
+FRAGMENT_CACHE = "fragments"
+FRAGMENT_TIMEOUT = 60
+
+FEED_CACHE = "feeds"
+
+# Whole pages served to logged out visitors, see posts.pagecache. Kept off
+# under DEBUG so the toolbar and template changes show up straight away.
+PAGE_CACHE = "default"
+PAGE_CACHE_TIMEOUT = 0 if DEBUG else 30
+PAGE_CACHE_STALE = 60
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
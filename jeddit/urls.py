@@ -3,7 +3,10 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
 
+from jeddit import instrumentation
+
 urlpatterns = [
+    path("admin/timings/", instrumentation.timings, name="timings"),
     path("admin/", admin.site.urls),
     path("accounts/", include("django.contrib.auth.urls")),
     path("", include("posts.urls")),
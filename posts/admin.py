@@ -1,6 +1,15 @@
 from django.contrib import admin
 
-from posts.models import Category, Comment, Favourite, Post, Subscription, Vote
+from posts.models import (
+    Category,
+    Comment,
+    CommentVote,
+    Karma,
+    Post,
+    PostFavourite,
+    PostVote,
+    Subscription,
+)
 
 
 @admin.register(Subscription)
@@ -8,19 +17,29 @@ class SubscriptionAdmin(admin.ModelAdmin):
     list_display = ("user", "category")
 
 
-@admin.register(Favourite)
-class FavouriteAdmin(admin.ModelAdmin):
-    list_display = ("user", "content_object")
+@admin.register(PostFavourite)
+class PostFavouriteAdmin(admin.ModelAdmin):
+    list_display = ("user", "post", "created_on")
+    raw_id_fields = ("user", "post")
 
 
-@admin.register(Vote)
+@admin.register(PostVote, CommentVote)
 class VoteAdmin(admin.ModelAdmin):
-    list_display = ("user", "content_object", "choice")
+    list_display = ("user", "target", "choice")
+    raw_id_fields = ("user", "target")
+
+
+@admin.register(Karma)
+class KarmaAdmin(admin.ModelAdmin):
+    list_display = ("user", "post_karma", "comment_karma", "total")
+    readonly_fields = ("post_karma", "comment_karma", "total")
 
 
 @admin.register(Comment)
 class CommentAdmin(admin.ModelAdmin):
     list_display = ("content", "post", "reply", "user")
+    # Kept by the vote and comment write paths, saves leave them alone
+    readonly_fields = Comment.COUNTER_FIELDS
 
 
 @admin.register(Category)
@@ -43,10 +62,12 @@ class PostAdmin(admin.ModelAdmin):
     exclude = ("user", "id")
 
     def get_readonly_fields(self, request, obj=None):
+        # Counters and ranks are kept by the write paths, saves leave them alone
         # If object is being viewed, show user as readonly
+        maintained = Post.COUNTER_FIELDS + Post.RANK_FIELDS
         if obj is not None:
-            return self.readonly_fields
-        return ()
+            return self.readonly_fields + maintained
+        return maintained
 
     def get_exclude(self, request, obj=None):
         # If post is being created don't exclude the user field
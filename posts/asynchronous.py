@@ -0,0 +1,94 @@
+"""Database access for the async views.
+
+Under ASGI the vote, save and comment views are coroutines, so a request
+waiting on the database doesn't hold a server thread. Django's ORM is still
+synchronous. ``run`` hands each unit of database work to a pool of
+``ASYNC_DATABASE_THREADS`` threads. The pool bounds how many requests use
+the database at once, and so how many connections the process opens,
+however many requests are in flight. Each pool thread keeps its own
+connection and closes it after every call, as the end of a request would,
+unless ``CONN_MAX_AGE`` says to keep it.
+
+``sync_to_async`` isn't used for this because its thread sensitive mode
+sends every call through a single thread, and otherwise it uses the event
+loop's default executor, which everything else in the process shares.
+
+The pool is only used once ``jeddit.asgi`` calls ``use_pool``. Under WSGI,
+and in the test client, Django runs each async view in its own event loop
+while the request's thread waits on it. ``run`` then uses ``sync_to_async``,
+which hands the work back to that thread, so it shares the request's
+connection and transaction.
+
+Django's ``login_required`` can't wrap a coroutine, so the async views use
+the one here.
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.db import close_old_connections
+
+executor = None
+executor_lock = threading.Lock()
+pooled = False
+
+
+def use_pool(enabled=True):
+    """Run database work in the pool, for servers that run views as coroutines.
+
+    Returns whether it was used before, so callers can restore that.
+    """
+    global pooled
+    previous, pooled = pooled, enabled
+    return previous
+
+
+def get_executor():
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "ASYNC_DATABASE_THREADS", 8),
+                thread_name_prefix="database",
+            )
+    return executor
+
+
+def call(func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run(func, *args, **kwargs):
+    """Call ``func`` in the database pool, or the request's thread outside ASGI."""
+    if not pooled:
+        return await sync_to_async(func)(*args, **kwargs)
+    # Carries the request's context variables, like its sampled timings
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        get_executor(), context.run, call, func, args, kwargs
+    )
+
+
+def is_authenticated(request):
+    # The first access loads the session and user from the database
+    return request.user.is_authenticated
+
+
+def login_required(view):
+    """Send logged out visitors of an async ``view`` to the login page."""
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not await run(is_authenticated, request):
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,349 @@
+"""View benchmarks against generated datasets.
+
+Each scenario requests one view through the test client as a logged in
+user. It records the latency percentiles over repeated requests, and from
+one further request each the SQL query count, the rows fetched from the
+database cursor and the peak memory traced by ``tracemalloc``. Scenarios
+declare a query budget. A view whose query count grows with the size of the
+dataset, like an N+1 over the rows of a page, breaks it on the larger
+datasets.
+
+Requests run after ``warmup`` untimed ones, so cached feeds and heads are
+measured warm.
+
+``throughput`` compares the request handlers instead: it keeps a number of
+vote requests in flight and records the requests served per second by each
+handler. Through the WSGI handler they come from as many threads, each
+doing its database work on its own thread. Through the ASGI handler they
+come from as many coroutines on one event loop, with the database work in
+the ``posts.asynchronous`` pool, as ``jeddit.asgi`` deploys it.
+"""
+import asyncio
+import math
+import queue
+import time
+import tracemalloc
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db.backends.utils import CursorWrapper
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+from posts import asynchronous, votebuffer
+from posts.models import Category, Comment, Post
+
+# Arguments for the generate command, by dataset name
+SIZES = {
+    "small": dict(
+        users=200,
+        categories=10,
+        posts=1000,
+        comments=5000,
+        votes=20000,
+        favourites=1000,
+        subscriptions=1000,
+    ),
+    "medium": dict(
+        users=2000,
+        categories=50,
+        posts=10000,
+        comments=50000,
+        votes=200000,
+        favourites=10000,
+        subscriptions=10000,
+    ),
+    "large": dict(
+        users=20000,
+        categories=200,
+        posts=100000,
+        comments=500000,
+        votes=2000000,
+        favourites=100000,
+        subscriptions=100000,
+    ),
+}
+
+# ``reset`` is requested untimed after each run, to undo what it changed
+Scenario = namedtuple("Scenario", "name url budget reset")
+
+
+def vote_url(name, pk):
+    # The vote views send the voter back to ``next``
+    return f"{reverse(name, args=[pk])}?next=/"
+
+
+def scenarios(viewer):
+    """Every benchmarked view, aimed at the busiest parts of the dataset."""
+    category = Category.objects.order_by("-post_count", "pk").first()
+    post = Post.objects.order_by("-comment_count", "pk").first()
+    comment = Comment.objects.filter(post=post).order_by("-score", "pk").first()
+    found = [
+        Scenario("index", reverse("posts:index"), 6, None),
+        Scenario("top_week", f"{reverse('posts:index')}?t=week", 6, None),
+        Scenario("user_feed", reverse("posts:user_feed"), 6, None),
+        Scenario("user_list", reverse("posts:user_list"), 5, None),
+        Scenario(
+            "user_detail",
+            reverse("posts:user_detail", args=[viewer.username]),
+            9,
+            None,
+        ),
+    ]
+    if category is not None:
+        found.append(
+            Scenario(
+                "category_detail",
+                reverse("posts:category_detail", args=[category.slug]),
+                7,
+                None,
+            )
+        )
+    if post is not None:
+        found += [
+            Scenario(
+                "post_detail",
+                reverse("posts:post_detail", args=[post.pk, post.slug]),
+                9,
+                None,
+            ),
+            Scenario(
+                "upvote_post",
+                vote_url("posts:upvote_post", post.pk),
+                11,
+                vote_url("posts:unvote_post", post.pk),
+            ),
+        ]
+    if comment is not None:
+        found.append(
+            Scenario(
+                "upvote_comment",
+                vote_url("posts:upvote_comment", comment.pk),
+                9,
+                vote_url("posts:unvote_comment", comment.pk),
+            )
+        )
+    return found
+
+
+class RowCounter:
+    """Counts the rows fetched through Django's database cursors.
+
+    ``CursorWrapper`` hands fetches straight to the driver's cursor through
+    ``__getattr__``, so defining them on the class intercepts every one.
+    """
+
+    METHODS = ("fetchone", "fetchmany", "fetchall")
+
+    def __init__(self):
+        self.rows = 0
+
+    def __enter__(self):
+        counter = self
+
+        def fetchone(cursor):
+            row = cursor.cursor.fetchone()
+            counter.rows += row is not None
+            return row
+
+        def fetchmany(cursor, *args, **kwargs):
+            rows = cursor.cursor.fetchmany(*args, **kwargs)
+            counter.rows += len(rows)
+            return rows
+
+        def fetchall(cursor):
+            rows = cursor.cursor.fetchall()
+            counter.rows += len(rows)
+            return rows
+
+        for method in (fetchone, fetchmany, fetchall):
+            setattr(CursorWrapper, method.__name__, method)
+        return self
+
+    def __exit__(self, *exc_info):
+        for name in self.METHODS:
+            delattr(CursorWrapper, name)
+
+
+class QueryCounter:
+    """Counts the queries run through Django's database cursors.
+
+    Unlike the query log of one connection, this also counts the queries
+    the async views run on the connections of the database pool's threads.
+    """
+
+    METHODS = ("execute", "executemany")
+
+    def __init__(self):
+        self.queries = 0
+        self.originals = {}
+
+    def __enter__(self):
+        counter = self
+        for name in self.METHODS:
+            original = self.originals[name] = getattr(CursorWrapper, name)
+
+            def counted(cursor, *args, original=original, **kwargs):
+                counter.queries += 1
+                return original(cursor, *args, **kwargs)
+
+            setattr(CursorWrapper, name, counted)
+        return self
+
+    def __exit__(self, *exc_info):
+        for name, original in self.originals.items():
+            setattr(CursorWrapper, name, original)
+
+
+def percentile(values, percent):
+    """Nearest rank percentile of ``values``."""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def request(client, scenario):
+    response = client.get(scenario.url)
+    if response.status_code >= 400:
+        raise BenchmarkError(f"{scenario.name} returned {response.status_code}")
+    if scenario.reset:
+        client.get(scenario.reset)
+    return response
+
+
+def run(viewer, repeat=20, warmup=2):
+    """Benchmark every scenario as ``viewer``, returning one result each."""
+    # Outside INTERNAL_IPS so the debug toolbar stays out of the measurements
+    client = Client(REMOTE_ADDR="10.0.0.1")
+    client.force_login(viewer)
+    results = []
+    for scenario in scenarios(viewer):
+        for _ in range(warmup):
+            request(client, scenario)
+
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            client.get(scenario.url)
+            timings.append(time.perf_counter() - started)
+            if scenario.reset:
+                client.get(scenario.reset)
+
+        with QueryCounter() as queries, RowCounter() as counter:
+            client.get(scenario.url)
+        if scenario.reset:
+            client.get(scenario.reset)
+
+        tracemalloc.start()
+        try:
+            client.get(scenario.url)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        if scenario.reset:
+            client.get(scenario.reset)
+
+        results.append(
+            {
+                "view": scenario.name,
+                "url": scenario.url,
+                "p50_ms": round(percentile(timings, 50) * 1000, 2),
+                "p95_ms": round(percentile(timings, 95) * 1000, 2),
+                "queries": queries.queries,
+                "budget": scenario.budget,
+                "rows": counter.rows,
+                "peak_kib": round(peak / 1024, 1),
+            }
+        )
+    return results
+
+
+def through_wsgi(clients, urls):
+    idle = queue.Queue()
+    for client in clients:
+        idle.put(client)
+
+    def get(url):
+        client = idle.get()
+        try:
+            return client.get(url).status_code
+        finally:
+            idle.put(client)
+
+    with ThreadPoolExecutor(len(clients)) as pool:
+        return list(pool.map(get, urls))
+
+
+def through_asgi(clients, urls):
+    async def get(idle, url):
+        client = await idle.get()
+        try:
+            return (await client.get(url)).status_code
+        finally:
+            idle.put_nowait(client)
+
+    async def serve():
+        idle = asyncio.Queue()
+        for client in clients:
+            idle.put_nowait(client)
+        return await asyncio.gather(*(get(idle, url) for url in urls))
+
+    return asyncio.run(serve())
+
+
+def throughput(viewer, requests=200, concurrency=20):
+    """Vote requests per second served through WSGI and through ASGI.
+
+    Each request upvotes or unvotes one of the ``concurrency`` top posts.
+    The vote buffer is on, so that what's measured is the handlers rather
+    than how many writers the database lets in at once. SQLite lets in one.
+    """
+    posts = list(
+        Post.objects.order_by("-score", "pk").values_list("pk", flat=True)[:concurrency]
+    )
+    if not posts:
+        return []
+    urls = [
+        vote_url(
+            "posts:unvote_post" if number % 2 else "posts:upvote_post",
+            posts[number // 2 % len(posts)],
+        )
+        for number in range(requests)
+    ]
+    resetter = Client(REMOTE_ADDR="10.0.0.1")
+    resetter.force_login(viewer)
+    results = []
+    for interface, client_class, serve, pooled in (
+        ("wsgi", Client, through_wsgi, False),
+        ("asgi", AsyncClient, through_asgi, True),
+    ):
+        clients = [client_class(REMOTE_ADDR="10.0.0.1") for _ in range(concurrency)]
+        for client in clients:
+            client.force_login(viewer)
+        previous = asynchronous.use_pool(pooled)
+        try:
+            with override_settings(VOTE_BUFFER=True):
+                started = time.perf_counter()
+                statuses = serve(clients, urls)
+                elapsed = time.perf_counter() - started
+                votebuffer.get_buffer().flush()
+        finally:
+            asynchronous.use_pool(previous)
+        # Served out of order, the upvotes and unvotes may not have cancelled
+        for post in posts:
+            resetter.get(vote_url("posts:unvote_post", post))
+        failed = sum(status >= 400 for status in statuses)
+        if failed:
+            raise BenchmarkError(f"{failed} {interface} vote requests failed")
+        results.append(
+            {
+                "interface": interface,
+                "requests": len(urls),
+                "concurrency": concurrency,
+                "requests_per_second": round(len(urls) / elapsed, 1),
+            }
+        )
+    return results
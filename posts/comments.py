@@ -0,0 +1,107 @@
+"""Loads a post's comment thread in one query and assembles it in Python.
+
+Templates render the returned tree by walking ``comment.children``, so they
+never touch the ORM. Every rendered comment also carries the viewer's vote,
+see ``posts.viewer``.
+
+Two kinds of "load more" stub cut the tree down to size. A comment with more
+than ``breadth`` replies keeps the first ``breadth`` and counts the rest in
+``more_replies``. A comment at ``depth`` levels keeps no children and sets
+``continue_thread`` if it has any.
+"""
+import math
+from collections import defaultdict
+
+from posts.models import Comment
+from posts.viewer import attach_viewer_state
+
+DEFAULT_DEPTH = 8
+DEFAULT_BREADTH = 20
+
+
+def confidence(upvotes, downvotes, z=1.281551565545):
+    """Lower bound of the Wilson score interval on the upvote ratio."""
+    total = upvotes + downvotes
+    if total == 0:
+        return 0
+    ratio = upvotes / total
+    return (
+        ratio
+        + z * z / (2 * total)
+        - z * math.sqrt((ratio * (1 - ratio) + z * z / (4 * total)) / total)
+    ) / (1 + z * z / total)
+
+
+SORTS = {
+    "best": lambda c: (confidence(c.upvotes, c.downvotes), c.created_on),
+    "top": lambda c: (c.score, c.created_on),
+    "new": lambda c: c.created_on,
+}
+
+
+class CommentTree:
+    def __init__(self, comments, more_replies, root=None):
+        self.comments = comments
+        self.more_replies = more_replies
+        self.root = root
+
+    def __iter__(self):
+        return iter(self.comments)
+
+    def __len__(self):
+        return len(self.comments)
+
+
+def load_comment_tree(
+    post,
+    user=None,
+    sort="best",
+    root=None,
+    depth=DEFAULT_DEPTH,
+    breadth=DEFAULT_BREADTH,
+):
+    """Build ``post``'s comment tree, or the subtree below the ``root`` comment.
+
+    A subtree is fetched with one range query over the comments' materialised
+    paths, so permalinks deep into a large thread only load what they show.
+    """
+    thread = Comment.objects.filter(post=post)
+    if root is not None:
+        thread = thread.get(pk=root).subtree()
+    comments = thread.select_related("user")
+
+    replies = defaultdict(list)
+    by_id = {}
+    for comment in comments:
+        comment.children = []
+        comment.more_replies = 0
+        comment.continue_thread = False
+        comment.post = post
+        replies[comment.reply_id].append(comment)
+        by_id[comment.pk] = comment
+
+    key = SORTS.get(sort, SORTS["best"])
+    for siblings in replies.values():
+        siblings.sort(key=key, reverse=True)
+
+    top = replies[None]
+    if root is not None:
+        root = by_id[root]
+        top = [root]
+
+    level = [(comment, 1) for comment in top[:breadth]]
+    shown = []
+    while level:
+        comment, current = level.pop()
+        shown.append(comment)
+        children = replies.get(comment.pk, ())
+        if current >= depth:
+            comment.continue_thread = bool(children)
+            continue
+        comment.children = children[:breadth]
+        comment.more_replies = max(len(children) - breadth, 0)
+        level.extend((child, current + 1) for child in comment.children)
+
+    # Only the comments that get rendered need the viewer's votes
+    attach_viewer_state(user, shown)
+    return CommentTree(top[:breadth], max(len(top) - breadth, 0), root)
@@ -0,0 +1,178 @@
+"""Cached home feeds built by merging per-category rankings.
+
+Every category keeps a cached head: the ordering keys of its top
+``HEAD_LENGTH`` posts for a sort. A user's feed is a k-way merge of the heads
+of the categories they subscribe to. The merged keys are cached per user and
+sort, up to ``FEED_LENGTH`` entries. Once that is built, serving a page is a
+binary search over the cached keys plus one primary key lookup for the page's
+posts, whatever the number of subscriptions. Readers paging past the cached
+entries fall back to the keyset paginated database query.
+
+Every category has a generation, a random string cached under its own key,
+which its heads' keys include. A new post starts a new generation of its
+category, so its heads are rebuilt on their next read, and the old ones
+expire. Feeds remember the generations they were merged from and are
+rebuilt once any of those has moved on, so a new post costs one cache write
+however many subscribers its category has. Subscribing or unsubscribing
+drops the user's feeds. Score changes only reorder feeds once they expire
+after ``FEED_TIMEOUT``.
+
+Heads and feeds live in the ``FEED_CACHE`` cache.
+"""
+import heapq
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+from posts import ranking
+from posts.models import Post
+from posts.pagination import CursorPage, CursorPaginator, InvalidCursor, link_page
+
+HEAD_LENGTH = 200
+FEED_LENGTH = 1000
+FEED_TIMEOUT = 300
+
+
+def get_cache():
+    return caches[getattr(settings, "FEED_CACHE", "default")]
+
+
+def generation_key(category_id):
+    return f"feed-generation:{category_id}"
+
+
+def head_key(category_id, generation, sort):
+    return f"feed-head:{category_id}:{generation}:{sort}"
+
+
+def feed_key(user_id, sort):
+    return f"feed:{user_id}:{sort}"
+
+
+def feed_queryset(user, sort):
+    posts = Post.objects.select_related("user", "category").filter(
+        category__in=user.subscriptions.values("category")
+    )
+    return ranking.order(posts, sort)
+
+
+def key_fields(paginator):
+    return [field.lstrip("-") for field in paginator.ordering]
+
+
+def generations(category_ids):
+    """The current generation of each category, starting any that are missing."""
+    cache = get_cache()
+    keys = {generation_key(category_id): category_id for category_id in category_ids}
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        # Added rather than set, a new post's generation mustn't be overwritten
+        for key in missing:
+            cache.add(key, uuid.uuid4().hex, None)
+        found.update(cache.get_many(missing))
+    return {keys[key]: generation for key, generation in found.items()}
+
+
+def category_heads(generations, sort, fields):
+    """The cached head of each category, loading any that are missing."""
+    cache = get_cache()
+    keys = {
+        head_key(category_id, generation, sort): category_id
+        for category_id, generation in generations.items()
+    }
+    heads = cache.get_many(keys)
+    missing = {}
+    for key, category_id in keys.items():
+        if key not in heads:
+            posts = ranking.order(Post.objects.filter(category_id=category_id), sort)
+            missing[key] = list(
+                posts.order_by(*posts.query.order_by, "-pk").values_list(*fields)[
+                    :HEAD_LENGTH
+                ]
+            )
+    cache.set_many(missing, FEED_TIMEOUT)
+    heads.update(missing)
+    return heads.values()
+
+
+def build(user, sort, fields):
+    """Merge the user's category heads into their feed's ordering keys.
+
+    Returns the keys, whether they are the whole feed and the generations
+    of the categories they came from. Past the last key of a truncated head
+    the merge can't tell what comes next, so the feed stops there.
+    """
+    merged = generations(user.subscriptions.values_list("category_id", flat=True))
+    heads = list(category_heads(merged, sort, fields))
+    truncated = [head[-1] for head in heads if len(head) == HEAD_LENGTH]
+    floor = max(truncated) if truncated else None
+
+    entries = []
+    for entry in heapq.merge(*heads, reverse=True):
+        if len(entries) == FEED_LENGTH or (floor is not None and entry < floor):
+            return entries, False, merged
+        entries.append(entry)
+    return entries, not truncated, merged
+
+
+def position(entries, key):
+    """Index of the first of the descending ``entries`` that sorts below ``key``."""
+    low, high = 0, len(entries)
+    while low < high:
+        middle = (low + high) // 2
+        if entries[middle] < key:
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+
+def page(request, sort, per_page=50):
+    """The requested page of ``request.user``'s home feed for ``sort``."""
+    user = request.user
+    paginator = CursorPaginator(feed_queryset(user, sort), per_page)
+    fields = key_fields(paginator)
+
+    cache = get_cache()
+    key = feed_key(user.pk, sort)
+    feed = cache.get(key)
+    if feed is None or generations(feed[2]) != feed[2]:
+        feed = build(user, sort, fields)
+        cache.set(key, feed, FEED_TIMEOUT)
+    entries, complete, _ = feed
+
+    cursor = request.GET.get("after")
+    try:
+        start = position(entries, tuple(paginator.decode(cursor))) if cursor else 0
+    except InvalidCursor:
+        cursor, start = None, 0
+
+    if start >= len(entries) and not complete:
+        return link_page(request, paginator.get_page(cursor))
+
+    window = entries[start : start + per_page]
+    posts = Post.objects.select_related("user", "category").in_bulk(
+        [entry[-1] for entry in window]
+    )
+    has_next = start + per_page < len(entries) or not complete
+    next_cursor = (
+        paginator.encode(dict(zip(fields, window[-1]))) if has_next and window else None
+    )
+    result = CursorPage(
+        [posts[entry[-1]] for entry in window if entry[-1] in posts],
+        has_next and bool(window),
+        next_cursor,
+        bool(cursor),
+    )
+    return link_page(request, result)
+
+
+def invalidate_user(user_id):
+    get_cache().delete_many([feed_key(user_id, sort) for sort in ranking.SORTS])
+
+
+def invalidate_category(category_id):
+    """Start a new generation of a category's heads, and so of its feeds."""
+    get_cache().set(generation_key(category_id), uuid.uuid4().hex, None)
@@ -0,0 +1,342 @@
+"""Bulk loading of scraped posts.
+
+Records are read as a stream and written in batches. Each batch resolves its
+users and categories through name to id maps, filled by one bulk query per
+batch for names not seen before, instead of looking every record up. Users
+and categories are upserted with ``ignore_conflicts`` and posts are deduped
+by link, so loading the same data twice adds nothing. The post and comment
+counts of the batch's categories, users and threads are added with one
+statement each.
+
+Comment records are attached to posts and comments loaded earlier by the
+same ``Ingester``, by the scraper's ids. Their paths are handed out from
+in-memory reply counters rather than through ``Comment.save``, so a thread
+of any size is written with one insert per batch. Comments on posts that
+were already in the database are skipped along with their posts. Only the
+``max_threads`` posts and comments most recently added or replied to are
+remembered, replies to older ones are skipped too.
+"""
+import json
+import re
+import time
+from collections import OrderedDict
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from posts import feeds, ranking, sampling, search
+from posts.models import Category, Comment, Karma, Post, add_in_bulk, encode_segment
+from posts.viewer import CHUNK_SIZE, chunked
+
+READ_SIZE = 1 << 16
+
+# Posts and comments an ingester keeps the reply counters of
+MAX_THREADS = 100000
+SEPARATORS = re.compile(r"[\s\[\],]*")
+
+
+def iter_records(infile, read_size=READ_SIZE):
+    """Yield the objects of a JSON array or a JSON lines file as they're read.
+
+    Only the current record and one read buffer are held in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+    while True:
+        # Skip anything between records: whitespace, array brackets and commas
+        position = SEPARATORS.match(buffer, position).end()
+        if position == len(buffer):
+            if eof:
+                return
+            buffer, position = infile.read(read_size), 0
+            eof = not buffer
+            continue
+        try:
+            record, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # The record is split across reads, fetch the rest of it
+            chunk = infile.read(read_size)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        yield record
+
+
+class Thread:
+    """Where the next reply to an ingested post or comment goes."""
+
+    __slots__ = ("post_id", "comment_id", "path", "depth", "replies")
+
+    def __init__(self, post_id, comment_id=None, path="", depth=-1):
+        self.post_id = post_id
+        self.comment_id = comment_id
+        self.path = path
+        self.depth = depth
+        self.replies = 0
+
+
+class Ingester:
+    """Buffers post and comment records and writes them in batches.
+
+    Post records use the scraper's field names: ``title``, ``href``,
+    ``username``, ``subreddit`` and optionally ``id`` and ``body``. Records
+    without a user or subreddit fall back to ``default_user`` and
+    ``default_category`` and are skipped if those aren't given either.
+
+    Comment records have ``type: "comment"``, their own ``id``, the ``post``
+    and ``parent`` ids they belong under, a ``username`` and ``content``.
+    They must come after their parent, as the spider yields them.
+    """
+
+    def __init__(
+        self,
+        batch_size=1000,
+        default_user=None,
+        default_category=None,
+        max_threads=MAX_THREADS,
+    ):
+        self.batch_size = batch_size
+        self.default_user = default_user
+        self.default_category = default_category
+        self.max_threads = max_threads
+        self.users = {}
+        self.categories = {}
+        self.pending = []
+        # Least recently used first
+        self.threads = OrderedDict()
+        self.created = 0
+        self.comments = 0
+        self.duplicates = 0
+        self.skipped = 0
+        self.started = time.monotonic()
+
+    @property
+    def rate(self):
+        return self.created / max(time.monotonic() - self.started, 1e-9)
+
+    def add(self, record):
+        """Queue a record, returns True when that filled and flushed a batch."""
+        username = record.get("username") or self.default_user
+        if record.get("type") == "comment":
+            category = None
+            valid = username and record.get("parent") and record.get("id")
+        else:
+            category = record.get("subreddit") or self.default_category
+            valid = username and category and record.get("title")
+        if not valid:
+            self.skipped += 1
+            return False
+        self.pending.append((username, category, record))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+            return True
+        return False
+
+    def resolve(self, cache, model, field, names, build):
+        """Fill ``cache`` with ids for ``names``, creating whatever's missing.
+
+        Returns the ids added to ``cache``, some may have existed already.
+        """
+        missing = {name for name in names if name not in cache}
+        if not missing:
+            return []
+        model.objects.bulk_create(
+            [build(name) for name in missing], ignore_conflicts=True
+        )
+        found = dict(
+            model.objects.filter(**{f"{field}__in": missing}).values_list(field, "pk")
+        )
+        cache.update(found)
+        return list(found.values())
+
+    def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        with transaction.atomic():
+            users = self.resolve(
+                self.users,
+                User,
+                "username",
+                {username for username, _, _ in batch},
+                lambda name: User(username=name, password=make_password(None)),
+            )
+            # Bulk inserts skip the signal that gives users their karma record
+            Karma.objects.bulk_create(
+                [Karma(user_id=pk) for pk in users], ignore_conflicts=True
+            )
+            known = len(self.categories)
+            self.resolve(
+                self.categories,
+                Category,
+                "name",
+                {category for _, category, _ in batch if category},
+                lambda name: Category(name=name, slug=slugify(name)),
+            )
+            if len(self.categories) > known:
+                # Some may have existed already, reloading for them is harmless
+                transaction.on_commit(sampling.changed)
+            posts = self.build_posts([entry for entry in batch if entry[1]])
+            Post.objects.bulk_create(posts)
+            comments, replied = self.build_comments(
+                [entry for entry in batch if not entry[1]]
+            )
+            Comment.objects.bulk_create(comments)
+            self.update_threads(comments, replied)
+            search.index(posts + comments)
+
+            added = {}
+            for post in posts:
+                added.setdefault(post.category_id, [0])[0] += 1
+            add_in_bulk(Category, ["post_count"], added)
+            # Every user resolved above has their karma record by now
+            made = {}
+            for post in posts:
+                made.setdefault(post.user_id, [0, 0])[0] += 1
+            for comment in comments:
+                made.setdefault(comment.user_id, [0, 0])[1] += 1
+            add_in_bulk(Karma, ["post_count", "comment_count"], made)
+            transaction.on_commit(lambda: self.invalidate(added))
+        self.created += len(posts)
+        self.comments += len(comments)
+
+    def build_posts(self, batch):
+        now = timezone.now()
+        posts = {}
+        sources = {}
+        for username, category, record in batch:
+            title = record["title"][:200]
+            post = Post(
+                title=title,
+                slug=slugify(title)[:50],
+                body=record.get("body") or "",
+                link=record.get("href") or record.get("link") or "",
+                user_id=self.users[username],
+                category_id=self.categories[category],
+                created_on=now,
+                updated_on=now,
+                **ranking.ranks(0, 0, 0, now, now),
+            )
+            key = self.dedupe_key(post)
+            if key in posts:
+                self.duplicates += 1
+            else:
+                posts[key] = post
+                sources[key] = record.get("id")
+
+        # Drop the posts that are already in the database
+        existing = set()
+        links = [post.link for post in posts.values() if post.link]
+        for chunk in chunked(links):
+            existing.update(Post.objects.filter(link__in=chunk).values_list("link"))
+        unlinked = [post for post in posts.values() if not post.link]
+        # Each post binds its category and its title
+        for chunk in chunked(unlinked, CHUNK_SIZE // 2):
+            existing.update(
+                Post.objects.filter(
+                    category_id__in={post.category_id for post in chunk},
+                    title__in={post.title for post in chunk},
+                ).values_list("category_id", "title")
+            )
+        fresh = []
+        for key, post in posts.items():
+            if key in existing:
+                self.duplicates += 1
+                continue
+            if not post.link:
+                # Post.save would link a post to itself, but bulk_create skips it
+                post.link = post.get_absolute_url()
+            if sources[key]:
+                self.remember(sources[key], Thread(post.pk))
+            fresh.append(post)
+        return fresh
+
+    def build_comments(self, batch):
+        """Comments to insert and the threads they reply to, by post or comment."""
+        now = timezone.now()
+        comments = []
+        replied = {}
+        max_depth = Comment.max_depth()
+        for username, _, record in batch:
+            parent = self.threads.get(record["parent"])
+            if record["id"] in self.threads:
+                self.duplicates += 1
+                continue
+            if parent is None or parent.depth + 1 >= max_depth:
+                self.skipped += 1
+                continue
+            self.threads.move_to_end(record["parent"])
+            parent.replies += 1
+            comment = Comment(
+                content=(record.get("content") or "")[:2000],
+                post_id=parent.post_id,
+                reply_id=parent.comment_id,
+                user_id=self.users[username],
+                path=parent.path
+                + encode_segment(parent.replies, Comment.SEGMENT_WIDTH),
+                depth=parent.depth + 1,
+                created_on=now,
+                updated_on=now,
+            )
+            self.remember(
+                record["id"],
+                Thread(parent.post_id, comment.pk, comment.path, comment.depth),
+            )
+            replied[parent.comment_id or parent.post_id] = parent
+            comments.append(comment)
+        return comments, replied
+
+    def remember(self, source_id, thread):
+        self.threads[source_id] = thread
+        if len(self.threads) > self.max_threads:
+            # Forget whatever has gone longest without a reply
+            self.threads.popitem(last=False)
+
+    @staticmethod
+    def update_threads(comments, replied):
+        """Bring the reply counters of everything replied to up to date.
+
+        Ingested threads are assumed not to be replied to through the site
+        while they load, so the sequences are set to this ingester's totals.
+        """
+        added = {}
+        for comment in comments:
+            added.setdefault(comment.post_id, [0])[0] += 1
+        add_in_bulk(Post, ["comment_count"], added)
+        Post.objects.bulk_update(
+            [
+                Post(pk=thread.post_id, reply_sequence=thread.replies)
+                for thread in replied.values()
+                if not thread.comment_id
+            ],
+            ["reply_sequence"],
+        )
+        Comment.objects.bulk_update(
+            [
+                Comment(
+                    pk=thread.comment_id,
+                    comment_count=thread.replies,
+                    reply_sequence=thread.replies,
+                )
+                for thread in replied.values()
+                if thread.comment_id
+            ],
+            ["comment_count", "reply_sequence"],
+        )
+
+    @staticmethod
+    def dedupe_key(post):
+        # Without a link a post is identified by its title within its category
+        return (post.link,) if post.link else (post.category_id, post.title)
+
+    @staticmethod
+    def invalidate(added):
+        for category_id in added:
+            feeds.invalidate_category(category_id)
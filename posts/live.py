@@ -0,0 +1,327 @@
+"""Live score and comment count updates, streamed as server-sent events.
+
+Pages list their posts' ids, and ``static/js/live.js`` opens an
+``EventSource`` on ``PATH`` for them. The stream is served by ``stream``, a
+plain ASGI app that ``jeddit.asgi`` routes to ahead of Django, since Django
+can't hold a response open without holding a thread with it.
+
+The vote and comment write paths ``publish`` the change they make to a
+post's score or comment count once their transaction commits. Every
+``LIVE_TICK`` seconds the broker collects what was published, sums it per
+post, and hands each subscriber the sums for its posts as one message. A
+post voted on a thousand times in a tick still costs its watchers one
+message.
+
+Each subscriber says when the page it watches for was rendered. Changes
+published since are replayed from the last ``LIVE_HISTORY`` seconds, and
+changes published earlier, which the page already shows, are skipped. Every
+message carries the time it's current to as its event id, which browsers
+send back when they reconnect.
+
+By default the broker only hears changes made in its own process. With
+``LIVE_SPOOL`` set to a directory, changes are appended to a file there per
+minute instead, and the broker of every process reads them back, a stand-in
+for a real message broker when writes and streams are served by separate
+processes on one machine.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.db import transaction
+
+PATH = "/live"
+
+# Seconds between messages to an otherwise idle stream
+KEEPALIVE = 15
+
+# Minutes of spool files kept, older ones are deleted by the writers
+SPOOL_RETENTION = 5
+
+
+class Subscriber:
+    def __init__(self, post_ids, since):
+        self.post_ids = post_ids
+        self.since = since
+        # The time everything sent so far is current to
+        self.mark = since
+        self.deltas = {}
+        self.ready = asyncio.Event()
+
+    def add(self, post_id, score, comments):
+        delta = self.deltas.setdefault(post_id, [0, 0])
+        delta[0] += score
+        delta[1] += comments
+        self.ready.set()
+
+    def take(self):
+        """The changes added since the last call, and the time they're current to."""
+        deltas, self.deltas = self.deltas, {}
+        self.ready.clear()
+        return (
+            {
+                post_id: {"score": score, "comments": comments}
+                for post_id, (score, comments) in deltas.items()
+                if score or comments
+            },
+            self.mark,
+        )
+
+
+class Broker:
+    """Coalesces the changes published in this process for its subscribers."""
+
+    def __init__(self, tick=1.0, history=120.0):
+        self.tick = tick
+        self.history = history
+        self.lock = threading.Lock()
+        # ``(time, post_id, score, comments)`` published since the last tick
+        self.pending = []
+        # Dispatched changes, replayed to subscribers catching up
+        self.recent = deque()
+        self.dispatched = 0.0
+        self.subscribers = defaultdict(set)
+        self.loop = None
+
+    def publish(self, post_id, score=0, comments=0):
+        # Until something has subscribed, nothing will collect them
+        if self.loop is None:
+            return
+        with self.lock:
+            self.pending.append((time.time(), post_id, score, comments))
+
+    def collect(self):
+        with self.lock:
+            events, self.pending = self.pending, []
+        return events
+
+    def subscribe(self, post_ids, since):
+        """Start sending ``post_ids``' changes published after ``since``."""
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            loop.create_task(self.run())
+        subscriber = Subscriber(post_ids, since)
+        for event_time, post_id, score, comments in self.recent:
+            if event_time > since and post_id in post_ids:
+                subscriber.add(post_id, score, comments)
+        subscriber.mark = max(since, self.dispatched)
+        for post_id in post_ids:
+            self.subscribers[post_id].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        for post_id in subscriber.post_ids:
+            watchers = self.subscribers.get(post_id)
+            if watchers is not None:
+                watchers.discard(subscriber)
+                if not watchers:
+                    del self.subscribers[post_id]
+
+    async def run(self):
+        loop = self.loop
+        while self.loop is loop:
+            await asyncio.sleep(self.tick)
+            self.dispatch(self.collect())
+
+    def dispatch(self, events):
+        now = time.time()
+        self.dispatched = now
+        self.recent.extend(events)
+        while self.recent and self.recent[0][0] < now - self.history:
+            self.recent.popleft()
+
+        by_post = defaultdict(list)
+        for event in events:
+            if event[1] in self.subscribers:
+                by_post[event[1]].append(event)
+        for post_id, post_events in by_post.items():
+            earliest = min(event[0] for event in post_events)
+            score = sum(event[2] for event in post_events)
+            comments = sum(event[3] for event in post_events)
+            for subscriber in self.subscribers[post_id]:
+                if subscriber.since < earliest:
+                    subscriber.add(post_id, score, comments)
+                    continue
+                # Only a page rendered during the tick sees some of them already
+                for event_time, _, event_score, event_comments in post_events:
+                    if event_time > subscriber.since:
+                        subscriber.add(post_id, event_score, event_comments)
+        for watchers in self.subscribers.values():
+            for subscriber in watchers:
+                subscriber.mark = now
+
+
+class SpoolBroker(Broker):
+    """Shares the changes of every process through files in ``directory``."""
+
+    def __init__(self, directory, **kwargs):
+        super().__init__(**kwargs)
+        self.directory = directory
+        self.writing = None
+        self.reading = None
+        self.offset = 0
+
+    def path(self, minute):
+        return os.path.join(self.directory, f"live-{minute}.jsonl")
+
+    def publish(self, post_id, score=0, comments=0):
+        now = time.time()
+        minute = int(now // 60)
+        if minute != self.writing:
+            self.writing = minute
+            self.prune(minute)
+        # Appends this short land whole, whichever process makes them
+        with open(self.path(minute), "a") as spool:
+            spool.write(json.dumps([now, post_id, score, comments]) + "\n")
+
+    def prune(self, minute):
+        for name in os.listdir(self.directory):
+            if not (name.startswith("live-") and name.endswith(".jsonl")):
+                continue
+            try:
+                if int(name[5:-6]) < minute - SPOOL_RETENTION:
+                    os.remove(os.path.join(self.directory, name))
+            except (ValueError, OSError):
+                pass
+
+    def collect(self):
+        now = time.time()
+        minute = int(now // 60)
+        if self.reading is None:
+            # Starting back far enough to replay to the first subscribers
+            self.reading = int((now - self.history) // 60)
+        events = self.read(self.reading)
+        while self.reading < minute:
+            self.reading += 1
+            self.offset = 0
+            events += self.read(self.reading)
+        return events
+
+    def read(self, minute):
+        try:
+            with open(self.path(minute), "rb") as spool:
+                spool.seek(self.offset)
+                data = spool.read()
+        except FileNotFoundError:
+            return []
+        # A line still being written is read whole on the next tick
+        data = data[: data.rfind(b"\n") + 1]
+        self.offset += len(data)
+        return [tuple(json.loads(line)) for line in data.splitlines()]
+
+
+broker = None
+broker_lock = threading.Lock()
+
+
+def get_broker():
+    global broker
+    if broker is None:
+        with broker_lock:
+            if broker is None:
+                options = dict(
+                    tick=getattr(settings, "LIVE_TICK", 1.0),
+                    history=getattr(settings, "LIVE_HISTORY", 120.0),
+                )
+                spool = getattr(settings, "LIVE_SPOOL", None)
+                if spool:
+                    os.makedirs(spool, exist_ok=True)
+                    broker = SpoolBroker(spool, **options)
+                else:
+                    broker = Broker(**options)
+    return broker
+
+
+def publish(post_id, score=0, comments=0):
+    """Send a change to a post's counters to its watchers, once committed."""
+    if not score and not comments:
+        return
+    post_id = str(post_id)
+    transaction.on_commit(lambda: get_broker().publish(post_id, score, comments))
+
+
+async def respond(send, status, body):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"text/plain; charset=utf-8")],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+async def disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+def event(deltas, mark):
+    if deltas:
+        return f"id: {mark}\nevent: counts\ndata: {json.dumps(deltas)}\n\n"
+    # An event without data isn't dispatched, but still moves the id on
+    return f"id: {mark}\n\n"
+
+
+async def stream(scope, receive, send):
+    """The changes to ``?posts=`` published after ``?since=``, as they come."""
+    query = parse_qs(scope["query_string"].decode("latin-1"))
+    headers = dict(scope["headers"])
+    try:
+        post_ids = {
+            str(uuid.UUID(pk))
+            for pk in query.get("posts", [""])[0].split(",")
+            if pk.strip()
+        }
+        since = float(
+            headers.get(b"last-event-id", b"").decode("latin-1")
+            or query.get("since", [time.time()])[0]
+        )
+    except ValueError:
+        return await respond(send, 400, b"Expected post ids and a time")
+    if not post_ids or len(post_ids) > getattr(settings, "LIVE_MAX_POSTS", 100):
+        return await respond(send, 400, b"Too few or too many post ids")
+
+    broker = get_broker()
+    subscriber = broker.subscribe(post_ids, since)
+    disconnected = asyncio.ensure_future(disconnect(receive))
+    try:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream"),
+                    (b"cache-control", b"no-cache"),
+                    # Stops nginx from buffering the stream
+                    (b"x-accel-buffering", b"no"),
+                ],
+            }
+        )
+        while not disconnected.done():
+            ready = asyncio.ensure_future(subscriber.ready.wait())
+            await asyncio.wait(
+                {ready, disconnected},
+                timeout=KEEPALIVE,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            ready.cancel()
+            if disconnected.done():
+                break
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": event(*subscriber.take()).encode(),
+                    "more_body": True,
+                }
+            )
+    finally:
+        disconnected.cancel()
+        broker.unsubscribe(subscriber)
@@ -0,0 +1,143 @@
+import json
+import sys
+from io import StringIO
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from posts import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the main views against generated datasets in a throwaway "
+        "test database, failing when a view goes over its query budget"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            default="small,medium",
+            help=f"Comma separated datasets out of {', '.join(benchmark.SIZES)}",
+        )
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--warmup", type=int, default=2)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--throughput",
+            type=int,
+            default=200,
+            help="Vote requests sent through WSGI and through ASGI, 0 to skip",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=20,
+            help="Vote requests kept in flight while measuring throughput",
+        )
+        parser.add_argument(
+            "--output",
+            default="benchmark.json",
+            help="Where to write the results as JSON, - for stdout",
+        )
+
+    def handle(self, *args, **options):
+        sizes = options["sizes"].split(",")
+        unknown = set(sizes) - set(benchmark.SIZES)
+        if unknown:
+            raise CommandError(f"Unknown sizes: {', '.join(sorted(unknown))}")
+
+        # Keep the table out of the way of JSON written to stdout
+        self.table = self.stderr if options["output"] == "-" else self.stdout
+        results = []
+        throughput = []
+        verbosity = options["verbosity"]
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            for size in sizes:
+                call_command("flush", interactive=False, verbosity=0)
+                for alias in settings.CACHES:
+                    caches[alias].clear()
+                call_command(
+                    "generate",
+                    seed=options["seed"],
+                    stdout=self.stdout if verbosity > 1 else StringIO(),
+                    **benchmark.SIZES[size],
+                )
+                # generate ranks users by activity, the first is the busiest
+                viewer = User.objects.get(username="genuser0")
+                try:
+                    measured = benchmark.run(
+                        viewer, options["repeat"], options["warmup"]
+                    )
+                except benchmark.BenchmarkError as error:
+                    raise CommandError(error)
+                for result in measured:
+                    results.append({"size": size, **result})
+                    self.report(results[-1])
+                if options["throughput"] > 0:
+                    try:
+                        measured = benchmark.throughput(
+                            viewer, options["throughput"], options["concurrency"]
+                        )
+                    except benchmark.BenchmarkError as error:
+                        raise CommandError(error)
+                    for result in measured:
+                        throughput.append({"size": size, **result})
+                        self.report_throughput(throughput[-1])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.write(options, results, throughput)
+        over = [
+            f"{result['view']} ({result['size']}): {result['queries']} queries, "
+            f"budget {result['budget']}"
+            for result in results
+            if result["queries"] > result["budget"]
+        ]
+        if over:
+            raise CommandError("Over budget: " + "; ".join(over))
+
+    def report(self, result):
+        self.table.write(
+            f"{result['size']:<8} {result['view']:<16} "
+            f"p50 {result['p50_ms']:>8.2f}ms  p95 {result['p95_ms']:>8.2f}ms  "
+            f"{result['queries']:>3}/{result['budget']} queries  "
+            f"{result['rows']:>6} rows  {result['peak_kib']:>9.1f}KiB"
+        )
+
+    def report_throughput(self, result):
+        self.table.write(
+            f"{result['size']:<8} {result['interface']:<16} "
+            f"{result['requests_per_second']:>8.1f} votes/s  "
+            f"{result['requests']} requests, {result['concurrency']} in flight"
+        )
+
+    def write(self, options, results, throughput):
+        document = {
+            "created_on": timezone.now().isoformat(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "seed": options["seed"],
+            "repeat": options["repeat"],
+            "sizes": {
+                size: benchmark.SIZES[size] for size in options["sizes"].split(",")
+            },
+            "results": results,
+            "throughput": throughput,
+        }
+        if options["output"] == "-":
+            json.dump(document, sys.stdout, indent=2)
+            sys.stdout.write("\n")
+            return
+        with open(options["output"], "w") as output:
+            json.dump(document, output, indent=2)
+        self.stdout.write(f"Wrote {len(results)} results to {options['output']}")
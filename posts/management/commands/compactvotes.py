@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from posts import rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Folds hourly vote rollups older than two days into daily ones and "
+        "drops days no top listing window reaches, run it every hour or so"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="Recompute the rollups from the post votes instead",
+        )
+
+    def handle(self, *args, **options):
+        if options["rebuild"]:
+            hourly, daily = rollups.rebuild()
+            self.stdout.write(f"Rebuilt {hourly} hourly and {daily} daily rollups")
+            return
+        folded, dropped = rollups.compact()
+        self.stdout.write(
+            f"Folded {folded} hourly rollups into days, dropped {dropped} old days"
+        )
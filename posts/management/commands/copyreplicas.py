@@ -0,0 +1,48 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = (
+        "Copies the primary SQLite database over each of DATABASE_REPLICAS, "
+        "standing in for replication when trying out replica reads locally"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0,
+            help="Keep copying every this many seconds, rather than once",
+        )
+
+    def handle(self, *args, **options):
+        aliases = getattr(settings, "DATABASE_REPLICAS", [])
+        if not aliases:
+            raise CommandError("DATABASE_REPLICAS names no replicas")
+        for alias in [DEFAULT_DB_ALIAS, *aliases]:
+            if connections[alias].vendor != "sqlite":
+                raise CommandError(f"{alias} isn't a SQLite database")
+        while True:
+            self.copy(aliases)
+            if options["interval"] <= 0:
+                break
+            time.sleep(options["interval"])
+
+    def copy(self, aliases):
+        primary = connections[DEFAULT_DB_ALIAS]
+        primary.ensure_connection()
+        for alias in aliases:
+            replica = connections[alias]
+            replica.close()
+            target = sqlite3.connect(replica.settings_dict["NAME"])
+            try:
+                # A consistent snapshot, even while the primary is written to
+                primary.connection.backup(target)
+            finally:
+                target.close()
+            self.stdout.write(f"Copied the primary to {alias}")
@@ -0,0 +1,400 @@
+import uuid
+from collections import namedtuple
+from datetime import timedelta
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from posts import feeds, sampling
+from posts.models import (
+    Category,
+    Comment,
+    CommentVote,
+    Post,
+    PostFavourite,
+    PostVote,
+    Subscription,
+    encode_segment,
+    explicit_timestamps,
+)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Where threads() puts each comment: indexes of its post and parent comment,
+# its path and depth, and the reply sequences of every comment and post
+Layout = namedtuple("Layout", "posts parents paths depths replies post_replies")
+
+WORDS = (
+    "async cache linux rust python kernel release update patch bug fix review "
+    "design tutorial question guide news benchmark compiler database index query "
+    "thread memory server client network game console engine story history"
+).split()
+
+
+def zipf_weights(count, exponent, rng=None):
+    """Probabilities falling off as ``1 / rank ** exponent``.
+
+    With ``rng`` the ranks are shuffled, so popularity doesn't follow the
+    order things were generated in.
+    """
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    if rng is not None:
+        weights = weights[rng.permutation(count)]
+    return weights / weights.sum()
+
+
+def uuids(rng, count):
+    data = rng.bytes(16 * count)
+    return [
+        uuid.UUID(bytes=data[start : start + 16], version=4)
+        for start in range(0, 16 * count, 16)
+    ]
+
+
+def words(rng, count, length):
+    choices = rng.integers(len(WORDS), size=(count, length)).tolist()
+    return [" ".join(WORDS[index] for index in row) for row in choices]
+
+
+def spread(rng, count, weights, size, start_weights):
+    """``count`` distinct (target, index) pairs, with targets drawn by ``weights``.
+
+    Each target gets a run of consecutive indexes below ``size``, starting
+    from one drawn by ``start_weights``, so no target repeats an index and
+    runs of popular targets overlap on the most active indexes. Targets are
+    capped at ``size`` pairs, so fewer than ``count`` may come back.
+    """
+    counts = np.bincount(
+        rng.choice(len(weights), count, p=weights), minlength=len(weights)
+    )
+    counts = np.minimum(counts, size)
+    targets = np.repeat(np.arange(len(weights)), counts)
+    starts = np.repeat(rng.choice(size, len(weights), p=start_weights), counts)
+    offsets = np.arange(len(targets)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return targets, (starts + offsets) % size
+
+
+class Command(BaseCommand):
+    help = (
+        "Fills the database with a reproducible synthetic dataset of users, "
+        "categories, threaded comments, votes, favourites and subscriptions. "
+        "Needs NumPy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10000)
+        parser.add_argument("--categories", type=int, default=20)
+        parser.add_argument("--posts", type=int, default=10000)
+        parser.add_argument("--comments", type=int, default=50000)
+        parser.add_argument("--votes", type=int, default=200000)
+        parser.add_argument("--favourites", type=int, default=10000)
+        parser.add_argument("--subscriptions", type=int, default=5000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--exponent",
+            type=float,
+            default=1.1,
+            help="Zipf exponent for how activity is spread over users, "
+            "categories, posts and comments",
+        )
+        parser.add_argument(
+            "--chain",
+            type=float,
+            default=0.5,
+            help="Chance that a comment replies to the comment before it",
+        )
+        parser.add_argument(
+            "--days", type=int, default=30, help="Spread posts over this many days"
+        )
+        parser.add_argument("--prefix", default="gen", help="Prefix for names")
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if np is None:
+            raise CommandError("generate needs NumPy, pip install numpy")
+        if options["users"] < 1 or options["categories"] < 1:
+            raise CommandError("Need at least one user and one category")
+        prefix = options["prefix"]
+        if User.objects.filter(username__startswith=f"{prefix}user").exists():
+            raise CommandError(f"Users prefixed {prefix} exist, pick another --prefix")
+
+        self.rng = np.random.default_rng(options["seed"])
+        self.now = timezone.now()
+        self.batch_size = options["batch_size"]
+        self.exponent = options["exponent"]
+
+        users = self.users(options["users"], prefix)
+        categories = self.categories(options["categories"], prefix)
+        user_weights = zipf_weights(len(users), self.exponent)
+        category_weights = zipf_weights(len(categories), self.exponent)
+
+        layout = self.threads(options["comments"], options["chain"], options["posts"])
+        posts, created = self.posts(
+            options["days"],
+            layout.post_replies,
+            users,
+            user_weights,
+            categories,
+            category_weights,
+        )
+        comments, commented = self.comments(layout, posts, created, users, user_weights)
+
+        # Votes land on posts and comments alike, favourites only on posts
+        targets = posts + comments
+        if targets:
+            target_weights = zipf_weights(len(targets), self.exponent, self.rng)
+            self.votes(
+                options["votes"],
+                targets,
+                created + commented,
+                len(posts),
+                target_weights,
+                users,
+            )
+        if posts:
+            post_weights = zipf_weights(len(posts), self.exponent, self.rng)
+            self.favourites(options["favourites"], posts, post_weights, users)
+        self.subscriptions(
+            options["subscriptions"], users, user_weights, categories, category_weights
+        )
+
+        # Fresh planner statistics for the tables just filled, without them
+        # SQLite can pick the wrong index for recount's vote subqueries
+        if connection.vendor in ("postgresql", "sqlite"):
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+        call_command("recount", stdout=self.stdout)
+        call_command("rerank", stdout=self.stdout)
+        call_command("rekarma", stdout=self.stdout)
+        call_command("compactvotes", rebuild=True, stdout=self.stdout)
+        call_command("reindex", stdout=self.stdout)
+        for category_id in categories:
+            feeds.invalidate_category(category_id)
+        sampling.changed()
+
+    def insert(self, model, objects, timestamps=False):
+        """Write ``objects`` in batches and return how many there were.
+
+        With ``timestamps`` the objects keep the times they were built with.
+        """
+        objects = iter(objects)
+        count = 0
+        while True:
+            batch = list(islice(objects, self.batch_size))
+            if not batch:
+                break
+            with transaction.atomic():
+                if timestamps:
+                    with explicit_timestamps(model):
+                        model.objects.bulk_create(batch)
+                else:
+                    model.objects.bulk_create(batch)
+            count += len(batch)
+        self.stdout.write(f"Generated {count} {model._meta.verbose_name_plural}")
+        return count
+
+    def users(self, count, prefix):
+        password = make_password(None)
+        names = [f"{prefix}user{number}" for number in range(count)]
+        self.insert(User, (User(username=name, password=password) for name in names))
+        ids = dict(
+            User.objects.filter(username__in=names).values_list("username", "pk")
+        )
+        return [ids[name] for name in names]
+
+    def categories(self, count, prefix):
+        names = [f"{prefix}category{number}" for number in range(count)]
+        descriptions = words(self.rng, count, 8)
+        self.insert(
+            Category,
+            (
+                Category(name=name, slug=slugify(name), description=description)
+                for name, description in zip(names, descriptions)
+            ),
+        )
+        ids = dict(Category.objects.filter(name__in=names).values_list("name", "pk"))
+        return [ids[name] for name in names]
+
+    def threads(self, count, chain, posts):
+        """Lay out threaded comments, deeper on posts with more of them.
+
+        Each comment replies to the comment before it with probability
+        ``chain``, otherwise to a random earlier comment or the post itself.
+        Paths and reply sequences are handed out as ``Comment.save`` would.
+        """
+        if not posts:
+            return Layout([], [], [], [], [], [])
+        on = np.sort(
+            self.rng.choice(
+                posts, count, p=zipf_weights(posts, self.exponent, self.rng)
+            )
+        ).tolist()
+        rolls = self.rng.random((count, 2)).tolist()
+        max_depth = Comment.max_depth() - 1
+        width = Comment.SEGMENT_WIDTH
+
+        parents, paths, depths = [], [], []
+        replies = [0] * count
+        post_replies = [0] * posts
+        thread = 0
+        for index, post in enumerate(on):
+            if index and on[index - 1] != post:
+                thread = index
+            (roll, pick), parent = rolls[index], None
+            if index > thread and roll < chain:
+                parent = index - 1
+            elif index > thread and roll < (1 + chain) / 2:
+                parent = thread + int(pick * (index - thread))
+            if parent is not None and depths[parent] >= max_depth:
+                parent = None
+
+            if parent is None:
+                post_replies[post] += 1
+                prefix, depth, sequence = "", 0, post_replies[post]
+            else:
+                replies[parent] += 1
+                prefix, depth = paths[parent], depths[parent] + 1
+                sequence = replies[parent]
+            parents.append(parent)
+            paths.append(prefix + encode_segment(sequence, width))
+            depths.append(depth)
+        return Layout(on, parents, paths, depths, replies, post_replies)
+
+    def posts(
+        self, days, post_replies, users, user_weights, categories, category_weights
+    ):
+        count = len(post_replies)
+        ids = uuids(self.rng, count)
+        authors = self.rng.choice(len(users), count, p=user_weights).tolist()
+        where = self.rng.choice(len(categories), count, p=category_weights).tolist()
+        ages = self.rng.uniform(0, days * 86400, count).tolist()
+        titles = words(self.rng, count, 6)
+        created = [self.now - timedelta(seconds=age) for age in ages]
+
+        def build():
+            for index, post_id in enumerate(ids):
+                post = Post(
+                    id=post_id,
+                    title=titles[index],
+                    slug=slugify(titles[index])[:50],
+                    user_id=users[authors[index]],
+                    category_id=categories[where[index]],
+                    reply_sequence=post_replies[index],
+                    created_on=created[index],
+                    updated_on=created[index],
+                )
+                post.link = post.get_absolute_url()
+                yield post
+
+        self.insert(Post, build(), timestamps=True)
+        return ids, created
+
+    def comments(self, layout, posts, created, users, user_weights):
+        count = len(layout.posts)
+        ids = uuids(self.rng, count)
+        authors = self.rng.choice(len(users), count, p=user_weights).tolist()
+        # Later comments in a thread are posted later, so rethread would
+        # hand out the same paths
+        delays = self.rng.exponential(3 * 3600, count)
+        delays = delays[np.lexsort((delays, layout.posts))].tolist()
+        contents = words(self.rng, count, 12)
+        times = [
+            min(created[post] + timedelta(seconds=delays[index]), self.now)
+            for index, post in enumerate(layout.posts)
+        ]
+
+        def build():
+            for index, post in enumerate(layout.posts):
+                parent = layout.parents[index]
+                yield Comment(
+                    id=ids[index],
+                    content=contents[index],
+                    post_id=posts[post],
+                    reply_id=None if parent is None else ids[parent],
+                    user_id=users[authors[index]],
+                    path=layout.paths[index],
+                    depth=layout.depths[index],
+                    reply_sequence=layout.replies[index],
+                    created_on=times[index],
+                    updated_on=times[index],
+                )
+
+        self.insert(Comment, build(), timestamps=True)
+        return ids, times
+
+    def votes(self, count, targets, created, post_count, target_weights, users):
+        """Votes on ``targets``, each cast some time after its target was created.
+
+        Most of a target's votes come in its first day, as with comments the
+        delays fall off exponentially.
+        """
+        voted, voters = spread(
+            self.rng,
+            count,
+            target_weights,
+            len(users),
+            zipf_weights(len(users), self.exponent),
+        )
+        # Each target gets its own share of upvotes
+        upvoted = self.rng.beta(4, 1.5, len(targets))[voted]
+        choices = np.where(self.rng.random(len(voted)) < upvoted, 1, -1)
+        delays = self.rng.exponential(8 * 3600, len(voted))
+        # The first post_count targets are posts, the rest comments
+        on_post = voted < post_count
+
+        def build(model, mask):
+            for target, voter, choice, delay in zip(
+                voted[mask].tolist(),
+                voters[mask].tolist(),
+                choices[mask].tolist(),
+                delays[mask].tolist(),
+            ):
+                created_on = min(created[target] + timedelta(seconds=delay), self.now)
+                yield model(
+                    choice=choice,
+                    user_id=users[voter],
+                    target_id=targets[target],
+                    created_on=created_on,
+                    updated_on=created_on,
+                )
+
+        for model, mask in ((PostVote, on_post), (CommentVote, ~on_post)):
+            self.insert(model, build(model, mask), timestamps=True)
+
+    def favourites(self, count, posts, post_weights, users):
+        saved, savers = spread(
+            self.rng,
+            count,
+            post_weights,
+            len(users),
+            zipf_weights(len(users), self.exponent),
+        )
+        self.insert(
+            PostFavourite,
+            (
+                PostFavourite(user_id=users[saver], post_id=posts[post])
+                for post, saver in zip(saved.tolist(), savers.tolist())
+            ),
+        )
+
+    def subscriptions(self, count, users, user_weights, categories, weights):
+        # Heavy users subscribe to many categories, most users to a few
+        subscribers, subscribed = spread(
+            self.rng, count, user_weights, len(categories), weights
+        )
+        self.insert(
+            Subscription,
+            (
+                Subscription(user_id=users[user], category_id=categories[category])
+                for user, category in zip(subscribers.tolist(), subscribed.tolist())
+            ),
+        )
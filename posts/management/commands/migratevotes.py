@@ -0,0 +1,120 @@
+from itertools import islice
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from posts.models import (
+    Comment,
+    CommentVote,
+    GenericFavourite,
+    GenericVote,
+    Post,
+    PostFavourite,
+    PostVote,
+    explicit_timestamps,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Copies votes and favourites from the generic tables into the typed "
+        "ones, then rebuilds the scores, ranks, karma and rollups the votes "
+        "feed. Rows already copied are skipped, so it's safe to run again"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--delete",
+            action="store_true",
+            help="Empty the generic tables once their rows are copied",
+        )
+
+    def handle(self, *args, **options):
+        self.batch_size = options["batch_size"]
+        copied = 0
+        for model, vote_model in ((Post, PostVote), (Comment, CommentVote)):
+            # Votes on deleted targets were never cascaded, leave them behind
+            rows = self.rows(
+                GenericVote,
+                model,
+                "user_id",
+                "object_id",
+                "choice",
+                "created_on",
+                "updated_on",
+            )
+            copied += self.copy(
+                vote_model,
+                (
+                    vote_model(
+                        user_id=user_id,
+                        target_id=object_id,
+                        choice=choice,
+                        created_on=created_on,
+                        updated_on=updated_on,
+                    )
+                    for user_id, object_id, choice, created_on, updated_on in rows
+                ),
+            )
+
+        # The generic table kept no timestamps, so they're all saved as of now
+        now = timezone.now()
+        rows = self.rows(GenericFavourite, Post, "user_id", "object_id")
+        self.copy(
+            PostFavourite,
+            (
+                PostFavourite(
+                    user_id=user_id, post_id=object_id, created_on=now, updated_on=now
+                )
+                for user_id, object_id in rows
+            ),
+        )
+        dropped = GenericFavourite.objects.exclude(
+            content_type=ContentType.objects.get_for_model(Post)
+        ).count()
+        if dropped:
+            self.stdout.write(f"Skipped {dropped} favourites on comments")
+
+        if copied:
+            # The copies went around the write paths that keep these in step
+            call_command("recount", stdout=self.stdout)
+            call_command("rerank", stdout=self.stdout)
+            call_command("rekarma", stdout=self.stdout)
+            call_command("compactvotes", rebuild=True, stdout=self.stdout)
+
+        if options["delete"]:
+            with transaction.atomic():
+                votes = GenericVote.objects.all().delete()[0]
+                favourites = GenericFavourite.objects.all().delete()[0]
+            self.stdout.write(
+                f"Deleted {votes} generic votes and {favourites} generic favourites"
+            )
+
+    def rows(self, generic, model, *fields):
+        """The generic rows pointing at an existing ``model``, as tuples."""
+        return (
+            generic.objects.filter(
+                content_type=ContentType.objects.get_for_model(model),
+                object_id__in=model.objects.values("pk"),
+            )
+            .order_by("pk")
+            .values_list(*fields)
+            .iterator(chunk_size=self.batch_size)
+        )
+
+    def copy(self, model, objects):
+        count = model.objects.count()
+        with transaction.atomic(), explicit_timestamps(model):
+            while True:
+                batch = list(islice(objects, self.batch_size))
+                if not batch:
+                    break
+                # Unique constraints on (user, target) skip rows copied before
+                model.objects.bulk_create(batch, ignore_conflicts=True)
+        count = model.objects.count() - count
+        self.stdout.write(f"Copied {count} {model._meta.verbose_name_plural}")
+        return count
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef
+
+from posts.models import Category, Comment, Post, Subscription, Vote, total
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the denormalised score and comment counters from scratch"
+
+    def handle(self, *args, **options):
+        for model, children in (
+            (Post, Comment.objects.filter(post=OuterRef("pk"))),
+            (Comment, Comment.objects.filter(reply=OuterRef("pk"))),
+        ):
+            votes = model.vote_model().objects.filter(target=OuterRef("pk"))
+            with transaction.atomic():
+                updated = model.objects.update(
+                    score=total(votes, "SUM", "choice"),
+                    upvotes=total(votes.filter(choice=Vote.Choice.UP), "COUNT"),
+                    downvotes=total(votes.filter(choice=Vote.Choice.DOWN), "COUNT"),
+                    comment_count=total(children, "COUNT"),
+                )
+            self.stdout.write(f"Recounted {updated} {model._meta.verbose_name_plural}")
+
+        with transaction.atomic():
+            updated = Category.objects.update(
+                post_count=total(Post.objects.filter(category=OuterRef("pk")), "COUNT"),
+                subscriber_count=total(
+                    Subscription.objects.filter(category=OuterRef("pk")), "COUNT"
+                ),
+            )
+        self.stdout.write(f"Recounted {updated} categories")
@@ -0,0 +1,41 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+
+from posts import search
+from posts.models import Comment, Post
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text search index of every post and comment"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        backend = search.backend()
+        if backend is None:
+            raise CommandError("The database has no full-text search backend")
+
+        with transaction.atomic():
+            backend.clear()
+            for name, objects in (
+                ("posts", Post.objects.only("title", "body", "category_id")),
+                (
+                    "comments",
+                    Comment.objects.annotate(category_id=F("post__category_id")).only(
+                        "content", "post_id"
+                    ),
+                ),
+            ):
+                objects = objects.order_by().iterator(chunk_size=options["batch_size"])
+                count = 0
+                while True:
+                    batch = list(islice(objects, options["batch_size"]))
+                    if not batch:
+                        break
+                    backend.index(batch)
+                    count += len(batch)
+                self.stdout.write(f"Indexed {count} {name}")
@@ -0,0 +1,61 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from posts.models import Comment, Karma, Post
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds every user's karma record from the post and comment scores "
+        "and counts, run recount first if the scores have drifted"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        post_totals = self.totals(Post)
+        comment_totals = self.totals(Comment)
+
+        records = []
+        rebuilt = 0
+        with transaction.atomic():
+            Karma.objects.all().delete()
+            for user_id in User.objects.values_list("pk", flat=True).iterator():
+                post, posts = post_totals.get(user_id, (0, 0))
+                comment, comments = comment_totals.get(user_id, (0, 0))
+                records.append(
+                    Karma(
+                        user_id=user_id,
+                        post_karma=post,
+                        comment_karma=comment,
+                        total=post + comment,
+                        post_count=posts,
+                        comment_count=comments,
+                    )
+                )
+                if len(records) == options["batch_size"]:
+                    rebuilt += self.flush(records, options["batch_size"])
+            rebuilt += self.flush(records, options["batch_size"])
+        self.stdout.write(f"Rebuilt karma for {rebuilt} users")
+
+    @staticmethod
+    def flush(records, batch_size):
+        # Django lowers batch_size to what the backend can take in a statement
+        Karma.objects.bulk_create(records, batch_size=batch_size)
+        count = len(records)
+        records.clear()
+        return count
+
+    @staticmethod
+    def totals(model):
+        """Each user's summed score and count of ``model``."""
+        rows = (
+            model.objects.order_by()
+            .values("user")
+            .annotate(total=Sum("score"), count=Count("pk"))
+            .values_list("user", "total", "count")
+        )
+        return {user_id: (score, count) for user_id, score, count in rows}
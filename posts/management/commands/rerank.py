@@ -0,0 +1,50 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = "Recomputes the hot, rising and controversial ranking columns"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-age",
+            type=int,
+            metavar="HOURS",
+            help="Only rerank posts created within the last HOURS hours",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        posts = Post.objects.order_by("pk").only(
+            "score", "upvotes", "downvotes", "created_on"
+        )
+        if options["max_age"] is not None:
+            posts = posts.filter(
+                created_on__gte=now - timedelta(hours=options["max_age"])
+            )
+
+        fields = Post.RANK_FIELDS
+        total = 0
+        batch = []
+        for post in posts.iterator(chunk_size=options["batch_size"]):
+            for field, value in post.ranks(now).items():
+                setattr(post, field, value)
+            batch.append(post)
+            if len(batch) == options["batch_size"]:
+                total += self.flush(batch, fields)
+        total += self.flush(batch, fields)
+        self.stdout.write(f"Reranked {total} posts")
+
+    @staticmethod
+    def flush(batch, fields):
+        with transaction.atomic():
+            Post.objects.bulk_update(batch, fields)
+        count = len(batch)
+        batch.clear()
+        return count
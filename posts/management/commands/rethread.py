@@ -0,0 +1,80 @@
+from collections import defaultdict
+from itertools import groupby
+
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from django.db.models.functions import Cast
+
+from posts.models import Comment, Message, Post, encode_segment
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the materialised paths of every comment and message thread"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        self.batch_size = options["batch_size"]
+        rows = (
+            Comment.objects.order_by("post", "created_on", "pk")
+            .values_list("pk", "post_id", "reply_id")
+            .iterator(chunk_size=self.batch_size)
+        )
+        total = 0
+        for post_id, comments in groupby(rows, key=lambda row: row[1]):
+            total += self.rethread_post(post_id, list(comments))
+        self.stdout.write(f"Rethreaded {total} comments")
+
+        paths = {}
+        messages = []
+        for pk, reply_id in Message.objects.order_by("pk").values_list("pk", "reply"):
+            prefix, depth = paths.get(reply_id, ("", -1))
+            path = prefix + encode_segment(pk, Message.SEGMENT_WIDTH)
+            paths[pk] = (path, depth + 1)
+            messages.append(Message(pk=pk, path=path, depth=depth + 1))
+        with transaction.atomic():
+            Message.objects.bulk_update(
+                messages, ["path", "depth"], batch_size=self.batch_size
+            )
+        self.stdout.write(f"Rethreaded {len(messages)} messages")
+
+    def rethread_post(self, post_id, comments):
+        replies = defaultdict(list)
+        for pk, _, reply_id in comments:
+            replies[reply_id].append(pk)
+
+        updated = []
+        # Walk down from the top level comments so every parent has its path
+        # before its replies are numbered
+        level = [(None, "", 0)]
+        while level:
+            parent, prefix, depth = level.pop()
+            children = replies.get(parent, ())
+            for sequence, pk in enumerate(children, start=1):
+                path = prefix + encode_segment(sequence, Comment.SEGMENT_WIDTH)
+                updated.append(
+                    Comment(
+                        pk=pk,
+                        path=path,
+                        depth=depth,
+                        reply_sequence=len(replies.get(pk, ())),
+                    )
+                )
+                level.append((pk, path, depth + 1))
+
+        with transaction.atomic():
+            # Park every comment on its own id first so the unique (post, path)
+            # constraint can't trip over a half renumbered thread
+            Comment.objects.filter(post_id=post_id).update(
+                path=Cast("pk", models.CharField())
+            )
+            Comment.objects.bulk_update(
+                updated,
+                ["path", "depth", "reply_sequence"],
+                batch_size=self.batch_size,
+            )
+            Post.objects.filter(pk=post_id).update(
+                reply_sequence=len(replies.get(None, ()))
+            )
+        return len(updated)
@@ -1,39 +1,48 @@
 import argparse
-import json
 
-from django.contrib.auth.hashers import make_password
-from django.contrib.auth.models import User
 from django.core.management.base import BaseCommand, CommandError
-from django.utils.text import slugify
 
-from posts.models import Category, Post
+from posts.ingest import Ingester, iter_records
 
 
 class Command(BaseCommand):
     help = "Loads scraped data into the database"
 
     def add_arguments(self, parser):
-        parser.add_argument("infile", nargs="?", type=argparse.FileType("r"))
+        parser.add_argument(
+            "infile",
+            nargs="?",
+            type=argparse.FileType("r"),
+            help="A JSON array or JSON lines file of scraped posts",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--user",
+            help="Username for records that don't name one",
+        )
+        parser.add_argument(
+            "--category",
+            help="Category for records without a subreddit",
+        )
 
     def handle(self, *args, **options):
-        posts = json.load(options["infile"])
-        users = {post["username"] for post in posts}
-        categories = {post["subreddit"] for post in posts}
+        if options["infile"] is None:
+            raise CommandError("No input file given")
 
-        User.objects.bulk_create([User(username=name) for name in users])
-        Category.objects.bulk_create(
-            [Category(name=name, slug=slugify(name)) for name in categories]
+        ingester = Ingester(
+            batch_size=options["batch_size"],
+            default_user=options["user"],
+            default_category=options["category"],
         )
-
-        Post.objects.bulk_create(
-            [
-                Post(
-                    title=post["title"],
-                    category=Category.objects.get(name=post["subreddit"]),
-                    link=post.get("href"),
-                    user=User.objects.get(username=post["username"]),
-                    slug=slugify(post["title"]),
-                )
-                for post in posts
-            ]
+        for record in iter_records(options["infile"]):
+            if ingester.add(record):
+                self.report(ingester)
+        ingester.flush()
+        self.report(ingester)
+
+    def report(self, ingester):
+        self.stdout.write(
+            f"{ingester.created} posts and {ingester.comments} comments created, "
+            f"{ingester.duplicates} duplicates, "
+            f"{ingester.skipped} skipped ({ingester.rate:.0f} posts/s)"
         )
@@ -1,13 +1,21 @@
 import uuid
+from collections import defaultdict
+from contextlib import contextmanager
 
-from django.db.models.functions import Coalesce
-from django.db.models import Sum, Value, Count
 from django.conf import settings
-from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
-from django.db import IntegrityError, models
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Case, F, Func, IntegerField, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.text import slugify
 
+from posts import live, ranking
+
 
 def get_sentinel_user():
     return get_user_model().objects.get_or_create(username="deleted")[0]
@@ -22,12 +30,194 @@ class TimeStamp(models.Model):
         abstract = True
 
 
-class Comment(TimeStamp):
+@contextmanager
+def explicit_timestamps(model):
+    """Let ``bulk_create`` keep the ``created_on`` and ``updated_on`` it's given.
+
+    Otherwise their ``pre_save`` stamps every row with the current time.
+    """
+    fields = [
+        field
+        for field in model._meta.concrete_fields
+        if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False)
+    ]
+    flags = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, flags):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def total(queryset, function, field="pk"):
+    """Correlated ``SELECT function(field)`` over ``queryset`` for each outer row."""
+    # A plain Func rather than an Aggregate keeps Django from adding a GROUP BY,
+    # so the subquery collapses every matching row into a single total.
+    return Coalesce(
+        Subquery(
+            queryset.order_by()
+            .annotate(total=Func(F(field), function=function))
+            .values("total"),
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    )
+
+
+def add_or_create(rows, changes, **values):
+    """Apply the F-expression ``changes`` to ``rows``, or create the row instead.
+
+    ``rows`` selects a single row by a unique key, ``values`` are the fields
+    to create it with when it doesn't exist yet.
+    """
+    if rows.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            rows.create(**values)
+    except IntegrityError:
+        # Somebody else created the row first
+        rows.update(**changes)
+
+
+def add_in_bulk(model, fields, amounts):
+    """Add ``amounts[pk]``, one number per name in ``fields``, to each row.
+
+    Every field gets a ``CASE`` over the rows' keys, so the rows are updated
+    with a single statement per chunk the database's bound parameter limit
+    allows. The rows must exist already.
+    """
+    # Each row binds its key in the WHERE and once more per CASE, plus its
+    # amount in every CASE
+    limit = connection.features.max_query_params or 900
+    size = max((limit - len(fields)) // (2 * len(fields) + 1), 1)
+    pks = list(amounts)
+    for start in range(0, len(pks), size):
+        chunk = pks[start : start + size]
+        model.objects.filter(pk__in=chunk).update(
+            **{
+                field: F(field)
+                + Case(
+                    *[When(pk=pk, then=Value(amounts[pk][i])) for pk in chunk],
+                    default=Value(0),
+                    output_field=IntegerField(),
+                )
+                for i, field in enumerate(fields)
+            }
+        )
+
+
+class Counters(models.Model):
+    """Denormalised vote and comment totals, kept in step by the write paths.
+
+    The ``recount`` management command rebuilds these from the source tables
+    if they ever drift.
+
+    Between recounts only F-expression updates move them. Saving a row that
+    already exists leaves out every column in ``maintained_fields``,
+    otherwise an instance loaded before a vote would write its stale totals
+    back over it.
+    """
+
+    COUNTER_FIELDS = ("score", "upvotes", "downvotes", "comment_count")
+
+    score = models.IntegerField(default=0)
+    upvotes = models.PositiveIntegerField(default=0)
+    downvotes = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+
+    maintained_fields = COUNTER_FIELDS
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if (
+            not self._state.adding
+            and not kwargs.get("force_insert")
+            and kwargs.get("update_fields") is None
+        ):
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.maintained_fields
+            ]
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def vote_model(cls):
+        """The typed table holding the votes on this model."""
+        return cls.votes.rel.related_model
+
+
+# Digits of the fixed-width base 36 segments making up a materialised path
+PATH_ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def encode_segment(number, width):
+    digits = []
+    while number:
+        number, digit = divmod(number, len(PATH_ALPHABET))
+        digits.append(PATH_ALPHABET[digit])
+    segment = "".join(reversed(digits)).rjust(width, PATH_ALPHABET[0])
+    if len(segment) > width:
+        raise OverflowError(f"Path segment {segment} is wider than {width}")
+    return segment
+
+
+def path_successor(path):
+    """The smallest path after every path that starts with ``path``."""
+    stripped = path.rstrip(PATH_ALPHABET[-1])
+    if not stripped:
+        return None
+    return stripped[:-1] + PATH_ALPHABET[PATH_ALPHABET.index(stripped[-1]) + 1]
+
+
+class Threaded(models.Model):
+    """Materialised path over a model's self-referential ``reply`` chain.
+
+    ``path`` concatenates one fixed-width base 36 segment per ancestor and a
+    final one for the row itself. Ordering by path therefore walks a thread
+    depth first, and any subthread is a single indexed range of paths.
+    """
+
+    SEGMENT_WIDTH = 5
+
+    path = models.CharField(max_length=500, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def max_depth(cls):
+        return cls._meta.get_field("path").max_length // cls.SEGMENT_WIDTH
+
+    def thread(self):
+        """Every row whose path is comparable with this one's."""
+        return type(self).objects.all()
+
+    def subtree(self):
+        """This row and all of its descendants, in depth first order."""
+        rows = self.thread().filter(path__gte=self.path)
+        upper = path_successor(self.path)
+        if upper is not None:
+            rows = rows.filter(path__lt=upper)
+        return rows.order_by("path")
+
+    def ancestors(self):
+        """The chain of rows this one replies to, outermost first."""
+        width = self.SEGMENT_WIDTH
+        paths = [self.path[:end] for end in range(width, len(self.path), width)]
+        return self.thread().filter(path__in=paths).order_by("path")
+
+
+class Comment(TimeStamp, Counters, Threaded):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     content = models.TextField(max_length=2000)
     post = models.ForeignKey("Post", on_delete=models.CASCADE, related_name="comments")
-    favourites = GenericRelation("Favourite", related_name="favourites")
-    votes = GenericRelation("Vote", related_name="votes")
     # Top level comments are those that aren't replies to other comments
     reply = models.ForeignKey(
         "self", on_delete=models.PROTECT, null=True, blank=True, related_name="replies"
@@ -37,36 +227,93 @@ class Comment(TimeStamp):
         on_delete=models.SET(get_sentinel_user),
         related_name="comments",
     )
+    # Path segments handed out to replies, unlike comment_count this never
+    # goes down so a deleted reply's segment is never reused
+    reply_sequence = models.PositiveIntegerField(default=0, editable=False)
+
+    # Replies claim their slots with F-expressions, and only rethread moves
+    # a saved comment's path
+    maintained_fields = Counters.COUNTER_FIELDS + ("path", "depth", "reply_sequence")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["post", "path"], name="comment_path")
+        ]
+
+    def get_absolute_url(self):
+        from django.urls import reverse
+
+        return reverse(
+            "posts:comment_detail",
+            args=[str(self.post_id), self.post.slug, str(self.id)],
+        )
+
+    def thread(self):
+        return Comment.objects.filter(post_id=self.post_id)
+
+    def save(self, *args, **kwargs):
+        from posts import search
+
+        if not self._state.adding or self.path:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                search.index([self])
+            return
+        # Claim the next reply slot on the parent comment, or on the post for
+        # top level comments, bumping the comment counters on the way
+        with transaction.atomic():
+            posts = Post.objects.filter(pk=self.post_id)
+            changes = {"comment_count": F("comment_count") + 1}
+            if self.reply_id is None:
+                changes["reply_sequence"] = F("reply_sequence") + 1
+            posts.update(**changes)
+            if self.reply_id is None:
+                prefix, self.depth = "", 0
+                sequence = posts.values_list("reply_sequence", flat=True).get()
+            else:
+                parents = Comment.objects.filter(pk=self.reply_id)
+                parents.update(
+                    comment_count=F("comment_count") + 1,
+                    reply_sequence=F("reply_sequence") + 1,
+                )
+                sequence, prefix, depth = parents.values_list(
+                    "reply_sequence", "path", "depth"
+                ).get()
+                self.depth = depth + 1
+            self.path = prefix + encode_segment(sequence, self.SEGMENT_WIDTH)
+            super().save(*args, **kwargs)
+            Karma.objects.tally(self.user_id, comments=1)
+            search.index([self])
+            live.publish(self.post_id, comments=1)
 
     def __str__(self) -> str:
         return self.content
 
 
-# First, define the Manager subclass.
 class RankedManager(models.Manager):
     def get_queryset(self):
-        return (
-            super()
-            .get_queryset()
-            .annotate(
-                total_comments=Coalesce(Count("comments", distinct=True), Value(0)),
-                score=Coalesce(Sum("votes__choice", distinct=True), Value(0)),
-            )
-        )
+        return super().get_queryset().order_by("-score", "-created_on")
 
 
-class Post(TimeStamp):
+class Post(TimeStamp, Counters):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     title = models.CharField(max_length=200)
     slug = models.SlugField(editable=False)
 
     # The content type of the post
     body = models.TextField(max_length=2000, blank=True)
-    link = models.URLField(blank=True)
+    link = models.URLField(blank=True, db_index=True)
     photo = models.ImageField(blank=True)
 
-    votes = GenericRelation("Vote", related_query_name="post")
-    favourites = GenericRelation("Favourite", related_query_name="post")
+    # Precomputed ranking columns, see posts.ranking
+    RANK_FIELDS = ("hot", "rising", "controversy")
+
+    hot = models.FloatField(default=0)
+    rising = models.FloatField(default=0)
+    controversy = models.FloatField(default=0)
+
+    # Path segments handed out to top level comments, see Comment.save
+    reply_sequence = models.PositiveIntegerField(default=0, editable=False)
 
     category = models.ForeignKey(
         "Category", on_delete=models.CASCADE, related_name="posts"
@@ -78,22 +325,64 @@ class Post(TimeStamp):
         related_name="posts",
     )
 
+    maintained_fields = Counters.COUNTER_FIELDS + RANK_FIELDS + ("reply_sequence",)
+
     objects = models.Manager()
     ranked = RankedManager()
 
     class Meta:
         ordering = ("-created_on",)
+        indexes = [
+            models.Index(fields=["-created_on"]),
+            models.Index(fields=["-score", "-created_on"]),
+            models.Index(fields=["-hot", "-created_on"]),
+            models.Index(fields=["-rising", "-created_on"]),
+            models.Index(fields=["-controversy", "-created_on"]),
+            models.Index(fields=["category", "-created_on"]),
+            models.Index(fields=["category", "-score", "-created_on"]),
+            models.Index(fields=["category", "-hot", "-created_on"]),
+            models.Index(fields=["user", "-score", "-created_on"]),
+        ]
 
     def get_absolute_url(self):
         from django.urls import reverse
 
         return reverse("posts:post_detail", args=[str(self.id), self.slug])
 
+    def rerank(self, now=None):
+        """Recompute the ranking columns from the current counters."""
+        Post.objects.filter(pk=self.pk).update(**self.ranks(now))
+
+    def ranks(self, now=None):
+        return ranking.ranks(
+            self.score,
+            self.upvotes,
+            self.downvotes,
+            self.created_on or timezone.now(),
+            now,
+        )
+
     def save(self, *args, **kwargs):
+        adding = self._state.adding
         self.slug = slugify(self.title)
+        if adding:
+            # Afterwards votes rerank the post, from its current counters
+            for field, value in self.ranks().items():
+                setattr(self, field, value)
         if not self.link:
             self.link = self.get_absolute_url()
-        super().save(*args, **kwargs)
+        from posts import feeds, search
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            search.index([self])
+            if adding:
+                Category.objects.filter(pk=self.category_id).update(
+                    post_count=F("post_count") + 1
+                )
+                Karma.objects.tally(self.user_id, posts=1)
+                category_id = self.category_id
+                transaction.on_commit(lambda: feeds.invalidate_category(category_id))
 
     def __str__(self) -> str:
         return self.title
@@ -105,14 +394,30 @@ class Category(TimeStamp):
     description = models.CharField(max_length=200)
     avatar = models.ImageField(blank=True)
 
+    # Denormalised totals, rebuilt by the recount management command
+    post_count = models.PositiveIntegerField(default=0)
+    subscriber_count = models.PositiveIntegerField(default=0)
+
     def get_absolute_url(self):
         from django.urls import reverse
 
         return reverse("posts:category_detail", args=[self.slug])
 
     def save(self, *args, **kwargs):
+        from posts import sampling
+
+        adding, previous = self._state.adding, self.slug
         self.slug = slugify(self.name)
         super().save(*args, **kwargs)
+        if adding or self.slug != previous:
+            transaction.on_commit(sampling.changed)
+
+    def delete(self, *args, **kwargs):
+        from posts import sampling
+
+        deleted = super().delete(*args, **kwargs)
+        transaction.on_commit(sampling.changed)
+        return deleted
 
     class Meta:
         ordering = ("name",)
@@ -122,16 +427,49 @@ class Category(TimeStamp):
         return self.name
 
 
-class Favourite(models.Model):
+class PostFavourite(TimeStamp):
+    """A post saved by a user, listed on their profile newest first."""
+
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.SET(get_sentinel_user),
-        related_name="favourites",
+        related_name="post_favourites",
+    )
+    post = models.ForeignKey(
+        "Post", on_delete=models.CASCADE, related_name="favourites"
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "post"], name="unique_post_favourite"
+            )
+        ]
+        indexes = [models.Index(fields=["user", "-created_on"])]
+
+    def __str__(self) -> str:
+        return str(self.post_id)
+
+
+class GenericFavourite(models.Model):
+    """The favourites table from before ``PostFavourite``.
+
+    Nothing writes to it any more, it's kept until ``migratevotes`` has
+    copied its rows across.
+    """
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET(get_sentinel_user),
+        related_name="+",
     )
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.UUIDField()
     content_object = GenericForeignKey()
 
+    class Meta:
+        db_table = "posts_favourite"
+
     def __str__(self) -> str:
         return str(self.object_id)
 
@@ -153,7 +491,10 @@ class Subscription(models.Model):
         return f"({self.user} {self.category})"
 
 
-class Message(TimeStamp):
+class Message(TimeStamp, Threaded):
+
+    # Messages use their own integer primary key as their path segment
+    SEGMENT_WIDTH = 8
 
     title = models.CharField(max_length=200)
     content = models.TextField(max_length=2000)
@@ -173,26 +514,422 @@ class Message(TimeStamp):
         settings.AUTH_USER_MODEL, on_delete=models.SET(get_sentinel_user),
     )
 
+    class Meta:
+        indexes = [models.Index(fields=["path"])]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding or self.path:
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if self.reply_id is None:
+                prefix, self.depth = "", 0
+            else:
+                prefix, depth = (
+                    Message.objects.filter(pk=self.reply_id)
+                    .values_list("path", "depth")
+                    .get()
+                )
+                self.depth = depth + 1
+            self.path = prefix + encode_segment(self.pk, self.SEGMENT_WIDTH)
+            Message.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+
+
+class VoteManager(models.Manager):
+    def cast(self, user, target, choice):
+        """Record ``user``'s vote on ``target``, ``None`` retracts it.
+
+        The vote row, the target's denormalised counters and its author's
+        karma are updated in the same transaction, using F-expressions so
+        concurrent voters don't overwrite each other's increments.
+        """
+        with transaction.atomic():
+            vote = self.select_for_update().filter(target=target, user=user).first()
+            previous = vote.choice if vote is not None else None
+            if previous == choice:
+                return
+            if vote is None:
+                self.create(target=target, user=user, choice=choice)
+            elif choice is None:
+                vote.delete()
+            else:
+                vote.choice = choice
+                vote.save(update_fields=["choice", "updated_on"])
+            self.apply(target, previous, choice)
+
+    def retract(self, user, target):
+        return self.cast(user, target, None)
+
+    def cast_many(self, votes):
+        """Record a batch of votes, ``None`` choices retract.
+
+        ``votes`` maps ``(user_id, target_id)`` to a choice. Vote rows are
+        written with one bulk insert, one bulk update and one delete. Each
+        target's counters and its author's karma then move once by the net
+        change of all its votes, and posts are reranked in one bulk update.
+        Votes on targets that don't exist are dropped. Returns how many votes
+        changed anything.
+        """
+        model = self.model._meta.get_field("target").related_model
+        object_ids = {object_id for _, object_id in votes}
+        voters = {user_id for user_id, _ in votes}
+        authors = dict(
+            model.objects.filter(pk__in=object_ids)
+            .order_by()
+            .values_list("pk", "user_id")
+        )
+        existing = {
+            (user_id, target_id): (pk, choice)
+            for pk, user_id, target_id, choice in self.filter(
+                target_id__in=object_ids, user_id__in=voters
+            ).values_list("pk", "user_id", "target_id", "choice")
+        }
+
+        now = timezone.now()
+        created, updated, deleted = [], [], []
+        changes = defaultdict(lambda: defaultdict(int))
+        for (user_id, object_id), choice in votes.items():
+            if object_id not in authors:
+                continue
+            pk, previous = existing.get((user_id, object_id), (None, None))
+            if previous == choice:
+                continue
+            if pk is None:
+                created.append(
+                    self.model(user_id=user_id, target_id=object_id, choice=choice)
+                )
+            elif choice is None:
+                deleted.append(pk)
+            else:
+                updated.append(self.model(pk=pk, choice=choice, updated_on=now))
+            change = changes[object_id]
+            change["score"] += (choice or 0) - (previous or 0)
+            change["upvotes"] += (choice == Vote.Choice.UP) - (
+                previous == Vote.Choice.UP
+            )
+            change["downvotes"] += (choice == Vote.Choice.DOWN) - (
+                previous == Vote.Choice.DOWN
+            )
+
+        kind = "post" if model is Post else "comment"
+        with transaction.atomic():
+            self.bulk_create(created)
+            self.bulk_update(updated, ["choice", "updated_on"])
+            self.filter(pk__in=deleted).delete()
+
+            karma = defaultdict(int)
+            for object_id, change in changes.items():
+                model.objects.filter(pk=object_id).update(
+                    **{
+                        field: F(field) + delta
+                        for field, delta in change.items()
+                        if delta
+                    }
+                )
+                karma[authors[object_id]] += change["score"]
+                if model is Post:
+                    HourlyVotes.objects.add(object_id, change["score"], now)
+                    live.publish(object_id, score=change["score"])
+            for user_id, delta in karma.items():
+                if delta:
+                    Karma.objects.adjust(user_id, **{kind: delta})
+
+            if model is Post:
+                posts = list(
+                    Post.objects.filter(pk__in=changes).only(
+                        "score", "upvotes", "downvotes", "created_on"
+                    )
+                )
+                for post in posts:
+                    for field, value in post.ranks(now).items():
+                        setattr(post, field, value)
+                Post.objects.bulk_update(posts, Post.RANK_FIELDS)
+        return len(created) + len(updated) + len(deleted)
+
+    def apply(self, target, previous, choice):
+        """Move ``target``'s counters and its author's karma between votes."""
+        type(target).objects.filter(pk=target.pk).update(
+            **self.counter_deltas(previous, choice)
+        )
+        delta = (choice or 0) - (previous or 0)
+        if isinstance(target, Post):
+            Karma.objects.adjust(target.user_id, post=delta)
+            HourlyVotes.objects.add(target.pk, delta)
+            live.publish(target.pk, score=delta)
+            target.refresh_from_db(fields=["score", "upvotes", "downvotes"])
+            target.rerank()
+        else:
+            Karma.objects.adjust(target.user_id, comment=delta)
+
+    @staticmethod
+    def counter_deltas(previous, choice):
+        """F-expression updates moving a target's counters from one vote to another."""
+        deltas = {"score": F("score") + (choice or 0) - (previous or 0)}
+        for value, field in (
+            (Vote.Choice.UP, "upvotes"),
+            (Vote.Choice.DOWN, "downvotes"),
+        ):
+            change = (choice == value) - (previous == value)
+            if change:
+                deltas[field] = F(field) + change
+        return deltas
+
 
 class Vote(TimeStamp):
+    """A user's vote on a post or comment, stored in a table per target type.
+
+    Each table has a real foreign key to its target. The unique constraint
+    on ``(user, target)`` serves looking up a user's votes on a page of
+    targets, and the ``(target, choice)`` index lets ``recount`` total a
+    target's votes from the index alone.
+    """
+
     class Choice(models.IntegerChoices):
         UP = 1
         DOWN = -1
 
     choice = models.IntegerField(choices=Choice.choices)
 
+    objects = VoteManager()
+
+    class Meta:
+        abstract = True
+        ordering = ("-created_on",)
+
+    def __str__(self) -> str:
+        return "Upvote" if self.choice == 1 else "Downvote"
+
+
+class PostVote(Vote):
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET(get_sentinel_user),
+        related_name="post_votes",
+    )
+    target = models.ForeignKey("Post", on_delete=models.CASCADE, related_name="votes")
+
+    class Meta(Vote.Meta):
+        constraints = [
+            models.UniqueConstraint(fields=["user", "target"], name="unique_post_vote")
+        ]
+        indexes = [models.Index(fields=["target", "choice"])]
+
+
+class CommentVote(Vote):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.SET(get_sentinel_user),
-        related_name="votes",
+        related_name="comment_votes",
+    )
+    target = models.ForeignKey(
+        "Comment", on_delete=models.CASCADE, related_name="votes"
+    )
+
+    class Meta(Vote.Meta):
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "target"], name="unique_comment_vote"
+            )
+        ]
+        indexes = [models.Index(fields=["target", "choice"])]
+
+
+class GenericVote(TimeStamp):
+    """The votes table from before ``PostVote`` and ``CommentVote``.
+
+    Nothing writes to it any more, it's kept until ``migratevotes`` has
+    copied its rows across.
+    """
+
+    choice = models.IntegerField(choices=Vote.Choice.choices)
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET(get_sentinel_user),
+        related_name="+",
     )
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.UUIDField()
     content_object = GenericForeignKey("content_type", "object_id")
 
     class Meta:
+        db_table = "posts_vote"
         unique_together = ["object_id", "user"]
-        ordering = ("-created_on",)
 
     def __str__(self) -> str:
         return "Upvote" if self.choice == 1 else "Downvote"
+
+
+class KarmaManager(models.Manager):
+    def adjust(self, user_id, post=0, comment=0):
+        """Add to a user's karma, creating their record on first use."""
+        changes = {
+            "post_karma": F("post_karma") + post,
+            "comment_karma": F("comment_karma") + comment,
+            "total": F("total") + post + comment,
+        }
+        add_or_create(
+            self.filter(pk=user_id),
+            changes,
+            user_id=user_id,
+            post_karma=post,
+            comment_karma=comment,
+            total=post + comment,
+        )
+
+    def tally(self, user_id, posts=0, comments=0):
+        """Add to the number of posts and comments a user has made."""
+        add_or_create(
+            self.filter(pk=user_id),
+            {
+                "post_count": F("post_count") + posts,
+                "comment_count": F("comment_count") + comments,
+            },
+            user_id=user_id,
+            post_count=posts,
+            comment_count=comments,
+        )
+
+
+class Karma(models.Model):
+    """A user's running karma totals, kept in step by ``VoteManager.cast``.
+
+    It also counts their posts and comments for their profile. Like the
+    category post counts they're raised as posts and comments are created
+    and lowered as they're deleted, along with the karma their votes gave,
+    and ``rekarma`` rebuilds them.
+    """
+
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="karma",
+    )
+    post_karma = models.IntegerField(default=0)
+    comment_karma = models.IntegerField(default=0)
+    total = models.IntegerField(default=0)
+    post_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+
+    objects = KarmaManager()
+
+    class Meta:
+        verbose_name_plural = "karma"
+        indexes = [models.Index(fields=["-total", "user"])]
+
+    def __str__(self) -> str:
+        return f"{self.user} ({self.total})"
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def create_karma(sender, instance, created, **kwargs):
+    """Give new users their karma record, so the leaderboard lists them.
+
+    Users inserted in bulk get theirs from the ingester or ``rekarma``.
+    """
+    if created:
+        Karma.objects.get_or_create(user=instance)
+
+
+def uncount(rows, field):
+    """Take one off ``field`` of ``rows``, leaving counts at zero alone.
+
+    A count can only be at zero on deleting what it counts if it had drifted
+    already, the ``recount`` and ``rekarma`` commands rebuild them.
+    """
+    rows.filter(**{f"{field}__gt": 0}).update(**{field: F(field) - 1})
+
+
+@receiver(post_delete, sender="posts.Post")
+def uncount_post(sender, instance, **kwargs):
+    uncount(Category.objects.filter(pk=instance.category_id), "post_count")
+    uncount(Karma.objects.filter(pk=instance.user_id), "post_count")
+    # Its votes went with it
+    if instance.score:
+        Karma.objects.adjust(instance.user_id, post=-instance.score)
+
+
+@receiver(post_delete, sender="posts.Comment")
+def uncount_comment(sender, instance, **kwargs):
+    uncount(Post.objects.filter(pk=instance.post_id), "comment_count")
+    if instance.reply_id is not None:
+        uncount(Comment.objects.filter(pk=instance.reply_id), "comment_count")
+    uncount(Karma.objects.filter(pk=instance.user_id), "comment_count")
+    if instance.score:
+        Karma.objects.adjust(instance.user_id, comment=-instance.score)
+    live.publish(instance.post_id, comments=-1)
+
+
+@receiver(post_save, sender="posts.Subscription")
+def count_subscription(sender, instance, created, **kwargs):
+    if created:
+        Category.objects.filter(pk=instance.category_id).update(
+            subscriber_count=F("subscriber_count") + 1
+        )
+
+
+@receiver(post_delete, sender="posts.Subscription")
+def uncount_subscription(sender, instance, **kwargs):
+    uncount(Category.objects.filter(pk=instance.category_id), "subscriber_count")
+
+
+class RollupManager(models.Manager):
+    def add(self, post_id, delta, now=None):
+        """Add ``delta`` to a post's net votes in the bucket holding ``now``."""
+        if not delta:
+            return
+        bucket = self.model.bucket_of(now or timezone.now())
+        add_or_create(
+            self.filter(post_id=post_id, bucket=bucket),
+            {"score": F("score") + delta},
+            post_id=post_id,
+            bucket=bucket,
+            score=delta,
+        )
+
+
+class VoteRollup(models.Model):
+    """The net votes a post received during one bucket of time.
+
+    Votes are added to the current hour as they're cast, and the
+    ``compactvotes`` command folds old hours into days. See ``posts.rollups``.
+    """
+
+    post = models.ForeignKey("Post", on_delete=models.CASCADE, related_name="+")
+    bucket = models.DateTimeField()
+    score = models.IntegerField(default=0)
+
+    objects = RollupManager()
+
+    class Meta:
+        abstract = True
+
+    def __str__(self) -> str:
+        return f"{self.post_id} {self.bucket:%Y-%m-%d %H:%M} ({self.score})"
+
+
+class HourlyVotes(VoteRollup):
+    class Meta:
+        verbose_name_plural = "hourly votes"
+        constraints = [
+            models.UniqueConstraint(fields=["post", "bucket"], name="unique_hour")
+        ]
+        indexes = [models.Index(fields=["bucket", "post"])]
+
+    @staticmethod
+    def bucket_of(moment):
+        return moment.replace(minute=0, second=0, microsecond=0)
+
+
+class DailyVotes(VoteRollup):
+    class Meta:
+        verbose_name_plural = "daily votes"
+        constraints = [
+            models.UniqueConstraint(fields=["post", "bucket"], name="unique_day")
+        ]
+        indexes = [models.Index(fields=["bucket", "post"])]
+
+    @staticmethod
+    def bucket_of(moment):
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
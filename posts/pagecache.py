@@ -0,0 +1,135 @@
+"""Whole page caching of the public listings for logged out visitors.
+
+Logged out visitors all get the same HTML for a URL, so ``anonymous_cache``
+keeps each page's response for ``PAGE_CACHE_TIMEOUT`` seconds. For a further
+``PAGE_CACHE_STALE`` seconds an expired page is still served, while the one
+request that wins a ``cache.add`` lock renders its replacement, so a hot page
+expiring sends one request to the database rather than every request that
+arrives until it's rebuilt. A page that isn't cached at all, after a deploy
+or a cache flush, is locked the same way: the other requests wait up to
+``MISS_WAIT`` seconds for it to be stored, then render it without storing it.
+
+Each cached page carries a strong ``ETag``, a hash of its content, and the
+``Cache-Control`` header tells proxies the same freshness rules. A request
+whose ``If-None-Match`` names the cached version gets a ``304 Not Modified``
+without the page being rendered or sent.
+"""
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+
+# Seconds a renderer holds a page's lock before others may try again
+LOCK_TIMEOUT = 30
+
+# Seconds a request waits for a missing page somebody else is rendering, and
+# how often it looks for it meanwhile
+MISS_WAIT = 2.0
+MISS_POLL = 0.05
+
+
+def page_key(request):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f"page:{path}"
+
+
+def render_page(view, request, args, kwargs, key, cache, timeout, stale, store=True):
+    """Render the page, caching it if it's a plain 200 and ``store`` is on."""
+    response = view(request, *args, **kwargs)
+    if (
+        response.status_code != 200
+        or response.streaming
+        or response.cookies
+        or response.has_header("Vary")
+    ):
+        return response, None
+    content = response.content
+    entry = {
+        "content": content,
+        "content_type": response["Content-Type"],
+        "etag": f'"{hashlib.md5(content).hexdigest()}"',
+        "fresh_until": time.time() + timeout,
+    }
+    if store:
+        cache.set(key, entry, timeout + stale)
+    return response, entry
+
+
+def respond(request, entry, timeout, stale, response=None):
+    if entry["etag"] in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+        response = HttpResponseNotModified()
+    elif response is None:
+        response = HttpResponse(entry["content"], content_type=entry["content_type"])
+    response["ETag"] = entry["etag"]
+    patch_cache_control(
+        response,
+        public=True,
+        max_age=max(round(entry["fresh_until"] - time.time()), 0),
+        stale_while_revalidate=stale,
+    )
+    # A visitor who logs in must not be handed the logged out page
+    patch_vary_headers(response, ["Cookie"])
+    return response
+
+
+def wait_for(cache, key, lock):
+    """The entry another request is storing under ``key``, if it's soon there."""
+    deadline = time.monotonic() + MISS_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(MISS_POLL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+        if cache.get(lock) is None:
+            # The renderer gave up, or its page couldn't be cached
+            return None
+    return None
+
+
+def anonymous_cache(view):
+    """Serve ``view``'s pages to logged out visitors from the page cache."""
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        timeout = getattr(settings, "PAGE_CACHE_TIMEOUT", 0)
+        stale = getattr(settings, "PAGE_CACHE_STALE", 0)
+        if (
+            timeout <= 0
+            or request.method not in ("GET", "HEAD")
+            or request.user.is_authenticated
+        ):
+            return view(request, *args, **kwargs)
+
+        cache = caches[getattr(settings, "PAGE_CACHE", "default")]
+        key = page_key(request)
+        entry = cache.get(key)
+        if entry is not None and entry["fresh_until"] > time.time():
+            return respond(request, entry, timeout, stale)
+
+        # Only one request renders a missing or stale page. The others serve
+        # the stale copy, or wait for the missing one and render it
+        # themselves, without storing it, if it doesn't turn up
+        lock = f"{key}:lock"
+        locked = cache.add(lock, True, LOCK_TIMEOUT)
+        if not locked:
+            if entry is None:
+                entry = wait_for(cache, key, lock)
+            if entry is not None:
+                return respond(request, entry, timeout, stale)
+        try:
+            response, fresh = render_page(
+                view, request, args, kwargs, key, cache, timeout, stale, locked
+            )
+        finally:
+            if locked:
+                cache.delete(lock)
+        if fresh is None:
+            return response
+        return respond(request, fresh, timeout, stale, response)
+
+    return wrapper
@@ -0,0 +1,148 @@
+"""Keyset pagination for listings too large to count or OFFSET through.
+
+Rather than numbered pages each page carries an opaque ``?after=`` token
+holding the ordering values of its last row, and the next page is fetched
+with a ``WHERE (ordering) < (token)`` range condition. Every page therefore
+costs the same as the first and no ``COUNT(*)`` is ever issued.
+"""
+import base64
+import binascii
+import datetime
+import json
+import uuid
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(values):
+    """An opaque, URL safe token for a list of JSON values."""
+    token = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(token).decode().rstrip("=")
+
+
+def decode_cursor(cursor, length):
+    """The ``length`` JSON values ``encode_cursor`` made ``cursor`` from."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError) as e:
+        raise InvalidCursor(cursor) from e
+    if not isinstance(values, list) or len(values) != length:
+        raise InvalidCursor(cursor)
+    return values
+
+
+class CursorPage:
+    def __init__(self, object_list, has_next, next_cursor, has_previous):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.next_cursor = next_cursor
+        self.has_previous = has_previous
+        self.next_query = ""
+        self.first_query = ""
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+
+class CursorPaginator:
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = per_page
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        # The primary key breaks ties so the ordering is total and stable
+        if ordering[-1].lstrip("-") not in ("pk", "id"):
+            ordering.append("-pk" if ordering[-1].startswith("-") else "pk")
+        self.ordering = ordering
+
+    def encode(self, item):
+        values = []
+        for field in self.ordering:
+            name = field.lstrip("-")
+            value = item[name] if isinstance(item, dict) else getattr(item, name)
+            if isinstance(value, (datetime.datetime, datetime.date)):
+                value = value.isoformat()
+            elif isinstance(value, uuid.UUID):
+                value = str(value)
+            values.append(value)
+        return encode_cursor(values)
+
+    def decode(self, cursor):
+        values = decode_cursor(cursor, len(self.ordering))
+        decoded = []
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip("-")
+            try:
+                model_field = self.queryset.model._meta.get_field(
+                    self.queryset.model._meta.pk.name if name == "pk" else name
+                )
+            except FieldDoesNotExist:
+                # Annotations are compared as plain JSON values
+                decoded.append(value)
+                continue
+            try:
+                decoded.append(model_field.to_python(value))
+            except ValidationError as e:
+                raise InvalidCursor(cursor) from e
+        return decoded
+
+    def after(self, values):
+        """Filter matching the rows that sort strictly after ``values``."""
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            condition |= Q(**equal, **{f"{name}__{lookup}": value})
+            equal[name] = value
+        return condition
+
+    def page(self, cursor=None):
+        queryset = self.queryset.order_by(*self.ordering)
+        if cursor:
+            queryset = queryset.filter(self.after(self.decode(cursor)))
+        # Fetching one extra row tells us whether there's a next page
+        rows = list(queryset[: self.per_page + 1])
+        has_next = len(rows) > self.per_page
+        rows = rows[: self.per_page]
+        next_cursor = self.encode(rows[-1]) if has_next else None
+        return CursorPage(rows, has_next, next_cursor, bool(cursor))
+
+    def get_page(self, cursor=None):
+        """Like ``page`` but falls back to the first page for a bad cursor."""
+        try:
+            return self.page(cursor)
+        except InvalidCursor:
+            return self.page()
+
+
+def paginate(request, queryset, per_page=50):
+    """Paginate ``queryset`` from the request's ``?after=`` token.
+
+    The returned page carries ready-made query strings for the first and next
+    pages which preserve any other parameters, such as the sort order.
+    """
+    page = CursorPaginator(queryset, per_page).get_page(request.GET.get("after"))
+    return link_page(request, page)
+
+
+def link_page(request, page):
+    """Fill in ``page``'s first and next page query strings for ``request``."""
+    query = request.GET.copy()
+    query.pop("after", None)
+    page.first_query = query.urlencode()
+    if page.has_next:
+        query["after"] = page.next_cursor
+        page.next_query = query.urlencode()
+    return page
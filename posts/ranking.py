@@ -0,0 +1,60 @@
+"""Ranking formulas for the precomputed sort columns on ``Post``.
+
+``hot`` only depends on a post's score and creation time, so it is fixed
+between votes and needs no periodic refresh. ``rising`` decays with age and is
+refreshed in bulk by the ``rerank`` management command.
+"""
+import math
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+
+# Reddit's epoch for the hot ranking, it keeps the age term a manageable size
+EPOCH = datetime(2005, 12, 8, 7, 46, 43, tzinfo=timezone.utc)
+
+# Posts older than this drop out of the rising listing altogether
+RISING_WINDOW = timedelta(days=1)
+
+SORTS = {
+    "hot": ("-hot", "-created_on"),
+    "new": ("-created_on",),
+    "top": ("-score", "-created_on"),
+    "rising": ("-rising", "-created_on"),
+    "controversial": ("-controversy", "-created_on"),
+}
+
+
+def hot(score, created_on):
+    order = math.log10(max(abs(score), 1))
+    sign = (score > 0) - (score < 0)
+    seconds = (created_on - EPOCH).total_seconds()
+    return round(sign * order + seconds / 45000, 7)
+
+
+def rising(score, created_on, now):
+    hours = max((now - created_on).total_seconds(), 0) / 3600
+    return score / (hours + 2) ** 1.8
+
+
+def controversy(upvotes, downvotes):
+    if upvotes <= 0 or downvotes <= 0:
+        return 0.0
+    balance = min(upvotes, downvotes) / max(upvotes, downvotes)
+    return (upvotes + downvotes) ** balance
+
+
+def ranks(score, upvotes, downvotes, created_on, now=None):
+    """Values for every ranking column of a post with the given counters."""
+    now = now or timezone.now()
+    return {
+        "hot": hot(score, created_on),
+        "rising": rising(score, created_on, now),
+        "controversy": controversy(upvotes, downvotes),
+    }
+
+
+def order(posts, sort):
+    """Order a queryset of posts for one of the ``SORTS`` listings."""
+    if sort == "rising":
+        posts = posts.filter(created_on__gte=timezone.now() - RISING_WINDOW)
+    return posts.order_by(*SORTS[sort])
@@ -0,0 +1,117 @@
+"""Routing reads of the listing views to read replicas.
+
+Writes always go to the ``default`` database, the primary. Views marked
+``read_from_replica`` read from one of the ``DATABASE_REPLICAS`` instead,
+one picked per request so a page never mixes two replicas' states. Reads
+anywhere else, and reads after the request has written, stay on the
+primary, as do sessions, which a replica lagging behind a login would lose.
+
+Replicas lag, so someone who just voted or commented would not see it on a
+replica. A request that writes sets a cookie that pins its browser to the
+primary for ``REPLICA_PIN_SECONDS``. ``ReplicaMiddleware`` reads the cookie,
+holds the request's routing state in a context variable and sets the
+cookie. The state is one mutable object, so writes made by the async views'
+database threads, which run in a copy of the request's context, still mark
+the request as having written.
+"""
+import functools
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+
+from jeddit.middleware import ContextMiddleware
+
+DEFAULT = "default"
+COOKIE = "primary_until"
+
+# Apps whose reads never go to a replica
+PRIMARY_APPS = {"sessions"}
+
+# The routing state of the request being handled, if any
+active = ContextVar("replica_routing", default=None)
+
+
+class Routing:
+    def __init__(self, pinned):
+        self.pinned = pinned
+        self.replica_reads = False
+        self.wrote = False
+        self.replica = None
+
+
+def replicas():
+    return getattr(settings, "DATABASE_REPLICAS", [])
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        routing = active.get()
+        if (
+            routing is None
+            or not routing.replica_reads
+            or routing.pinned
+            or routing.wrote
+            or model._meta.app_label in PRIMARY_APPS
+            or not replicas()
+        ):
+            return DEFAULT
+        if routing.replica is None:
+            routing.replica = random.choice(replicas())
+        return routing.replica
+
+    def db_for_write(self, model, **hints):
+        routing = active.get()
+        if routing is not None:
+            routing.wrote = True
+        return DEFAULT
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {DEFAULT, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+def read_from_replica(view):
+    """Let ``view`` read from a replica unless its visitor is pinned."""
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        routing = active.get()
+        if routing is None:
+            return view(request, *args, **kwargs)
+        routing.replica_reads = True
+        try:
+            response = view(request, *args, **kwargs)
+            # Template responses run their queries when they're rendered
+            if not getattr(response, "is_rendered", True):
+                response.render()
+            return response
+        finally:
+            routing.replica_reads = False
+
+    return wrapper
+
+
+class ReplicaMiddleware(ContextMiddleware):
+    context = active
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.pin = getattr(settings, "REPLICA_PIN_SECONDS", 5)
+
+    def start(self, request):
+        try:
+            pinned = float(request.COOKIES.get(COOKIE, 0)) > time.time()
+        except ValueError:
+            pinned = False
+        return Routing(pinned)
+
+    def finish(self, request, response, routing):
+        if routing.wrote:
+            until = time.time() + self.pin
+            response.set_cookie(COOKIE, f"{until:.3f}", max_age=self.pin)
+        return response
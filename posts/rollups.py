@@ -0,0 +1,135 @@
+"""Top listings over a window of time, answered from vote rollups.
+
+Summing the votes cast in the last week would read every one of them on
+each request. Instead the vote write paths add each post's net change to
+its ``HourlyVotes`` row for the current hour. The ``compactvotes`` command
+folds hours older than ``HOURLY_RETENTION`` into ``DailyVotes`` rows and
+drops days older than the longest window. A window then reads, for each
+post voted on during it, at most two days of hours plus one row per older
+day, rather than every vote.
+
+A window is only as precise as its oldest bucket: ``week`` counts the whole
+of the day it began in once that day has been compacted. Votes changed or
+retracted later count against the hour they were changed in.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import OuterRef, Q, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from posts import ranking
+from posts.models import DailyVotes, HourlyVotes, PostVote, total
+
+# The ?t= windows of the top listing, "all" ranks by the lifetime score
+WINDOWS = {
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+    "week": timedelta(weeks=1),
+    "month": timedelta(days=30),
+    "year": timedelta(days=365),
+    "all": None,
+}
+
+# Hours are folded into days once they're older than this
+HOURLY_RETENTION = timedelta(days=2)
+
+# Days older than the longest window are no longer read
+DAILY_RETENTION = max(span for span in WINDOWS.values() if span is not None)
+
+
+def top(posts, window, now=None):
+    """Order ``posts`` by the net votes they received during ``window``.
+
+    Posts nobody voted on during the window are left out.
+    """
+    span = WINDOWS[window]
+    if span is None:
+        return ranking.order(posts, "top")
+    since = (now or timezone.now()) - span
+    hourly = HourlyVotes.objects.filter(bucket__gte=HourlyVotes.bucket_of(since))
+    daily = DailyVotes.objects.filter(bucket__gte=DailyVotes.bucket_of(since))
+    return (
+        posts.filter(Q(pk__in=hourly.values("post")) | Q(pk__in=daily.values("post")))
+        .annotate(
+            window_score=total(hourly.filter(post=OuterRef("pk")), "SUM", "score")
+            + total(daily.filter(post=OuterRef("pk")), "SUM", "score")
+        )
+        .order_by("-window_score", "-created_on")
+    )
+
+
+def compact(now=None):
+    """Fold old hours into days and drop expired days.
+
+    Returns how many hourly rows were folded and daily rows dropped. Votes
+    only ever land in the current hour, so this doesn't race the writers.
+    """
+    now = now or timezone.now()
+    cutoff = DailyVotes.bucket_of(now - HOURLY_RETENTION)
+    with transaction.atomic():
+        hours = HourlyVotes.objects.filter(bucket__lt=cutoff)
+        days = {
+            (row["post"], row["day"]): row["total"]
+            for row in hours.annotate(day=TruncDay("bucket", tzinfo=timezone.utc))
+            .order_by()
+            .values("post", "day")
+            .annotate(total=Sum("score"))
+        }
+        updated = []
+        if days:
+            # Only days still being folded, so a handful at most
+            for row in DailyVotes.objects.filter(
+                bucket__gte=min(day for _, day in days)
+            ):
+                score = days.pop((row.post_id, row.bucket), None)
+                if score:
+                    row.score += score
+                    updated.append(row)
+        DailyVotes.objects.bulk_update(updated, ["score"])
+        DailyVotes.objects.bulk_create(
+            DailyVotes(post_id=post_id, bucket=day, score=score)
+            for (post_id, day), score in days.items()
+            if score
+        )
+        folded = hours.delete()[0]
+        dropped = DailyVotes.objects.filter(
+            bucket__lt=DailyVotes.bucket_of(now - DAILY_RETENTION)
+        ).delete()[0]
+    return folded, dropped
+
+
+def rebuild(now=None):
+    """Recompute every rollup from the post votes' creation times.
+
+    Returns how many hourly and daily rows were written. Unlike the
+    incremental totals, a changed vote counts in the hour it was first cast.
+    """
+    now = now or timezone.now()
+    cutoff = DailyVotes.bucket_of(now - HOURLY_RETENTION)
+    oldest = DailyVotes.bucket_of(now - DAILY_RETENTION)
+    counts = []
+    with transaction.atomic():
+        for model, trunc, votes in (
+            (HourlyVotes, TruncHour, PostVote.objects.filter(created_on__gte=cutoff)),
+            (
+                DailyVotes,
+                TruncDay,
+                PostVote.objects.filter(created_on__gte=oldest, created_on__lt=cutoff),
+            ),
+        ):
+            model.objects.all().delete()
+            rows = (
+                votes.annotate(bucket=trunc("created_on", tzinfo=timezone.utc))
+                .order_by()
+                .values("target", "bucket")
+                .annotate(total=Sum("choice"))
+                .exclude(total=0)
+            )
+            created = model.objects.bulk_create(
+                model(post_id=row["target"], bucket=row["bucket"], score=row["total"])
+                for row in rows
+            )
+            counts.append(len(created))
+    return tuple(counts)
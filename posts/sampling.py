@@ -0,0 +1,87 @@
+"""Random category picks for /r/random without sorting the table.
+
+``ORDER BY RANDOM()`` reads and sorts every category on each request.
+Instead each process keeps the slugs of all categories in a list, and picks
+an index into it. For weighted picks it also keeps the running totals of
+the categories' post counts, plus one so empty categories still come up,
+and bisects them. Either way a pick costs one cache read, of a short version
+string, and no queries.
+
+Creating, renaming or deleting a category through the model sets a new
+version once the transaction commits, and every process reloads its list
+on its next pick rather than on every one. Lists are also reloaded after
+``REFRESH`` seconds, which picks up changed post counts and categories
+removed by queryset deletes. A slug that's gone by the time it's followed
+gets the category page's 404.
+"""
+import bisect
+import itertools
+import random
+import threading
+import time
+import uuid
+
+from django.core.cache import cache
+
+VERSION_KEY = "random-categories:version"
+
+# Seconds a process keeps its list when no category has changed
+REFRESH = 600
+
+
+def new_version():
+    return uuid.uuid4().hex
+
+
+class Sampler:
+    def __init__(self):
+        self.entries = ((), ())
+        self.version = None
+        self.loaded = 0.0
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        version = cache.get_or_set(VERSION_KEY, new_version, None)
+        if version == self.version and time.monotonic() - self.loaded < REFRESH:
+            return
+        with self.lock:
+            if version == self.version and time.monotonic() - self.loaded < REFRESH:
+                return
+            from posts.models import Category
+
+            rows = list(
+                Category.objects.order_by("pk").values_list("slug", "post_count")
+            )
+            slugs = [slug for slug, _ in rows]
+            totals = list(itertools.accumulate(count + 1 for _, count in rows))
+            # Swapped in whole, so a pick never sees one list without the other
+            self.entries = (slugs, totals)
+            self.version = version
+            self.loaded = time.monotonic()
+
+    def choose(self, weighted=False):
+        """A random category slug, ``None`` when there are no categories.
+
+        ``weighted`` picks categories in proportion to their post counts.
+        """
+        self.refresh()
+        slugs, totals = self.entries
+        if not slugs:
+            return None
+        if weighted:
+            index = bisect.bisect_right(totals, random.random() * totals[-1])
+        else:
+            index = random.randrange(len(slugs))
+        return slugs[index]
+
+
+sampler = Sampler()
+
+
+def choose(weighted=False):
+    return sampler.choose(weighted)
+
+
+def changed():
+    """Have every process reload its list before its next pick."""
+    cache.set(VERSION_KEY, new_version(), None)
@@ -0,0 +1,288 @@
+"""Full-text search over post titles and bodies and comment text.
+
+Every post and comment has one row in a ``posts_search`` table that Django
+doesn't manage: an FTS5 virtual table on SQLite, or a table with a GIN
+indexed ``tsvector`` on PostgreSQL. It's created the first time it's needed.
+Other databases have no search.
+
+``Post.save`` and ``Comment.save`` index the object they save, and the
+ingester indexes each batch it writes. Deletes aren't followed, results
+whose object is gone are dropped when they're loaded, and the ``reindex``
+command rebuilds the table from scratch.
+
+Rows are keyed by the object's kind and UUID, as posts and comments don't
+share a key space, and numbered from a sequence for the cursor. On SQLite a
+``posts_search_key`` table maps each object to its row's FTS5 rowid, since
+the virtual table can only look rows up by that. Results are ranked by
+BM25 on SQLite and ``ts_rank_cd`` on PostgreSQL, weighting title matches
+above body ones, and paged with a cursor of the last row's rank and number.
+Tables created before the rows were keyed by kind have to be rebuilt with
+``reindex``.
+"""
+import re
+import uuid
+
+from django.db import connections, transaction
+
+from posts.pagination import CursorPage, InvalidCursor, decode_cursor, encode_cursor
+
+TABLE = "posts_search"
+TERMS = re.compile(r"\w+")
+
+
+def documents(objects):
+    """``(kind, pk, category_id, title, body)`` rows for posts and comments.
+
+    Comments are filed under their post's category, taken from a
+    ``category_id`` annotation or the cached post when there is one, and
+    otherwise looked up in one query for all of them.
+    """
+    from posts.models import Comment, Post
+
+    objects = list(objects)
+    comments = [obj for obj in objects if not isinstance(obj, Post)]
+    unknown = {
+        obj.post_id
+        for obj in comments
+        if not hasattr(obj, "category_id") and not Comment.post.is_cached(obj)
+    }
+    categories = {}
+    if unknown:
+        categories = dict(
+            Post.objects.filter(pk__in=unknown).values_list("pk", "category_id")
+        )
+    rows = []
+    for obj in objects:
+        if isinstance(obj, Post):
+            rows.append(("post", obj.pk, obj.category_id, obj.title, obj.body))
+            continue
+        if hasattr(obj, "category_id"):
+            category_id = obj.category_id
+        elif Comment.post.is_cached(obj):
+            category_id = obj.post.category_id
+        else:
+            category_id = categories.get(obj.post_id)
+        if category_id is not None:
+            rows.append(("comment", obj.pk, category_id, "", obj.content))
+    return rows
+
+
+# Databases whose table has been created by this process
+created = set()
+
+
+class Backend:
+    create = ()
+    tables = (TABLE,)
+
+    def __init__(self, using):
+        self.using = using
+
+    @property
+    def connection(self):
+        return connections[self.using]
+
+    def ensure(self, cursor):
+        name = self.connection.settings_dict["NAME"]
+        if name not in created:
+            for statement in self.create:
+                cursor.execute(statement)
+            # A rolled back transaction takes the table with it
+            transaction.on_commit(lambda: created.add(name), using=self.using)
+
+    def index(self, objects):
+        # One row per object, a statement can't write the same row twice
+        rows = list({row[:2]: row for row in documents(objects)}.values())
+        if not rows:
+            return
+        with self.connection.cursor() as cursor:
+            self.ensure(cursor)
+            for batch in self.batches(rows):
+                self.write(cursor, batch)
+
+    def batches(self, rows):
+        """``rows`` in slices that fit within a statement's parameter limit."""
+        # Written with one more column, their number
+        size = self.connection.ops.bulk_batch_size(
+            ["column"] * (len(rows[0]) + 1), rows
+        )
+        for start in range(0, len(rows), size):
+            yield rows[start : start + size]
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            self.ensure(cursor)
+            for table in self.tables:
+                cursor.execute(f"DELETE FROM {table}")
+
+    def search(self, query, category_id=None, after=None, limit=50):
+        """One page of ``(kind, pk)`` matches, best first, and the next cursor.
+
+        ``after`` is the cursor of the previous page.
+        """
+        terms = TERMS.findall(query)
+        if not terms:
+            return [], None
+        sql, params = self.matches(terms)
+        if category_id is not None:
+            sql += " AND category_id = %s"
+            params.append(category_id)
+        sql = f"SELECT * FROM ({sql}) AS matches"
+        if after:
+            values = decode_cursor(after, 2)
+            if not all(isinstance(value, (int, float)) for value in values):
+                raise InvalidCursor(after)
+            sql += " WHERE rank > %s OR (rank = %s AND id > %s)"
+            params += [values[0], values[0], values[1]]
+        sql += " ORDER BY rank, id LIMIT %s"
+        params.append(limit + 1)
+        with self.connection.cursor() as cursor:
+            self.ensure(cursor)
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor([rows[-1][3], rows[-1][0]])
+        # SQLite hands back the UUIDs as the hex they were stored as
+        return (
+            [
+                (kind, pk if isinstance(pk, uuid.UUID) else uuid.UUID(pk))
+                for _, kind, pk, _ in rows
+            ],
+            next_cursor,
+        )
+
+
+class SQLiteBackend(Backend):
+    KEYS = f"{TABLE}_key"
+
+    create = (
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+        "title, body, kind UNINDEXED, object_id UNINDEXED, "
+        "category_id UNINDEXED, tokenize = 'porter unicode61')",
+        f"CREATE TABLE IF NOT EXISTS {KEYS} (id integer PRIMARY KEY, "
+        "object_id text NOT NULL, kind text NOT NULL, UNIQUE (object_id, kind))",
+    )
+    tables = (TABLE, KEYS)
+
+    def write(self, cursor, rows):
+        # Single statements rather than executemany, which the debug
+        # toolbar's SQL panel can't format
+        objects = [(pk.hex, kind) for kind, pk, *_ in rows]
+        cursor.execute(
+            f"INSERT OR IGNORE INTO {self.KEYS} (object_id, kind) VALUES "
+            + ", ".join(["(%s, %s)"] * len(rows)),
+            [value for pair in objects for value in pair],
+        )
+        cursor.execute(
+            f"SELECT object_id, kind, id FROM {self.KEYS} "
+            f"WHERE object_id IN ({', '.join(['%s'] * len(rows))})",
+            [object_id for object_id, _ in objects],
+        )
+        keys = {(object_id, kind): id for object_id, kind, id in cursor.fetchall()}
+        ids = [keys[pair] for pair in objects]
+        cursor.execute(
+            f"DELETE FROM {TABLE} WHERE rowid IN ({', '.join(['%s'] * len(rows))})",
+            ids,
+        )
+        cursor.execute(
+            f"INSERT INTO {TABLE} (rowid, kind, object_id, category_id, title, body) "
+            "VALUES " + ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(rows)),
+            [
+                value
+                for id, (kind, pk, category, *text) in zip(ids, rows)
+                for value in (id, kind, pk.hex, category, *text)
+            ],
+        )
+
+    def matches(self, terms):
+        # Quoted, the terms can't be read as FTS5 operators
+        query = " ".join(f'"{term}"' for term in terms)
+        return (
+            f"SELECT rowid AS id, kind, object_id, bm25({TABLE}, 10.0, 1.0) AS rank "
+            f"FROM {TABLE} WHERE {TABLE} MATCH %s",
+            [query],
+        )
+
+
+class PostgresBackend(Backend):
+    create = (
+        f"CREATE SEQUENCE IF NOT EXISTS {TABLE}_id",
+        f"CREATE TABLE IF NOT EXISTS {TABLE} ("
+        "id bigint PRIMARY KEY, kind varchar(7) NOT NULL, object_id uuid NOT NULL, "
+        "category_id integer NOT NULL, document tsvector NOT NULL)",
+        f"CREATE UNIQUE INDEX IF NOT EXISTS {TABLE}_object "
+        f"ON {TABLE} (kind, object_id)",
+        f"CREATE INDEX IF NOT EXISTS {TABLE}_document ON {TABLE} USING gin (document)",
+    )
+
+    def write(self, cursor, rows):
+        values = (
+            f"(nextval('{TABLE}_id'), %s, %s, %s, "
+            "setweight(to_tsvector('english', %s), 'A') || "
+            "setweight(to_tsvector('english', %s), 'B'))"
+        )
+        cursor.execute(
+            f"INSERT INTO {TABLE} (id, kind, object_id, category_id, document) "
+            "VALUES " + ", ".join([values] * len(rows)) + " "
+            "ON CONFLICT (kind, object_id) DO UPDATE SET "
+            "document = EXCLUDED.document, category_id = EXCLUDED.category_id",
+            [value for row in rows for value in row],
+        )
+
+    def matches(self, terms):
+        # Negated so that, as with BM25, lower ranks are better
+        return (
+            "SELECT id, kind, object_id, -ts_rank_cd(document, query) AS rank "
+            f"FROM {TABLE}, plainto_tsquery('english', %s) AS query "
+            "WHERE document @@ query",
+            [" ".join(terms)],
+        )
+
+
+BACKENDS = {"sqlite": SQLiteBackend, "postgresql": PostgresBackend}
+
+
+def backend(using="default"):
+    """The search backend of a database, ``None`` if it has no search."""
+    found = BACKENDS.get(connections[using].vendor)
+    return found(using) if found else None
+
+
+def index(objects, using="default"):
+    """Add or replace the rows of some posts and comments."""
+    found = backend(using)
+    if found is not None:
+        found.index(objects)
+
+
+def find(query, category=None, after=None, limit=50, using="default"):
+    """A page of the posts and comments matching ``query``, best first.
+
+    Each result has its ``search_kind`` set to "post" or "comment". Raises
+    ``InvalidCursor`` for an ``after`` that isn't one of this page's cursors.
+    """
+    from posts.models import Comment, Post
+
+    found = backend(using)
+    if found is None:
+        return CursorPage([], False, None, bool(after))
+    matches, next_cursor = found.search(
+        query, category.pk if category else None, after, limit
+    )
+    loaded = {
+        "post": Post.objects.select_related("user", "category").in_bulk(
+            [pk for kind, pk in matches if kind == "post"]
+        ),
+        "comment": Comment.objects.select_related("user", "post").in_bulk(
+            [pk for kind, pk in matches if kind == "comment"]
+        ),
+    }
+    results = []
+    for kind, pk in matches:
+        obj = loaded[kind].get(pk)
+        if obj is not None:
+            obj.search_kind = kind
+            results.append(obj)
+    return CursorPage(results, next_cursor is not None, next_cursor, bool(after))
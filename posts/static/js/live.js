@@ -0,0 +1,40 @@
+// Keeps the scores and comment counts of the posts on the page current, from
+// the changes streamed by posts.live. Without an ASGI server the stream 404s
+// and the page stays as it was rendered.
+(function () {
+  var ids = [];
+  document.querySelectorAll("[data-post]").forEach(function (post) {
+    var id = post.getAttribute("data-post");
+    if (ids.indexOf(id) === -1) {
+      ids.push(id);
+    }
+  });
+  if (!ids.length || !window.EventSource) {
+    return;
+  }
+
+  function bump(elements, delta) {
+    if (!delta) {
+      return;
+    }
+    elements.forEach(function (element) {
+      element.textContent = parseInt(element.textContent, 10) + delta;
+    });
+  }
+
+  var since = document.body.getAttribute("data-live-since");
+  var source = new EventSource(
+    "/live?posts=" + ids.join(",") + "&since=" + encodeURIComponent(since)
+  );
+  source.addEventListener("counts", function (event) {
+    var deltas = JSON.parse(event.data);
+    Object.keys(deltas).forEach(function (id) {
+      document
+        .querySelectorAll('[data-post="' + id + '"]')
+        .forEach(function (post) {
+          bump(post.querySelectorAll(".score"), deltas[id].score);
+          bump(post.querySelectorAll(".comment_count"), deltas[id].comments);
+        });
+    });
+  });
+})();
@@ -1,3 +1,1666 @@
-from django.test import TestCase
+import asyncio
+import json
+import sys
+import tempfile
+import time
+import unittest
+import uuid
+import warnings
+from datetime import datetime, timedelta
+from html.parser import HTMLParser
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.core.cache.backends.base import CacheKeyWarning
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import (
+    Client,
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from jeddit import instrumentation
+from jeddit.middleware import ContextMiddleware
+from posts import (
+    comments,
+    feeds,
+    live,
+    pagecache,
+    ranking,
+    replicas,
+    rollups,
+    sampling,
+    search,
+    votebuffer,
+)
+from posts.ingest import Ingester, iter_records
+from posts.management.commands import generate
+from posts.templatetags import fragments
+from posts.models import (
+    Category,
+    Comment,
+    CommentVote,
+    Counters,
+    DailyVotes,
+    GenericFavourite,
+    GenericVote,
+    HourlyVotes,
+    Karma,
+    Post,
+    PostFavourite,
+    PostVote,
+    Subscription,
+    Vote,
+)
+from posts.pagination import CursorPaginator, InvalidCursor, encode_cursor
+from posts.viewer import attach_viewer_state
+
+# The scrapy project sits beside the Django one, with its own requirements
+sys.path.append(str(settings.BASE_DIR) + "/scraper")
+try:
+    import scrapy
+    from scrapy.http import HtmlResponse
+    from scraper.pipelines import DjangoPipeline
+    from scraper.spiders.example import FIXTURES, ROOT, PostSpider
+except ImportError:
+    scrapy = None
+
+
+def setUpModule():
+    # Created inside a test's transaction, SQLite's FTS5 table breaks the
+    # savepoint rolling the test back
+    with connection.cursor() as cursor:
+        search.backend().ensure(cursor)
+
+
+class PostFixture:
+    """A user logged in on the test client, a category and a post of theirs."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user("author", password="password")
+        self.category = Category.objects.create(name="python", description="")
+        self.post = self.make_post("A post")
+        self.client.force_login(self.user)
+
+    def make_post(self, title, **kwargs):
+        return Post.objects.create(
+            title=title, category=self.category, user=self.user, **kwargs
+        )
+
+    def make_comment(self, content, reply=None):
+        return Comment.objects.create(
+            content=content, post=self.post, user=self.user, reply=reply
+        )
+
+
+class StaleSaveTests(PostFixture, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.voter = User.objects.create_user("voter", password="password")
+
+    def test_saving_a_stale_post_keeps_its_counters_and_ranks(self):
+        stale = Post.objects.get(pk=self.post.pk)
+        PostVote.objects.cast(self.voter, self.post, Vote.Choice.UP)
+        voted = Post.objects.get(pk=self.post.pk)
+
+        stale.title = "An edited post"
+        stale.save()
+
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(post.title, "An edited post")
+        self.assertEqual(post.slug, "an-edited-post")
+        self.assertEqual((post.score, post.upvotes), (1, 1))
+        self.assertEqual(post.hot, voted.hot)
+
+    def test_saving_a_stale_comment_keeps_its_reply_slots(self):
+        parent = self.make_comment("A")
+        stale = Comment.objects.get(pk=parent.pk)
+        first = self.make_comment("B", parent)
+
+        stale.content = "An edited comment"
+        stale.save()
+        Post.objects.get(pk=self.post.pk).save()
+        second = self.make_comment("C", parent)
+
+        self.assertNotEqual(first.path, second.path)
+        parent.refresh_from_db()
+        self.assertEqual((parent.comment_count, parent.reply_sequence), (2, 2))
+        self.assertEqual(parent.content, "An edited comment")
+
+
+class CommentTreeTests(PostFixture, TestCase):
+    def setUp(self):
+        super().setUp()
+        # A: B (C: D: E), F, G; H; I
+        self.a = self.make_comment("A")
+        b = self.make_comment("B", self.a)
+        self.c = self.make_comment("C", b)
+        self.d = self.make_comment("D", self.c)
+        self.make_comment("E", self.d)
+        self.make_comment("F", self.a)
+        self.make_comment("G", self.a)
+        self.make_comment("H")
+        self.make_comment("I")
+
+    def test_loads_in_one_query(self):
+        with self.assertNumQueries(1):
+            tree = comments.load_comment_tree(self.post, sort="new")
+        self.assertEqual([c.content for c in tree], ["I", "H", "A"])
+
+    def test_breadth_leaves_more_replies_stubs(self):
+        tree = comments.load_comment_tree(self.post, sort="new", breadth=2)
+        self.assertEqual(
+            ([c.content for c in tree], tree.more_replies), (["I", "H"], 1)
+        )
+        tree = comments.load_comment_tree(
+            self.post, sort="new", root=self.a.pk, breadth=2
+        )
+        (a,) = tree
+        self.assertEqual([c.content for c in a.children], ["G", "F"])
+        self.assertEqual(a.more_replies, 1)
+
+    def test_depth_leaves_continue_thread_stubs(self):
+        tree = comments.load_comment_tree(
+            self.post, sort="new", root=self.c.pk, depth=2
+        )
+        (c,) = tree
+        (d,) = c.children
+        self.assertEqual((d.content, d.children, d.continue_thread), ("D", [], True))
+        self.assertFalse(c.continue_thread)
+
+    def test_post_detail_links_the_stubs(self):
+        CommentVote.objects.cast(self.user, self.a, Vote.Choice.UP)
+        response = self.client.get(self.post.get_absolute_url() + "?limit=2")
+        self.assertContains(response, "load 1 more comment<")
+        self.assertContains(response, "load 1 more reply")
+        response = self.client.get(self.d.get_absolute_url())
+        self.assertEqual(response.context["comments"].root, self.d)
+        response = self.client.get(self.post.get_absolute_url() + "notauuid/")
+        self.assertEqual(response.status_code, 404)
+
+    def test_replies_past_the_depth_limit_are_refused(self):
+        deep = Comment.objects.create(
+            content="Deep",
+            post=self.post,
+            user=self.user,
+            path="z" * Comment._meta.get_field("path").max_length,
+            depth=Comment.max_depth() - 1,
+        )
+        url = f"/{self.post.pk}/comment"
+        response = self.client.post(url, {"content": "Deeper", "reply": deep.pk})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(url, {"content": "Fine", "reply": self.d.pk})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.d.replies.count(), 2)
+
+
+class RankingTests(PostFixture, TestCase):
+    def test_hot(self):
+        # A day and a half after the epoch every 45000 seconds adds one
+        created_on = ranking.EPOCH + timedelta(seconds=45000)
+        self.assertEqual(ranking.hot(10, created_on), 2.0)
+        self.assertEqual(ranking.hot(100, created_on), 3.0)
+        self.assertEqual(ranking.hot(0, created_on), 1.0)
+        self.assertEqual(ranking.hot(-10, created_on), 0.0)
+
+    def test_rising(self):
+        now = timezone.now()
+        # 10 / (2 + 2) ** 1.8
+        self.assertAlmostEqual(
+            ranking.rising(10, now - timedelta(hours=2), now), 0.8247, places=4
+        )
+        self.assertAlmostEqual(ranking.rising(10, now, now), 2.8717, places=4)
+        # Clock skew doesn't make a post younger than new
+        self.assertEqual(
+            ranking.rising(10, now + timedelta(hours=1), now),
+            ranking.rising(10, now, now),
+        )
+
+    def test_controversy(self):
+        self.assertEqual(ranking.controversy(10, 10), 20.0)
+        self.assertAlmostEqual(ranking.controversy(10, 5), 15**0.5)
+        self.assertEqual(ranking.controversy(10, 0), 0.0)
+
+    def test_votes_rerank(self):
+        voter = User.objects.create_user("voter", password="password")
+        PostVote.objects.cast(self.user, self.post, Vote.Choice.UP)
+        PostVote.objects.cast(voter, self.post, Vote.Choice.DOWN)
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(post.hot, ranking.hot(0, post.created_on))
+        self.assertEqual(post.controversy, 2.0)
+
+        PostVote.objects.cast(voter, self.post, Vote.Choice.UP)
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(post.hot, ranking.hot(2, post.created_on))
+        self.assertEqual(post.controversy, 0.0)
+        self.assertGreater(post.rising, 0)
+
+    def listing(self, query):
+        response = self.client.get(f"/?{query}")
+        titles = [post.title for post in response.context["page_obj"]]
+        return response.context["sort"], titles
+
+    def test_sorts(self):
+        now = timezone.now()
+        self.make_post("B")
+        self.make_post("C")
+        for title, hours, score, hot, rising, controversy in (
+            ("A post", 3, 1, 3, 2, 0),
+            ("B", 2, 3, 1, 0.5, 5),
+            ("C", 30, 2, 2, 3, 1),
+        ):
+            Post.objects.filter(title=title).update(
+                created_on=now - timedelta(hours=hours),
+                score=score,
+                hot=hot,
+                rising=rising,
+                controversy=controversy,
+            )
+
+        self.assertEqual(self.listing(""), ("hot", ["A post", "C", "B"]))
+        self.assertEqual(self.listing("sort=bogus"), ("hot", ["A post", "C", "B"]))
+        self.assertEqual(self.listing("sort=new"), ("new", ["B", "A post", "C"]))
+        self.assertEqual(self.listing("sort=top"), ("top", ["B", "C", "A post"]))
+        # Older than a day, C has stopped rising
+        self.assertEqual(self.listing("sort=rising"), ("rising", ["A post", "B"]))
+        self.assertEqual(
+            self.listing("sort=controversial"), ("controversial", ["B", "C", "A post"])
+        )
+
+        # A window on its own means the top listing, whatever the window
+        for query in ("t=", "t=all", "t=bogus"):
+            self.assertEqual(self.listing(query), ("top", ["B", "C", "A post"]))
+        HourlyVotes.objects.add(self.post.pk, 1)
+        self.assertEqual(self.listing("t=day"), ("top", ["A post"]))
+        self.assertEqual(self.listing("sort=new&t=day"), ("new", ["B", "A post", "C"]))
+
+
+class ViewerStateTests(PostFixture, TestCase):
+    def test_queries_are_per_model_not_per_row(self):
+        few = [self.post] + [self.make_post(f"Post {n}") for n in range(2)]
+        many = few + [self.make_post(f"More {n}") for n in range(30)]
+        PostVote.objects.cast(self.user, many[-1], Vote.Choice.UP)
+        for page in (few, many):
+            # The votes and the favourites
+            with self.assertNumQueries(2):
+                attach_viewer_state(self.user, page)
+        self.assertTrue(many[-1].upvoted)
+        comment = self.make_comment("A comment")
+        with self.assertNumQueries(3):
+            attach_viewer_state(self.user, many + [comment])
+
+    def test_posts_and_comments_sharing_a_key(self):
+        comment = Comment.objects.create(
+            id=self.post.pk, content="Same key", post=self.post, user=self.user
+        )
+        PostVote.objects.cast(self.user, self.post, Vote.Choice.UP)
+        CommentVote.objects.cast(self.user, comment, Vote.Choice.DOWN)
+        self.client.get(f"/{self.post.pk}/save?next=/")
+
+        post, comment = attach_viewer_state(
+            self.user,
+            [Post.objects.get(pk=self.post.pk), Comment.objects.get(pk=comment.pk)],
+        )
+        self.assertEqual(
+            (post.upvoted, post.downvoted, post.has_saved), (True, False, True)
+        )
+        self.assertEqual(
+            (comment.upvoted, comment.downvoted, comment.has_saved),
+            (False, True, False),
+        )
+
+    def test_anonymous_viewers_cost_nothing(self):
+        for user in (None, AnonymousUser()):
+            with self.assertNumQueries(0):
+                (post,) = attach_viewer_state(user, [self.post])
+            self.assertFalse(post.upvoted or post.downvoted or post.has_saved)
+
+
+class PaginationTests(PostFixture, TestCase):
+    def setUp(self):
+        super().setUp()
+        # Seven posts in three runs of equal scores, all posted at once
+        for number in range(6):
+            self.make_post(f"Post {number}")
+        for number, post in enumerate(Post.objects.all()):
+            Post.objects.filter(pk=post.pk).update(
+                score=number % 3, created_on=self.post.created_on
+            )
+
+    def walk(self, paginator):
+        """Every row from following the cursors, and how many pages there were."""
+        rows, pages, cursor = [], 0, None
+        while True:
+            page = paginator.page(cursor)
+            rows += page.object_list
+            pages += 1
+            if not page.has_next:
+                return rows, pages
+            cursor = page.next_cursor
+
+    def test_ties_are_neither_skipped_nor_repeated(self):
+        posts = ranking.order(Post.objects.all(), "top")
+        rows, pages = self.walk(CursorPaginator(posts, 2))
+        self.assertEqual(pages, 4)
+        self.assertEqual(len(set(rows)), 7)
+        self.assertEqual(rows, list(posts.order_by("-score", "-created_on", "-pk")))
+
+    def test_cursor_round_trip(self):
+        paginator = CursorPaginator(ranking.order(Post.objects.all(), "top"), 3)
+        first = paginator.page()
+        second = paginator.page(first.next_cursor)
+        self.assertEqual(paginator.encode(first[-1]), first.next_cursor)
+        self.assertTrue(second.has_previous)
+        self.assertLessEqual(second[0].score, first[-1].score)
+
+    def test_invalid_cursors_fall_back_to_the_first_page(self):
+        paginator = CursorPaginator(ranking.order(Post.objects.all(), "top"), 3)
+        for cursor in ("garbage", encode_cursor([1]), encode_cursor([1, "x", "y"])):
+            with self.assertRaises(InvalidCursor):
+                paginator.page(cursor)
+            self.assertEqual(list(paginator.get_page(cursor)), list(paginator.page()))
+        response = self.client.get("/?sort=top&after=garbage")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context["page_obj"].has_previous)
+
+    def test_next_links_keep_the_sort(self):
+        Post.objects.bulk_create(
+            Post(
+                title=f"Bulk {number}",
+                slug=f"bulk-{number}",
+                category=self.category,
+                user=self.user,
+                created_on=self.post.created_on,
+            )
+            for number in range(50)
+        )
+        first = self.client.get("/?sort=new").context["page_obj"]
+        self.assertIn("sort=new", first.next_query)
+        second = self.client.get(f"/?{first.next_query}").context["page_obj"]
+        self.assertFalse(second.has_next)
+        seen = [post.pk for post in first] + [post.pk for post in second]
+        self.assertEqual(len(seen), 57)
+        self.assertEqual(len(set(seen)), 57)
+
+    def test_windowed_listing_pages(self):
+        for number, post in enumerate(Post.objects.all()):
+            HourlyVotes.objects.add(post.pk, 1 + number % 2)
+        posts = rollups.top(Post.objects.all(), "day")
+        rows, pages = self.walk(CursorPaginator(posts, 3))
+        self.assertEqual(pages, 3)
+        self.assertEqual(len(set(rows)), 7)
+        self.assertEqual([row.window_score for row in rows], [2, 2, 2, 1, 1, 1, 1])
+
+
+@override_settings(VOTE_BUFFER=True)
+class VoteBufferTests(PostFixture, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.voter = User.objects.create_user("voter", password="password")
+        self.client.force_login(self.voter)
+        # Flushed by the tests rather than a background thread
+        self.buffer = votebuffer.VoteBuffer(size=100)
+        self.buffer.thread = False
+        previous, votebuffer.buffer = votebuffer.buffer, self.buffer
+        self.addCleanup(setattr, votebuffer, "buffer", previous)
+
+    def scores(self):
+        self.post.refresh_from_db()
+        return self.post.score, self.post.upvotes, self.post.downvotes
+
+    def test_bursts_coalesce_into_the_last_choice(self):
+        for action in ("upvote", "downvote", "unvote", "upvote"):
+            self.client.get(f"/{self.post.pk}/{action}?next=/")
+        self.assertEqual(len(self.buffer.pending), 1)
+        self.assertEqual(self.scores(), (0, 0, 0))
+
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(self.scores(), (1, 1, 0))
+        self.assertEqual(
+            list(PostVote.objects.values_list("user", "choice")),
+            [(self.voter.pk, Vote.Choice.UP)],
+        )
+        self.assertEqual(Karma.objects.get(user=self.user).post_karma, 1)
+
+    def test_unwritten_votes_are_overlaid(self):
+        self.client.get(f"/{self.post.pk}/upvote?next=/")
+        self.assertContains(self.client.get("/"), "upvoter upvoted")
+        self.assertFalse(PostVote.objects.exists())
+
+        self.buffer.flush()
+        self.assertEqual(self.buffer.overlay(self.voter.pk, Post, [self.post.pk]), {})
+        self.assertContains(self.client.get("/"), "upvoter upvoted")
+
+    def test_unvote_retracts_a_written_vote(self):
+        PostVote.objects.cast(self.voter, self.post, Vote.Choice.DOWN)
+        self.client.get(f"/{self.post.pk}/unvote?next=/")
+        self.assertEqual(
+            self.buffer.overlay(self.voter.pk, Post, [self.post.pk]),
+            {self.post.pk: None},
+        )
+        self.assertNotContains(self.client.get("/"), "downvoter downvoted")
+
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertFalse(PostVote.objects.exists())
+        self.assertEqual(self.scores(), (0, 0, 0))
+
+    def test_votes_on_missing_targets_are_dropped(self):
+        gone = self.make_post("Gone")
+        self.client.get(f"/{gone.pk}/upvote?next=/")
+        self.client.get(f"/{self.post.pk}/upvote?next=/")
+        gone.delete()
+
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(
+            list(PostVote.objects.values_list("target", flat=True)), [self.post.pk]
+        )
+        self.assertEqual(self.buffer.pending, {})
+
+    def test_a_full_buffer_flushes(self):
+        self.buffer.size = 2
+        second = self.make_post("Second")
+        self.client.get(f"/{self.post.pk}/upvote?next=/")
+        self.assertFalse(PostVote.objects.exists())
+        self.client.get(f"/{second.pk}/upvote?next=/")
+        self.assertEqual(PostVote.objects.count(), 2)
+
+
+@override_settings(PAGE_CACHE_TIMEOUT=30, PAGE_CACHE_STALE=60)
+class PageCacheTests(PostFixture, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = caches[settings.PAGE_CACHE]
+        self.cache.clear()
+        self.anonymous = Client()
+
+    def test_conditional_requests(self):
+        response = self.anonymous.get("/")
+        self.assertEqual(response["Vary"], "Cookie")
+        self.assertIn("public", response["Cache-Control"])
+        etag = response["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.anonymous.get("/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        response = self.anonymous.get("/", HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual((response.status_code, response["ETag"]), (200, etag))
+
+    def test_cached_until_it_expires(self):
+        self.anonymous.get("/")
+        fresh = self.make_post("Fresh")
+        self.assertNotContains(self.anonymous.get("/"), fresh.title)
+        self.assertContains(self.anonymous.get("/?sort=new"), fresh.title)
+
+    def test_logged_in_pages_are_never_cached(self):
+        response = self.client.get("/")
+        self.assertContains(response, "Logout")
+        self.assertFalse(response.has_header("ETag"))
+
+        response = self.anonymous.get("/")
+        self.assertNotContains(response, "Logout")
+        self.assertNotContains(response, "/save?next=")
+        self.assertContains(self.client.get("/"), "Logout")
+
+    def test_one_request_revalidates_a_stale_page(self):
+        self.anonymous.get("/")
+        fresh = self.make_post("Fresh")
+        key = pagecache.page_key(RequestFactory().get("/"))
+        entry = self.cache.get(key)
+        entry["fresh_until"] = 0
+        self.cache.set(key, entry)
+
+        # Somebody else is rendering it, the stale copy is served meanwhile
+        self.cache.add(f"{key}:lock", True)
+        with self.assertNumQueries(0):
+            response = self.anonymous.get("/")
+        self.assertNotContains(response, fresh.title)
+
+        self.cache.delete(f"{key}:lock")
+        self.assertContains(self.anonymous.get("/"), fresh.title)
+        self.assertIsNone(self.cache.get(f"{key}:lock"))
+        self.assertGreater(self.cache.get(key)["fresh_until"], 0)
+
+    def test_one_request_renders_a_missing_page(self):
+        key = pagecache.page_key(RequestFactory().get("/"))
+        self.cache.add(f"{key}:lock", True)
+        rendered = {
+            "content": b"Rendered elsewhere",
+            "content_type": "text/html",
+            "etag": '"elsewhere"',
+            "fresh_until": time.time() + 30,
+        }
+
+        # The renderer stores the page while this request waits for it
+        def sleep(seconds):
+            self.cache.set(key, rendered)
+
+        with mock.patch.object(pagecache.time, "sleep", sleep):
+            with self.assertNumQueries(0):
+                response = self.anonymous.get("/")
+        self.assertEqual(response.content, b"Rendered elsewhere")
+
+        # It never turns up, so the waiting request renders its own copy
+        self.cache.delete(key)
+        with mock.patch.object(pagecache, "MISS_WAIT", 0.01):
+            response = self.anonymous.get("/")
+        self.assertContains(response, self.post.title)
+        self.assertIsNone(self.cache.get(key))
+
+        # Only the lock's holder stores it
+        self.cache.delete(f"{key}:lock")
+        self.anonymous.get("/")
+        self.assertIsNotNone(self.cache.get(key))
+        self.assertIsNone(self.cache.get(f"{key}:lock"))
+
+
+class RollupTests(PostFixture, TestCase):
+    now = datetime(2026, 1, 15, 12, 30, tzinfo=timezone.utc)
+
+    def setUp(self):
+        super().setUp()
+        self.old = self.make_post("Old")
+
+    def test_compaction_folds_hours_into_days(self):
+        three_days = self.now - timedelta(days=3)
+        HourlyVotes.objects.add(self.post.pk, 2, three_days)
+        HourlyVotes.objects.add(self.post.pk, 3, three_days + timedelta(hours=1))
+        HourlyVotes.objects.add(self.post.pk, 1, self.now - timedelta(hours=1))
+        DailyVotes.objects.add(self.post.pk, 4, three_days)
+        DailyVotes.objects.add(self.old.pk, 1, self.now - timedelta(days=400))
+
+        self.assertEqual(rollups.compact(self.now), (2, 1))
+        self.assertEqual(
+            list(DailyVotes.objects.values_list("post", "bucket", "score")),
+            [(self.post.pk, DailyVotes.bucket_of(three_days), 9)],
+        )
+        self.assertEqual(list(HourlyVotes.objects.values_list("score", flat=True)), [1])
+        self.assertEqual(rollups.compact(self.now), (0, 0))
+
+    def test_windows(self):
+        HourlyVotes.objects.add(self.post.pk, 3, self.now - timedelta(hours=2))
+        DailyVotes.objects.add(self.old.pk, 5, self.now - timedelta(days=3))
+        DailyVotes.objects.add(self.old.pk, -1, self.now - timedelta(days=20))
+
+        def titles(window):
+            return [
+                post.title for post in rollups.top(Post.objects.all(), window, self.now)
+            ]
+
+        self.assertEqual(titles("hour"), [])
+        self.assertEqual(titles("day"), ["A post"])
+        self.assertEqual(titles("week"), ["Old", "A post"])
+        self.assertEqual(
+            [
+                post.window_score
+                for post in rollups.top(Post.objects.all(), "month", self.now)
+            ],
+            [4, 3],
+        )
+
+    def test_rebuild_from_vote_times(self):
+        voter = User.objects.create_user("voter", password="password")
+        PostVote.objects.cast(voter, self.post, Vote.Choice.UP)
+        PostVote.objects.cast(voter, self.old, Vote.Choice.DOWN)
+        PostVote.objects.filter(target=self.old).update(
+            created_on=timezone.now() - timedelta(days=3)
+        )
+        HourlyVotes.objects.all().delete()
+
+        self.assertEqual(rollups.rebuild(), (1, 1))
+        self.assertEqual(
+            list(DailyVotes.objects.values_list("post", "score")), [(self.old.pk, -1)]
+        )
+        self.assertEqual(
+            list(HourlyVotes.objects.values_list("post", "score")),
+            [(self.post.pk, 1)],
+        )
+
+
+class SamplingTests(PostFixture, TestCase):
+    def setUp(self):
+        super().setUp()
+        Category.objects.create(name="django")
+        self.sampler = sampling.Sampler()
+        sampling.changed()
+
+    def test_unweighted(self):
+        with mock.patch("random.randrange", return_value=1) as randrange:
+            self.assertEqual(self.sampler.choose(), "django")
+        randrange.assert_called_once_with(2)
+
+    def test_weighted_by_post_count(self):
+        # One post in python and none in django give running totals of 2, 3
+        with mock.patch("random.random", return_value=0.6):
+            self.assertEqual(self.sampler.choose(weighted=True), "python")
+        with mock.patch("random.random", return_value=0.7):
+            self.assertEqual(self.sampler.choose(weighted=True), "django")
+
+    def test_reloads_on_change(self):
+        self.sampler.choose()
+        Category.objects.filter(slug="django").delete()
+        with CaptureQueriesContext(connection) as queries:
+            self.sampler.choose()
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(self.sampler.entries[0], ["python", "django"])
+
+        sampling.changed()
+        self.assertEqual(self.sampler.choose(), "python")
+
+    def test_no_categories(self):
+        Category.objects.all().delete()
+        sampling.changed()
+        self.assertIsNone(self.sampler.choose())
+        with mock.patch.object(sampling, "sampler", self.sampler):
+            self.assertEqual(self.client.get("/r/random").status_code, 404)
+
+
+class ThreadTests(PostFixture, TestCase):
+    def test_replies_take_slots_on_their_parent(self):
+        first = self.make_comment("A")
+        reply = self.make_comment("B", first)
+        second = self.make_comment("C")
+        nested = self.make_comment("D", reply)
+
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.comment_count, self.post.reply_sequence), (4, 2))
+        self.assertEqual(
+            [(c.depth, c.content) for c in self.post.comments.order_by("path")],
+            [(0, "A"), (1, "B"), (2, "D"), (0, "C")],
+        )
+        self.assertTrue(nested.path.startswith(reply.path))
+        self.assertFalse(second.path.startswith(first.path))
+
+
+class TagBalance(HTMLParser):
+    """Checks that every element opened in some HTML is closed in it."""
+
+    VOID = {"br", "img", "input", "hr", "meta", "link"}
+
+    def __init__(self):
+        super().__init__()
+        self.open = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in self.VOID:
+            self.open.append(tag)
+
+    def handle_endtag(self, tag):
+        if not self.open or self.open.pop() != tag:
+            raise AssertionError(f"Unbalanced </{tag}>")
+
+
+@override_settings(FRAGMENT_TIMEOUT=60)
+class FragmentTests(PostFixture, TestCase):
+    def setUp(self):
+        super().setUp()
+        caches[settings.FRAGMENT_CACHE].clear()
+
+    def cached_post_fragment(self):
+        post = Post.objects.select_related("user", "category").get(pk=self.post.pk)
+        key = fragments.fragment_key(
+            "post", post, [post.user.username, post.category.name]
+        )
+        return caches[settings.FRAGMENT_CACHE].get(key)
+
+    def test_post_fragments_are_whole_elements(self):
+        self.client.get("/")
+        fragment = self.cached_post_fragment()
+        self.assertIn(self.post.title, fragment)
+        self.assertIn(f'href="/u/{self.user.username}/"', fragment)
+        self.assertIn(self.category.get_absolute_url(), fragment)
+        balance = TagBalance()
+        balance.feed(fragment)
+        self.assertEqual(balance.open, [])
+
+    def test_counters_stay_outside_fragments(self):
+        Post.objects.filter(pk=self.post.pk).update(
+            created_on=timezone.now() - timedelta(hours=2)
+        )
+        self.assertContains(self.client.get("/"), "2\xa0hours ago")
+        fragment = self.cached_post_fragment()
+        self.assertNotIn("comment_count", fragment)
+        self.assertNotIn("ago", fragment)
+
+        voter = User.objects.create_user("voter", password="password")
+        PostVote.objects.cast(voter, self.post, Vote.Choice.UP)
+        self.make_comment("A comment")
+        response = self.client.get("/")
+        # Neither moved the version, the fragment was served from the cache
+        self.assertEqual(self.cached_post_fragment(), fragment)
+        self.assertContains(response, '<div class="score">1</div>', html=True)
+        self.assertContains(response, '<span class="comment_count">1</span>')
+
+    def test_keys_hold_any_names(self):
+        Category.objects.filter(pk=self.category.pk).update(name="Ask " + "x" * 196)
+        User.objects.filter(pk=self.user.pk).update(username="y" * 150)
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", CacheKeyWarning)
+            self.assertEqual(self.client.get("/").status_code, 200)
+        self.assertIsNotNone(self.cached_post_fragment())
+
+    def test_viewer_links_stay_outside_fragments(self):
+        self.assertContains(self.client.get("/"), "/save?next=")
+        self.client.get(f"/{self.post.pk}/save?next=/")
+        self.assertContains(self.client.get("/"), "/unsave?next=")
+
+    def test_edits_render_fresh_fragments(self):
+        self.client.get("/")
+        self.post.title = "An edited post"
+        self.post.save()
+        self.assertContains(self.client.get("/"), "An edited post")
+
+
+class MigrateVotesTests(PostFixture, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.voter = User.objects.create_user("voter", password="password")
+        self.comment = self.make_comment("A comment")
+        post_type = ContentType.objects.get_for_model(Post)
+        comment_type = ContentType.objects.get_for_model(Comment)
+        self.cast = timezone.now() - timedelta(days=3)
+        GenericVote.objects.bulk_create(
+            [
+                GenericVote(
+                    user=self.voter,
+                    content_type=post_type,
+                    object_id=self.post.pk,
+                    choice=Vote.Choice.UP,
+                ),
+                GenericVote(
+                    user=self.voter,
+                    content_type=comment_type,
+                    object_id=self.comment.pk,
+                    choice=Vote.Choice.DOWN,
+                ),
+                # A vote on a post deleted since
+                GenericVote(
+                    user=self.user,
+                    content_type=post_type,
+                    object_id=uuid.uuid4(),
+                    choice=Vote.Choice.UP,
+                ),
+            ]
+        )
+        GenericVote.objects.update(created_on=self.cast, updated_on=self.cast)
+        GenericFavourite.objects.bulk_create(
+            [
+                GenericFavourite(
+                    user=self.voter, content_type=post_type, object_id=self.post.pk
+                ),
+                GenericFavourite(
+                    user=self.voter,
+                    content_type=comment_type,
+                    object_id=self.comment.pk,
+                ),
+            ]
+        )
+
+    def migrate(self, *args):
+        out = StringIO()
+        call_command("migratevotes", *args, stdout=out)
+        return out.getvalue().splitlines()
+
+    def test_copies_once(self):
+        self.assertEqual(
+            self.migrate()[:4],
+            [
+                "Copied 1 post votes",
+                "Copied 1 comment votes",
+                "Copied 1 post favourites",
+                "Skipped 1 favourites on comments",
+            ],
+        )
+        self.assertEqual(
+            list(PostVote.objects.values_list("user", "target", "choice")),
+            [(self.voter.pk, self.post.pk, Vote.Choice.UP)],
+        )
+        self.assertEqual(
+            list(CommentVote.objects.values_list("user", "target", "choice")),
+            [(self.voter.pk, self.comment.pk, Vote.Choice.DOWN)],
+        )
+        self.assertEqual(PostVote.objects.get().created_on, self.cast)
+        self.assertEqual(
+            list(PostFavourite.objects.values_list("user", "post")),
+            [(self.voter.pk, self.post.pk)],
+        )
+
+        # What the votes feed is rebuilt from them
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual((post.score, post.upvotes), (1, 1))
+        self.assertEqual(post.hot, ranking.hot(1, post.created_on))
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.score, -1)
+        karma = Karma.objects.get(user=self.user)
+        self.assertEqual((karma.post_karma, karma.comment_karma), (1, -1))
+        self.assertEqual(
+            list(DailyVotes.objects.values_list("post", "score")), [(self.post.pk, 1)]
+        )
+
+        self.assertEqual(
+            self.migrate(),
+            [
+                "Copied 0 post votes",
+                "Copied 0 comment votes",
+                "Copied 0 post favourites",
+                "Skipped 1 favourites on comments",
+            ],
+        )
+        self.assertEqual(PostVote.objects.count() + CommentVote.objects.count(), 2)
+        self.assertEqual(GenericVote.objects.count(), 3)
+
+    def test_delete_empties_the_generic_tables(self):
+        output = self.migrate("--delete")
+        self.assertEqual(output[-1], "Deleted 3 generic votes and 2 generic favourites")
+        self.assertFalse(GenericVote.objects.exists())
+        self.assertFalse(GenericFavourite.objects.exists())
+        self.assertEqual(PostVote.objects.count(), 1)
+
+
+class UserListTests(TestCase):
+    def test_new_users_are_listed(self):
+        User.objects.create_user("brandnew", password="password")
+        response = self.client.get("/users")
+        self.assertContains(response, "brandnew")
+
+    def test_ingested_users_are_listed(self):
+        ingester = Ingester()
+        ingester.add({"title": "A post", "username": "scraped", "subreddit": "news"})
+        ingester.flush()
+        response = self.client.get("/users")
+        self.assertContains(response, "scraped")
+
+    def test_ingested_users_are_counted(self):
+        ingester = Ingester()
+        ingester.add({"id": "a", "title": "A", "username": "u", "subreddit": "news"})
+        ingester.add({"type": "comment", "id": "c", "parent": "a", "username": "u"})
+        ingester.add({"type": "comment", "id": "d", "parent": "c", "username": "v"})
+        ingester.flush()
+        self.assertEqual(
+            set(
+                Karma.objects.values_list(
+                    "user__username", "post_count", "comment_count"
+                )
+            ),
+            {("u", 1, 1), ("v", 0, 1)},
+        )
+
+
+class UserDetailTests(PostFixture, TestCase):
+    def test_counts_are_kept_on_karma(self):
+        self.make_comment("A reply", self.make_comment("A comment"))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/u/author/")
+        karma = response.context["user"].karma
+        self.assertEqual((karma.post_count, karma.comment_count), (1, 2))
+        self.assertFalse(
+            any("COUNT(" in query["sql"] for query in queries.captured_queries)
+        )
+
+    def test_counts_are_rebuilt(self):
+        self.make_comment("A comment")
+        Karma.objects.all().delete()
+        call_command("rekarma", stdout=StringIO())
+        karma = Karma.objects.get(user=self.user)
+        self.assertEqual((karma.post_count, karma.comment_count), (1, 1))
+
+    def test_deletes_lower_the_counts(self):
+        other = self.make_post("Another post")
+        self.make_comment("A comment")
+        Comment.objects.create(content="B", post=other, user=self.user)
+
+        other.delete()
+
+        karma = Karma.objects.get(user=self.user)
+        self.assertEqual((karma.post_count, karma.comment_count), (1, 1))
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.post_count, 1)
+        # A drifted count stays at zero rather than failing the delete
+        Karma.objects.filter(user=self.user).update(post_count=0)
+        self.post.delete()
+        self.assertEqual(Karma.objects.get(user=self.user).post_count, 0)
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.post_count, 0)
+
+    def test_deleting_a_reply_lowers_its_thread_counts(self):
+        parent = self.make_comment("A comment")
+        reply = self.make_comment("A reply", parent)
+        voter = User.objects.create_user("voter", password="password")
+        CommentVote.objects.cast(voter, reply, Vote.Choice.UP)
+        self.assertEqual(Karma.objects.get(user=self.user).comment_karma, 1)
+
+        Comment.objects.get(pk=reply.pk).delete()
+
+        self.post.refresh_from_db()
+        parent.refresh_from_db()
+        self.assertEqual((self.post.comment_count, parent.comment_count), (1, 0))
+        karma = Karma.objects.get(user=self.user)
+        self.assertEqual((karma.comment_count, karma.comment_karma), (1, 0))
+        # recount agrees
+        call_command("recount", stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+
+    def test_subscriptions_are_counted_however_made(self):
+        self.client.get("/r/python/subscribe")
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.subscriber_count, 1)
+        self.client.get("/r/python/unsubscribe")
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.subscriber_count, 0)
+
+        # As the admin does it, then through the site with a drifted count
+        Subscription.objects.create(user=self.user, category=self.category)
+        Category.objects.filter(pk=self.category.pk).update(subscriber_count=0)
+        response = self.client.get("/r/python/unsubscribe")
+        self.assertEqual(response.status_code, 302)
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.subscriber_count, 0)
+
+    def test_ties_list_newest_first(self):
+        newer = self.make_post("A newer post")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/u/author/")
+        self.assertEqual(list(response.context["page_obj"]), [newer, self.post])
+        # The order of the index on user, score and creation time
+        self.assertTrue(
+            any(
+                '"score" DESC, "posts_post"."created_on" DESC' in query["sql"]
+                for query in queries.captured_queries
+            )
+        )
+
+
+class FeedTests(PostFixture, TestCase):
+    def setUp(self):
+        feeds.get_cache().clear()
+        super().setUp()
+        Subscription.objects.create(user=self.user, category=self.category)
+
+    def test_new_posts_reach_cached_feeds(self):
+        self.assertContains(
+            self.client.get("/feed?sort=new"), self.post.get_absolute_url()
+        )
+
+        second = self.make_post("Second")
+        # Run by the post's transaction once it commits
+        feeds.invalidate_category(self.category.pk)
+        self.assertContains(
+            self.client.get("/feed?sort=new"), second.get_absolute_url()
+        )
+
+    def test_subscribing_rebuilds_the_feed(self):
+        other = Category.objects.create(name="django", description="")
+        elsewhere = Post.objects.create(
+            title="Elsewhere", category=other, user=self.user
+        )
+        self.assertNotContains(
+            self.client.get("/feed?sort=new"), elsewhere.get_absolute_url()
+        )
+
+        self.client.get("/r/django/subscribe")
+        self.assertContains(
+            self.client.get("/feed?sort=new"), elsewhere.get_absolute_url()
+        )
+        self.client.get("/r/django/unsubscribe")
+        self.assertNotContains(
+            self.client.get("/feed?sort=new"), elsewhere.get_absolute_url()
+        )
+
+    @mock.patch.object(feeds, "HEAD_LENGTH", 3)
+    def test_paging_past_the_heads(self):
+        other = Category.objects.create(name="django", description="")
+        Subscription.objects.create(user=self.user, category=other)
+        start = timezone.now() - timedelta(days=1)
+        for number in range(9):
+            post = Post.objects.create(
+                title=f"Post {number}",
+                category=(self.category, other)[number % 2],
+                user=self.user,
+            )
+            # Interleaved in time, with runs of tied scores
+            Post.objects.filter(pk=post.pk).update(
+                created_on=start + timedelta(minutes=number), score=number // 3
+            )
+
+        for sort in ("new", "top"):
+            feeds.get_cache().clear()
+            paginator = CursorPaginator(feeds.feed_queryset(self.user, sort), 1)
+            expected = list(
+                feeds.feed_queryset(self.user, sort).order_by(*paginator.ordering)
+            )
+            seen, cursor = [], None
+            while True:
+                query = {"sort": sort}
+                if cursor:
+                    query["after"] = cursor
+                request = RequestFactory().get("/feed", query)
+                request.user = self.user
+                page = feeds.page(request, sort, per_page=2)
+                seen += page.object_list
+                if not page.has_next:
+                    break
+                cursor = page.next_cursor
+            # The heads cover the first few pages, the database the rest
+            self.assertEqual(seen, expected, sort)
+            entries, complete, _ = feeds.get_cache().get(
+                feeds.feed_key(self.user.pk, sort)
+            )
+            self.assertFalse(complete)
+            self.assertLess(len(entries), len(expected))
+
+
+@unittest.skipIf(generate.np is None, "NumPy isn't installed")
+class GenerateTests(TestCase):
+    SIZES = {
+        "users": 20,
+        "categories": 3,
+        "posts": 15,
+        "comments": 60,
+        "votes": 200,
+        "favourites": 20,
+        "subscriptions": 10,
+    }
+
+    def generate(self, seed=1):
+        call_command(
+            "generate",
+            *[f"--{key}={value}" for key, value in self.SIZES.items()],
+            f"--seed={seed}",
+            stdout=StringIO(),
+        )
+
+    def snapshot(self):
+        """Everything generated, by keys that don't depend on insert order."""
+        return {
+            "posts": set(
+                Post.objects.values_list(
+                    "pk", "title", "user__username", "category__name"
+                )
+            ),
+            "comments": set(
+                Comment.objects.values_list("pk", "post", "reply", "path", "content")
+            ),
+            "votes": set(
+                PostVote.objects.values_list("user__username", "target", "choice")
+            )
+            | set(
+                CommentVote.objects.values_list("user__username", "target", "choice")
+            ),
+            "counters": self.counters(),
+        }
+
+    def counters(self):
+        return {
+            model.__name__: set(
+                model.objects.values_list("pk", *Counters.COUNTER_FIELDS)
+            )
+            for model in (Post, Comment)
+        }
+
+    def clear(self):
+        Comment.objects.update(reply=None)
+        for model in (Comment, Post, Category, User):
+            model.objects.all().delete()
+
+    def test_a_seed_generates_the_same_data(self):
+        self.generate()
+        first = self.snapshot()
+        self.clear()
+        self.generate()
+        self.assertEqual(self.snapshot(), first)
+        self.clear()
+        self.generate(seed=2)
+        self.assertNotEqual(self.snapshot()["posts"], first["posts"])
+
+    def test_generated_rows_are_consistent(self):
+        self.generate()
+        self.assertEqual(Post.objects.count(), self.SIZES["posts"])
+        self.assertEqual(Comment.objects.count(), self.SIZES["comments"])
+        self.assertEqual(Category.objects.count(), self.SIZES["categories"])
+        self.assertEqual(Karma.objects.count(), self.SIZES["users"])
+        votes = PostVote.objects.count() + CommentVote.objects.count()
+        self.assertLessEqual(votes, self.SIZES["votes"])
+        self.assertEqual(
+            sum(Karma.objects.values_list("post_count", flat=True)),
+            self.SIZES["posts"],
+        )
+
+        comments = {comment.pk: comment for comment in Comment.objects.all()}
+        width = Comment.SEGMENT_WIDTH
+        for comment in comments.values():
+            self.assertEqual(len(comment.path), width * (comment.depth + 1))
+            if comment.reply_id:
+                parent = comments[comment.reply_id]
+                self.assertEqual(comment.path[:-width], parent.path)
+                self.assertEqual(comment.post_id, parent.post_id)
+        for post in Post.objects.all():
+            top = [c for c in comments.values() if c.post_id == post.pk and not c.depth]
+            self.assertEqual(post.reply_sequence, len(top))
+
+        # generate finishes with a recount, another one changes nothing
+        counters = self.counters()
+        call_command("recount", stdout=StringIO())
+        self.assertEqual(self.counters(), counters)
+        self.assertEqual(
+            sum(post.comment_count for post in Post.objects.all()),
+            self.SIZES["comments"],
+        )
+
+
+@unittest.skipIf(scrapy is None, "Scrapy isn't installed")
+class ScraperTests(TestCase):
+    def fixture(self, url):
+        path = url[len("file://") :]
+        with open(path, "rb") as page:
+            return HtmlResponse(url=url, body=page.read())
+
+    def crawl(self, spider):
+        """Items from the saved pages, requests for anything else are dropped."""
+        items = []
+        requests = list(spider.start_requests())
+        while requests:
+            request = requests.pop(0)
+            if not request.url.startswith("file:"):
+                continue
+            response = self.fixture(request.url)
+            for result in request.callback(response, **request.cb_kwargs):
+                if isinstance(result, scrapy.Request):
+                    requests.append(result)
+                else:
+                    items.append(result)
+        return items
+
+    def test_offline_argument(self):
+        self.assertTrue(PostSpider(offline="1").offline)
+        self.assertFalse(PostSpider(offline="0").offline)
+        self.assertFalse(PostSpider().offline)
+        requests = list(PostSpider(offline="0").start_requests())
+        self.assertTrue(all(r.url.startswith("http") for r in requests))
+
+    def test_fixtures_load_through_the_pipeline(self):
+        spider = PostSpider(offline="1")
+        items = self.crawl(spider)
+
+        pipeline = DjangoPipeline("jeddit.settings", 1000, 3600)
+        pipeline.open_spider(spider)
+        for item in items:
+            self.assertIs(pipeline.process_item(item, spider), item)
+        # What close_spider hands to its worker thread
+        pipeline.write(pipeline.buffer)
+
+        self.assertEqual(len(items), 52 + 9)
+        self.assertEqual(Post.objects.count(), 52)
+        self.assertEqual(
+            set(Category.objects.values_list("name", flat=True)), set(FIXTURES)
+        )
+        post = Post.objects.get(title=items[0]["title"])
+        self.assertEqual(
+            (post.link, post.user.username), (items[0]["href"], items[0]["username"])
+        )
+
+        post = Post.objects.get(link__contains="high-bar-code-review")
+        self.assertEqual((post.comment_count, post.reply_sequence), (9, 3))
+        thread = [
+            (comment.depth, comment.user.username)
+            for comment in post.comments.order_by("path")
+        ]
+        self.assertEqual(
+            thread[:4],
+            [
+                (0, "lintroller"),
+                (1, "nullpointerdad"),
+                (2, "lintroller"),
+                (1, "tabs_not_spaces"),
+            ],
+        )
+        self.assertEqual(thread[4], (0, "deleted"))
+
+    def test_walk_saved_comment_page(self):
+        spider = PostSpider()
+        page = self.fixture((ROOT / "comments-t3_f6xey8.html").as_uri())
+        comments = list(spider.parse_comments(page, "t3_f6xey8"))
+
+        self.assertEqual(
+            [(c["id"], c["parent"]) for c in comments],
+            [
+                ("t1_fi7a2k3", "t3_f6xey8"),
+                ("t1_fi7c9d1", "t1_fi7a2k3"),
+                ("t1_fi7e4m8", "t1_fi7c9d1"),
+                ("t1_fi7d0b5", "t1_fi7a2k3"),
+                ("t1_fi7b1x0", "t3_f6xey8"),
+                ("t1_fi7f6y2", "t1_fi7b1x0"),
+                ("t1_fi7g2h9", "t3_f6xey8"),
+                ("t1_fi7h8r4", "t1_fi7g2h9"),
+                ("t1_fi7j0q6", "t1_fi7g2h9"),
+            ],
+        )
+        self.assertTrue(all(c["post"] == "t3_f6xey8" for c in comments))
+        deleted = comments[4]
+        self.assertEqual(
+            (deleted["username"], deleted["content"]), ("deleted", "[deleted]")
+        )
+        self.assertEqual(
+            comments[6]["content"],
+            "Approve with comments is underrated.\n\n"
+            "Most of my feedback doesn't need to block the merge.",
+        )
+
+
+class IngesterTests(TestCase):
+    def test_threads_are_bounded(self):
+        ingester = Ingester(batch_size=2, max_threads=2)
+        for name in ("a", "b"):
+            ingester.add(
+                {"id": name, "title": name, "username": "u", "subreddit": "news"}
+            )
+        ingester.add({"type": "comment", "id": "c", "parent": "a", "username": "u"})
+        # Replying kept "a", so remembering "c" forgot "b"
+        ingester.add({"type": "comment", "id": "d", "parent": "b", "username": "u"})
+        ingester.flush()
+
+        self.assertEqual(list(ingester.threads), ["a", "c"])
+        self.assertEqual((ingester.comments, ingester.skipped), (1, 1))
+
+    def test_records_split_across_reads(self):
+        records = [{"title": f"Post {n}", "tags": ["a", "b"]} for n in range(20)]
+        for text in (
+            json.dumps(records, indent=2),
+            "\n".join(json.dumps(record) for record in records) + "\n",
+        ):
+            # Reads far shorter than a record
+            self.assertEqual(list(iter_records(StringIO(text), read_size=7)), records)
+        self.assertEqual(list(iter_records(StringIO("  [ ]\n"))), [])
+        with self.assertRaises(json.JSONDecodeError):
+            list(iter_records(StringIO('[{"title": '), read_size=4))
+
+    def ingest(self, records, **kwargs):
+        ingester = Ingester(**kwargs)
+        for record in records:
+            ingester.add(record)
+        ingester.flush()
+        return ingester
+
+    def test_ingesting_twice_adds_nothing(self):
+        records = [
+            {
+                "title": "Linked",
+                "href": "https://example.com/",
+                "username": "u",
+                "subreddit": "news",
+            },
+            {
+                "title": "Relinked",
+                "href": "https://example.com/",
+                "username": "u",
+                "subreddit": "news",
+            },
+            {"title": "Unlinked", "username": "u", "subreddit": "news"},
+            {"title": "Unlinked", "username": "v", "subreddit": "news"},
+            {"title": "Unlinked", "username": "u", "subreddit": "python"},
+        ]
+        first = self.ingest(records)
+        self.assertEqual((first.created, first.duplicates), (3, 2))
+        second = self.ingest(records)
+        self.assertEqual((second.created, second.duplicates), (0, 5))
+        self.assertEqual(Post.objects.count(), 3)
+        self.assertEqual(
+            dict(Category.objects.values_list("name", "post_count")),
+            {"news": 2, "python": 1},
+        )
+        self.assertEqual(Karma.objects.get(user__username="u").post_count, 3)
+
+    def test_batches_beyond_the_parameter_limit(self):
+        records = [
+            {
+                "title": f"Post {n}",
+                "href": f"https://example.com/{n}",
+                "username": f"user{n % 700}",
+                "subreddit": f"sub{n % 3}",
+            }
+            for n in range(1200)
+        ]
+        self.assertEqual(self.ingest(records, batch_size=1200).created, 1200)
+        self.assertEqual(self.ingest(records, batch_size=1200).duplicates, 1200)
+        self.assertEqual(
+            sorted(Karma.objects.values_list("post_count", flat=True).distinct()),
+            [1, 2],
+        )
+
+    def test_scrape_command_batches(self):
+        records = [
+            {"title": f"Post {n}", "username": "u", "subreddit": "news"}
+            for n in range(5)
+        ]
+        with tempfile.NamedTemporaryFile("w", suffix=".json") as infile:
+            json.dump(records, infile)
+            infile.flush()
+            out = StringIO()
+            with CaptureQueriesContext(connection) as queries:
+                call_command("scrape", infile.name, "--batch-size", "2", stdout=out)
+        # A report per full batch, and one at the end
+        reports = out.getvalue().splitlines()
+        self.assertEqual(len(reports), 3)
+        self.assertTrue(reports[-1].startswith("5 posts and 0 comments created"))
+        inserts = [
+            q for q in queries if q["sql"].startswith('INSERT INTO "posts_post"')
+        ]
+        self.assertEqual(len(inserts), 3)
+
+
+class AsyncViewTests(PostFixture, TestCase):
+    def test_upvote(self):
+        response = self.client.get(f"/{self.post.pk}/upvote?next=/")
+        self.assertRedirects(response, "/", fetch_redirect_response=False)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.score, self.post.upvotes), (1, 1))
+
+    def test_malformed_ids_are_not_found(self):
+        for action in ("save", "unsave", "upvote", "downvote", "unvote"):
+            response = self.client.get(f"/notauuid/{action}?next=/")
+            self.assertEqual(response.status_code, 404, action)
+        response = self.client.get("/comment/notauuid/upvote?next=/")
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post("/notauuid/comment", {"content": "Hello"})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post(
+            f"/{self.post.pk}/comment", {"content": "Hello", "reply": "notauuid"}
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class LiveTests(SimpleTestCase):
+    a = "00000000-0000-0000-0000-00000000000a"
+    b = "00000000-0000-0000-0000-00000000000b"
+
+    def setUp(self):
+        # A tick long enough that only the tests dispatch
+        self.broker = live.Broker(tick=3600)
+
+    def subscribe(self, post_ids, since):
+        async def subscribe():
+            return self.broker.subscribe(post_ids, since)
+
+        return asyncio.run(subscribe())
+
+    def test_publish_before_subscribers_is_dropped(self):
+        self.broker.publish(self.a, 1)
+        self.assertEqual(self.broker.pending, [])
+
+    def test_tick_coalesces_per_post(self):
+        subscriber = self.subscribe({self.a, self.b}, time.time() - 1)
+        for _ in range(1000):
+            self.broker.publish(self.a, 1)
+        self.broker.publish(self.a, comments=1)
+        self.broker.publish(self.b, 1)
+        self.broker.publish(self.b, -1)
+        self.broker.dispatch(self.broker.collect())
+
+        self.assertTrue(subscriber.ready.is_set())
+        deltas, mark = subscriber.take()
+        self.assertEqual(deltas, {self.a: {"score": 1000, "comments": 1}})
+        self.assertEqual(mark, self.broker.dispatched)
+        self.assertFalse(subscriber.ready.is_set())
+        self.assertEqual(subscriber.take()[0], {})
+
+    def test_only_changes_after_render_are_sent(self):
+        watcher = self.subscribe({self.a}, time.time() - 1)
+        self.broker.publish(self.a, 1)
+        rendered = time.time()
+        self.broker.publish(self.a, 2)
+        # A page rendered during the tick already shows the first vote
+        late = self.subscribe({self.a}, rendered)
+        self.broker.dispatch(self.broker.collect())
+        self.assertEqual(watcher.take()[0], {self.a: {"score": 3, "comments": 0}})
+        self.assertEqual(late.take()[0], {self.a: {"score": 2, "comments": 0}})
+
+        # Reconnecting replays what was dispatched after the last event id
+        replayed = self.subscribe({self.a, self.b}, rendered)
+        self.assertEqual(replayed.take()[0], {self.a: {"score": 2, "comments": 0}})
+        current = self.subscribe({self.a}, self.broker.dispatched)
+        self.assertEqual(current.take()[0], {})
+
+        self.broker.unsubscribe(watcher)
+        self.broker.unsubscribe(late)
+        self.broker.unsubscribe(replayed)
+        self.broker.unsubscribe(current)
+        self.assertEqual(self.broker.subscribers, {})
+
+    def test_stream(self):
+        self.broker.tick = 0.01
+        messages = []
+        disconnect = asyncio.Event()
+
+        async def receive():
+            await disconnect.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            messages.append(message)
+            if message.get("more_body"):
+                disconnect.set()
+
+        async def request(query):
+            scope = {"query_string": query.encode(), "headers": []}
+            await live.stream(scope, receive, send)
+
+        async def voted():
+            stream = asyncio.ensure_future(
+                request(f"posts={self.a}&since={time.time() - 1}")
+            )
+            await asyncio.sleep(0)
+            self.broker.publish(self.a, 1)
+            self.broker.publish(self.a, 1)
+            await asyncio.wait_for(stream, 5)
+            self.broker.loop = None
+
+        with mock.patch.object(live, "broker", self.broker):
+            asyncio.run(request("posts=notauuid"))
+            self.assertEqual(messages[0]["status"], 400)
+            messages.clear()
+            asyncio.run(voted())
+
+        self.assertEqual(messages[0]["status"], 200)
+        self.assertEqual(len(messages), 2)
+        event_id, name, data = messages[1]["body"].decode().splitlines()[:3]
+        self.assertEqual(name, "event: counts")
+        self.assertEqual(
+            json.loads(data[len("data: ") :]), {self.a: {"score": 2, "comments": 0}}
+        )
+        self.assertEqual(self.broker.subscribers, {})
+
+
+class ContextMiddlewareTests(SimpleTestCase):
+    def test_runs_as_a_coroutine_under_asgi(self):
+        async def get_response(request):
+            return "response"
+
+        middleware = ContextMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        self.assertEqual(asyncio.run(middleware("request")), "response")
+
+    def test_the_base_hooks_leave_requests_alone(self):
+        middleware = ContextMiddleware(lambda request: "response")
+        self.assertFalse(asyncio.iscoroutinefunction(middleware))
+        self.assertEqual(middleware("request"), "response")
+        self.assertEqual(middleware.finish("request", "response", {}), "response")
+
+
+class InstrumentationTests(PostFixture, TestCase):
+    def setUp(self):
+        super().setUp()
+        instrumentation.histogram.clear()
+
+    @override_settings(INSTRUMENTATION_SAMPLE_RATE=1.0)
+    def test_sampled_requests_are_timed(self):
+        with self.assertLogs("jeddit.instrumentation") as logs:
+            response = self.client.get("/")
+        sample = json.loads(logs.records[0].getMessage())
+        self.assertEqual((sample["view"], sample["status"]), ("posts:index", 200))
+        timing = response["Server-Timing"]
+        self.assertRegex(timing, r'^db;dur=[\d.]+;desc="\d+ queries", tpl;dur=')
+        self.assertIn("total;dur=", timing)
+        summary = instrumentation.histogram.summary()
+        self.assertEqual(summary["posts:index"]["count"], 1)
+        self.assertGreater(summary["posts:index"]["max_queries"], 0)
+
+    @override_settings(INSTRUMENTATION_SAMPLE_RATE=0.5)
+    def test_requests_are_sampled_at_the_rate(self):
+        with mock.patch("random.random", return_value=0.7):
+            self.assertNotIn("Server-Timing", self.client.get("/"))
+        with mock.patch("random.random", return_value=0.2):
+            with self.assertLogs("jeddit.instrumentation"):
+                self.assertIn("Server-Timing", self.client.get("/"))
+        self.assertEqual(instrumentation.histogram.summary()["posts:index"]["count"], 1)
+
+    @override_settings(INSTRUMENTATION_SAMPLE_RATE=0)
+    def test_a_rate_of_zero_leaves_requests_alone(self):
+        self.assertNotIn("Server-Timing", self.client.get("/"))
+        self.assertEqual(instrumentation.histogram.summary(), {})
+
+    @override_settings(
+        INSTRUMENTATION_SAMPLE_RATE=1.0, INSTRUMENTATION_SERVER_TIMING=False
+    )
+    def test_the_header_can_be_left_off(self):
+        with self.assertLogs("jeddit.instrumentation"):
+            self.assertNotIn("Server-Timing", self.client.get("/"))
+        self.assertIn("posts:index", instrumentation.histogram.summary())
+
+    def test_histogram_buckets(self):
+        histogram = instrumentation.Histogram(window=4)
+        for total in (0.5, 3, 3000, 9000, 1):
+            histogram.add(
+                "view",
+                {"total_ms": total, "queries": 2, "db_ms": 1, "template_ms": 0},
+            )
+        summary = histogram.summary()["view"]
+        # The first sample has fallen out of the window
+        self.assertEqual(summary["count"], 4)
+        self.assertEqual((summary["p50_ms"], summary["max_ms"]), (3000, 9000))
+        buckets = {bound: count for bound, count in summary["buckets"].items() if count}
+        self.assertEqual(buckets, {"<=1": 1, "<=5": 1, "<=5000": 1, "inf": 1})
+
+    def test_timings_are_for_staff(self):
+        response = self.client.get("/admin/timings/")
+        self.assertEqual(response.status_code, 302)
+        self.client.logout()
+        self.assertEqual(self.client.get("/admin/timings/").status_code, 302)
+
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.client.force_login(self.user)
+        response = self.client.get("/admin/timings/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()), {"sample_rate", "views"})
+
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class ReplicaTests(PostFixture, TransactionTestCase):
+    # The replica mirrors the test database, but through a connection of its
+    # own that wouldn't see a TestCase's uncommitted rows
+    databases = {"default", "replica"}
+
+    def get(self, url, **kwargs):
+        """The response to ``url`` and the queries each database ran for it."""
+        with CaptureQueriesContext(connections["default"]) as primary:
+            with CaptureQueriesContext(connections["replica"]) as replica:
+                response = self.client.get(url, **kwargs)
+        return response, primary, replica
+
+    def test_listings_read_from_the_replica(self):
+        response, primary, replica = self.get("/r/python/")
+        self.assertContains(response, self.post.get_absolute_url())
+        self.assertTrue(any("posts_post" in q["sql"] for q in replica))
+        self.assertFalse(any("posts_post" in q["sql"] for q in primary))
+        self.assertNotIn(replicas.COOKIE, response.cookies)
+
+    def test_writes_pin_to_the_primary(self):
+        response, primary, replica = self.get(f"/{self.post.pk}/upvote?next=/")
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(replicas.COOKIE, response.cookies)
+        self.assertEqual(len(replica), 0)
+
+        # The test client sends the cookie back
+        response, primary, replica = self.get("/r/python/")
+        self.assertContains(response, self.post.get_absolute_url())
+        self.assertEqual(len(replica), 0)
+        self.assertTrue(any("posts_post" in q["sql"] for q in primary))
+
+
+class SearchTests(PostFixture, TransactionTestCase):
+    # The debug toolbar wraps and unwraps the cursors of every connection,
+    # which would undo a TestCase's guard on the replica
+    databases = {"default", "replica"}
+
+    @override_settings(DEBUG=True)
+    def test_posting_with_the_debug_toolbar(self):
+        # Its SQL panel formats every query the index writes
+        response = self.client.post(
+            "/post/create",
+            {"title": "Indexed post", "body": "", "category": self.category.pk},
+        )
+        self.assertEqual(response.status_code, 302)
+        post = Post.objects.get(title="Indexed post")
+        response = self.client.post(f"/{post.pk}/comment", {"content": "Findable"})
+        self.assertEqual(response.status_code, 302)
+
+        found = search.find("indexed")
+        self.assertEqual([result.pk for result in found], [post.pk])
+        comment = post.comments.get()
+        self.assertEqual(
+            [result.pk for result in search.find("findable")], [comment.pk]
+        )
+
+    def test_title_matches_rank_first(self):
+        in_body = self.make_post("Something else", body="Rankable words")
+        in_title = self.make_post("Rankable")
+        self.assertEqual(
+            [result.pk for result in search.find("rankable")],
+            [in_title.pk, in_body.pk],
+        )
+
+    def test_searching_a_category(self):
+        other = Category.objects.create(name="django", description="")
+        inside = self.make_post("Scoped result")
+        Post.objects.create(title="Scoped result", category=other, user=self.user)
+        self.assertEqual(
+            [result.pk for result in search.find("scoped", self.category)],
+            [inside.pk],
+        )
+
+    def test_pages_follow_on(self):
+        posts = {self.make_post(f"Pageable {n}").pk for n in range(5)}
+        first = search.find("pageable", limit=2)
+        second = search.find("pageable", after=first.next_cursor, limit=2)
+        last = search.find("pageable", after=second.next_cursor, limit=2)
+        found = [result.pk for page in (first, second, last) for result in page]
+        self.assertEqual(len(found), 5)
+        self.assertEqual(set(found), posts)
+        self.assertTrue(second.has_next)
+        self.assertFalse(last.has_next)
+        with self.assertRaises(InvalidCursor):
+            search.find("pageable", after="nonsense")
+
+    def test_posts_and_comments_with_one_uuid(self):
+        post = self.make_post("Shared key")
+        comment = Comment.objects.create(
+            id=post.pk, content="Shared key", post=post, user=self.user
+        )
+        found = search.find("shared")
+        self.assertEqual(
+            {(result.search_kind, result.pk) for result in found},
+            {("post", post.pk), ("comment", comment.pk)},
+        )
+        # Reindexing either one replaces only its own row
+        post.save()
+        self.assertEqual(len(search.find("shared")), 2)
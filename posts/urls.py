@@ -10,6 +10,7 @@ urlpatterns = [
     path("post/create", views.PostCreate.as_view(), name="post_create"),
     path("categories", views.CategoryList.as_view(), name="category_list"),
     path("users", views.UserList.as_view(), name="user_list"),
+    path("search", views.search, name="search"),
     # Sub
     path("category/create", views.CategoryCreate.as_view(), name="category_create"),
     path("r/<str:category_slug>/", views.category_detail, name="category_detail"),
@@ -21,6 +22,7 @@ urlpatterns = [
     path("<str:post_id>/unsave", views.unsave_post, name="unsave_post"),
     path("<str:post_id>/upvote", views.upvote_post, name="upvote_post"),
     path("<str:post_id>/downvote", views.downvote_post, name="downvote_post"),
+    path("<str:post_id>/unvote", views.unvote_post, name="unvote_post"),
     path(
         "comment/<str:comment_id>/upvote", views.upvote_comment, name="upvote_comment"
     ),
@@ -29,6 +31,14 @@ urlpatterns = [
         views.downvote_comment,
         name="downvote_comment",
     ),
+    path(
+        "comment/<str:comment_id>/unvote", views.unvote_comment, name="unvote_comment"
+    ),
     path("<str:post_id>/comment", views.comment, name="comment"),
     path("<str:post_id>/<str:post_slug>/", views.post_detail, name="post_detail"),
+    path(
+        "<str:post_id>/<str:post_slug>/<str:comment_id>/",
+        views.post_detail,
+        name="comment_detail",
+    ),
 ]
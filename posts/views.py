@@ -1,44 +1,76 @@
-from django import forms
-from django.utils.translation import gettext_lazy as _
+import uuid
+
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth.models import User
-from django.core.paginator import Paginator
-from django.db import IntegrityError
-from django.db.models import (
-    Case,
-    Count,
-    Exists,
-    F,
-    IntegerField,
-    OuterRef,
-    Prefetch,
-    Q,
-    Sum,
-    Value,
-    When,
-)
-from django.db.models.functions import Coalesce
-from django.http import Http404
+from django.db.models import Exists
+from django.http import Http404, HttpResponseBadRequest, HttpResponseNotAllowed
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.http import require_POST
+from django.utils.decorators import method_decorator
 from django.views.generic.edit import CreateView
 from django.views.generic.list import ListView
 
-from posts.models import Category, Comment, Favourite, Post, Subscription, Vote
+from posts import (
+    asynchronous,
+    comments,
+    feeds,
+    ranking,
+    replicas,
+    rollups,
+    sampling,
+    votebuffer,
+)
+from posts.models import (
+    Category,
+    Comment,
+    Karma,
+    Post,
+    PostFavourite,
+    Subscription,
+    Vote,
+)
+from posts.pagecache import anonymous_cache
+from posts.pagination import InvalidCursor, link_page, paginate
+from posts.search import find
+from posts.viewer import attach_viewer_state
+
+# Upper bound on the ?limit= of replies shown beneath any one comment
+MAX_COMMENT_BREADTH = 500
+
+
+def sort_param(request):
+    """The ``?sort=`` listing requested, defaulting to hot."""
+    sort = request.GET.get("sort")
+    return sort if sort in ranking.SORTS else "hot"
+
+
+def window_param(request):
+    """The ``?t=`` window of the top listing, defaulting to all time."""
+    window = request.GET.get("t")
+    return window if window in rollups.WINDOWS else "all"
+
+
+def sort_posts(request, posts):
+    """Order ``posts`` for the requested listing, a ``?t=`` on its own means top."""
+    sort = sort_param(request)
+    window = window_param(request)
+    if "sort" not in request.GET and "t" in request.GET:
+        sort = "top"
+    if sort == "top":
+        return rollups.top(posts, window), sort, window
+    return ranking.order(posts, sort), sort, window
 
 
+@method_decorator(replicas.read_from_replica, name="dispatch")
 class UserList(ListView):
-    model = User
+    model = Karma
     paginate_by = 50
     template_name = "posts/user_list.html"
-    queryset = User.objects.annotate(
-        post_karma=Coalesce(Sum("posts__votes__choice"), Value(0)),
-        comment_karma=Coalesce(Sum("comments__votes__choice"), Value(0)),
-        karma=F("post_karma") + F("comment_karma"),
-    ).order_by("-karma", "-date_joined", "username")
+    queryset = Karma.objects.select_related("user").order_by("-total", "user")
 
 
+@method_decorator(replicas.read_from_replica, name="dispatch")
 class CategoryList(ListView):
     model = Category
 
@@ -61,136 +93,112 @@ class PostCreate(CreateView):
 @login_required
 def user_feed(request):
 
-    posts = (
-        Post.ranked.select_related("user", "category")
-        .filter(category__in=request.user.subscriptions.values("category__id"))
-        .order_by("-score", "-created_on")
-    )
-
-    user_votes = Vote.objects.filter(user=request.user)
-    user_favs = Favourite.objects.filter(user=request.user, object_id=OuterRef("pk"))
-    posts = posts.annotate(
-        has_saved=Exists(user_favs, distinct=True),
-        upvoted=Exists(
-            user_votes.filter(object_id=OuterRef("pk"), choice=Vote.Choice.UP),
-            distinct=True,
-        ),
-        downvoted=Exists(
-            user_votes.filter(object_id=OuterRef("pk"), choice=Vote.Choice.DOWN),
-            distinct=True,
-        ),
-    )
-
-    paginator = Paginator(posts, 50)
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
+    sort = sort_param(request)
+    page_obj = feeds.page(request, sort)
+    attach_viewer_state(request.user, page_obj)
     return render(
         request,
         "posts/index.html",
-        {"page_obj": page_obj, "form": AuthenticationForm,},
+        {
+            "page_obj": page_obj,
+            "form": AuthenticationForm,
+            "sort": sort,
+            "sorts": ranking.SORTS,
+        },
     )
 
 
+@anonymous_cache
+@replicas.read_from_replica
 def index(request):
     # Equivalent to /r/all
-    posts = Post.ranked.select_related("user", "category")
-
-    if request.user.is_authenticated:
-        # Filter down all the votes for a given user
-
-        # [TODO] Annotate with upvote/downvote in order to display in template
-        user_votes = Vote.objects.filter(user=request.user)
-        user_favs = Favourite.objects.filter(
-            user=request.user, object_id=OuterRef("pk")
-        )
-        posts = posts.annotate(
-            has_saved=Exists(user_favs, distinct=True),
-            upvoted=Exists(
-                user_votes.filter(object_id=OuterRef("pk"), choice=Vote.Choice.UP),
-                distinct=True,
-            ),
-            downvoted=Exists(
-                user_votes.filter(object_id=OuterRef("pk"), choice=Vote.Choice.DOWN),
-                distinct=True,
-            ),
-        )
+    posts = Post.objects.select_related("user", "category")
+    posts, sort, window = sort_posts(request, posts)
 
-    posts = posts.order_by("-score", "-created_on")
-
-    paginator = Paginator(posts, 50)
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
-    return render(request, "posts/index.html", {"page_obj": page_obj},)
+    page_obj = paginate(request, posts)
+    attach_viewer_state(request.user, page_obj)
+    return render(
+        request,
+        "posts/index.html",
+        {
+            "page_obj": page_obj,
+            "sort": sort,
+            "sorts": ranking.SORTS,
+            "window": window,
+            "windows": rollups.WINDOWS,
+        },
+    )
 
 
+@anonymous_cache
+@replicas.read_from_replica
 def user_detail(request, username):
 
-    posts_query = Post.ranked.select_related("category").order_by(
-        "-score", "created_on"
-    )
-
-    if request.user.is_authenticated:
-        # Filter down all the votes for a given user
-        user_votes = Vote.objects.filter(user=request.user, object_id=OuterRef("pk"))
-        user_favs = Favourite.objects.filter(
-            user=request.user, object_id=OuterRef("pk")
-        )
-        posts_query = posts_query.annotate(
-            has_saved=Exists(user_favs, distinct=True),
-            upvoted=Exists(
-                user_votes.filter(object_id=OuterRef("pk"), choice=Vote.Choice.UP),
-                distinct=True,
-            ),
-            downvoted=Exists(
-                user_votes.filter(object_id=OuterRef("pk"), choice=Vote.Choice.DOWN),
-                distinct=True,
-            ),
-        )
+    # Ranked's order, which the index on user, score and creation time serves
+    posts_query = Post.ranked.select_related("user", "category")
 
-    # Pre-fetch a user and all their corresponding posts
-    user_query = User.objects.prefetch_related(Prefetch("posts", queryset=posts_query))
+    user = get_object_or_404(User.objects.select_related("karma"), username=username)
 
-    # Annotate the user with the sum of their total post/comment Karma
-    user_query = user_query.annotate(
-        post_karma=Coalesce(Sum("posts__votes__choice"), Value(0)),
-        comment_karma=Coalesce(Sum("comments__votes__choice"), Value(0)),
-        karma=F("post_karma") + F("comment_karma"),
-    )
+    page_obj = paginate(request, posts_query.filter(user=user))
+    attach_viewer_state(request.user, page_obj)
+    return render(request, "posts/user.html", {"user": user, "page_obj": page_obj},)
 
-    user = get_object_or_404(user_query, username=username,)
 
-    paginator = Paginator(user.posts.all(), 50)
-    page_obj = paginator.get_page(request.GET.get("page"))
-    return render(request, "posts/user.html", {"user": user, "page_obj": page_obj},)
+def search(request):
+    query = request.GET.get("q", "").strip()
+    category = None
+    if request.GET.get("category"):
+        category = get_object_or_404(Category, slug=request.GET["category"])
+
+    page_obj = None
+    if query:
+        try:
+            page_obj = find(query, category, request.GET.get("after"))
+        except InvalidCursor:
+            page_obj = find(query, category)
+        link_page(request, page_obj)
+        attach_viewer_state(request.user, page_obj)
+    return render(
+        request,
+        "posts/search.html",
+        {"query": query, "category": category, "page_obj": page_obj},
+    )
 
 
 def random(request):
-    category = Category.objects.order_by("?").first()
-    if category is None:
+    slug = sampling.choose(getattr(settings, "RANDOM_CATEGORY_WEIGHTED", False))
+    if slug is None:
         raise Http404("No categories exist")
-    return redirect(category)
+    return redirect("posts:category_detail", slug)
 
 
 @login_required
 def unsubscribe(request, category_slug):
     category = get_object_or_404(Category, slug=category_slug)
-    Subscription.objects.get(user=request.user, category=category).delete()
+    # The subscriber count follows through the delete signal
+    Subscription.objects.filter(user=request.user, category=category).delete()
+    feeds.invalidate_user(request.user.pk)
     return redirect(category)
 
 
 @login_required
 def subscribe(request, category_slug):
     category = get_object_or_404(Category, slug=category_slug)
-    Subscription.objects.create(user=request.user, category=category).save()
+    Subscription.objects.get_or_create(user=request.user, category=category)
+    feeds.invalidate_user(request.user.pk)
     return redirect(category)
 
 
+@anonymous_cache
+@replicas.read_from_replica
 def category_detail(request, category_slug):
 
-    posts_query = Post.ranked.select_related("user").order_by("-score", "created_on")
+    posts_query, sort, window = sort_posts(
+        request, Post.objects.select_related("user", "category")
+    )
 
     # Default the category query is all the category objects
-    category_query = Category.objects.annotate(total_subscribers=Count("subscribers"))
+    category_query = Category.objects.all()
 
     if request.user.is_authenticated:
         # Determine whether the user is subscribed
@@ -200,134 +208,161 @@ def category_detail(request, category_slug):
 
         category_query = category_query.annotate(subscribed=Exists(has_subscription))
 
-        # Determine what posts the uer has favourited/voted on
-        user_votes = Vote.objects.filter(user=request.user, object_id=OuterRef("pk"))
-        user_favs = Favourite.objects.filter(
-            user=request.user, object_id=OuterRef("pk")
-        )
-        posts_query = posts_query.annotate(
-            has_saved=Exists(user_favs, distinct=True),
-            upvoted=Exists(
-                user_votes.filter(object_id=OuterRef("pk"), choice=Vote.Choice.UP),
-                distinct=True,
-            ),
-            downvoted=Exists(
-                user_votes.filter(object_id=OuterRef("pk"), choice=Vote.Choice.DOWN),
-                distinct=True,
-            ),
-        )
-
-    category_query = category_query.prefetch_related(
-        "subscribers", Prefetch("posts", posts_query)
-    )
-
     category = get_object_or_404(category_query, slug=category_slug)
 
-    paginator = Paginator(category.posts.all(), 50)
-    page_obj = paginator.get_page(request.GET.get("page"))
+    page_obj = paginate(request, posts_query.filter(category=category))
+    attach_viewer_state(request.user, page_obj)
     return render(
-        request, "posts/category.html", {"category": category, "page_obj": page_obj,},
+        request,
+        "posts/category.html",
+        {
+            "category": category,
+            "page_obj": page_obj,
+            "sort": sort,
+            "sorts": ranking.SORTS,
+            "window": window,
+            "windows": rollups.WINDOWS,
+        },
     )
 
 
-@login_required
-def save_post(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
-    f = Favourite(content_object=post, user=request.user)
-    f.save()
-    # [TODO] Check if this is okay
+def parse_id(value):
+    """The UUID of a post or comment in a URL or form, a 404 if it isn't one."""
+    try:
+        return uuid.UUID(value)
+    except ValueError:
+        raise Http404
+
+
+def favourite(user, post_id):
+    post = get_object_or_404(Post, pk=parse_id(post_id))
+    PostFavourite.objects.get_or_create(post=post, user=user)
+
+
+def unfavourite(user, post_id):
+    PostFavourite.objects.filter(post_id=parse_id(post_id), user=user).delete()
+
+
+@asynchronous.login_required
+async def save_post(request, post_id):
+    await asynchronous.run(favourite, request.user, post_id)
     return redirect(request.GET.get("next"))
 
 
-@login_required
-def unsave_post(request, post_id):
-    # [TODO] This is two queries, wen can probably do it in one by looking up
-    # the corresponding Favourite for the post/user id combination
-    post = get_object_or_404(Post, pk=post_id)
-    post.favourites.filter(user=request.user).delete()
+@asynchronous.login_required
+async def unsave_post(request, post_id):
+    await asynchronous.run(unfavourite, request.user, post_id)
     return redirect(request.GET.get("next"))
 
 
-@login_required
-@require_POST
-def comment(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
-    reply = Comment(content=request.POST["content"], post=post, user=request.user)
-    reply.save()
-    post.comments.add(reply)
-    post.save()
-    return redirect(post)
-
-
-def resolve_vote(request, choice, post_id):
-    post = get_object_or_404(Post, pk=post_id)
-    Vote.objects.update_or_create(
-        object_id=post_id,
-        user=request.user,
-        defaults={
-            "choice": choice,
-            "user": request.user,
-            "object_id": post_id,
-            "content_object": post,
-        },
+def reply(request, post_id):
+    post = get_object_or_404(Post, pk=parse_id(post_id))
+    parent = None
+    if request.POST.get("reply"):
+        parent = get_object_or_404(
+            Comment, pk=parse_id(request.POST["reply"]), post=post
+        )
+        if parent.depth + 1 >= Comment.max_depth():
+            return HttpResponseBadRequest("This thread is too deep to reply to")
+    Comment.objects.create(
+        content=request.POST["content"], post=post, user=request.user, reply=parent
     )
+    # A comment's URL reads its post
+    return redirect(parent or post)
+
+
+@asynchronous.login_required
+async def comment(request, post_id):
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+    return await asynchronous.run(reply, request, post_id)
+
+
+def cast_vote(user, model, pk, choice):
+    """Vote on a post or comment, through the vote buffer when it's on."""
+    pk = parse_id(pk)
+    buffer = votebuffer.get_buffer()
+    if buffer is None:
+        model.vote_model().objects.cast(user, get_object_or_404(model, pk=pk), choice)
+        return
+    # Whether the target exists is checked when the buffer is written
+    buffer.add(user.pk, model, pk, choice)
+
+
+async def resolve_vote(request, choice, post_id):
+    await asynchronous.run(cast_vote, request.user, Post, post_id, choice)
     return redirect(request.GET.get("next"))
 
 
-@login_required
-def upvote_post(request, post_id):
-    return resolve_vote(request, Vote.Choice.UP, post_id)
+@asynchronous.login_required
+async def upvote_post(request, post_id):
+    return await resolve_vote(request, Vote.Choice.UP, post_id)
 
 
-@login_required
-def downvote_post(request, post_id):
-    return resolve_vote(request, Vote.Choice.DOWN, post_id)
-
-
-def resolve_comment_vote(request, choice, comment_id):
-    comment = get_object_or_404(Comment, pk=comment_id)
-    Vote.objects.update_or_create(
-        object_id=comment_id,
-        user=request.user,
-        defaults={
-            "choice": choice,
-            "user": request.user,
-            "object_id": comment_id,
-            "content_object": comment,
-        },
-    )
+@asynchronous.login_required
+async def downvote_post(request, post_id):
+    return await resolve_vote(request, Vote.Choice.DOWN, post_id)
+
+
+@asynchronous.login_required
+async def unvote_post(request, post_id):
+    return await resolve_vote(request, None, post_id)
+
+
+async def resolve_comment_vote(request, choice, comment_id):
+    await asynchronous.run(cast_vote, request.user, Comment, comment_id, choice)
     return redirect(request.GET.get("next"))
 
 
-@login_required
-def upvote_comment(request, comment_id):
-    return resolve_comment_vote(request, Vote.Choice.UP, comment_id)
+@asynchronous.login_required
+async def upvote_comment(request, comment_id):
+    return await resolve_comment_vote(request, Vote.Choice.UP, comment_id)
 
 
-@login_required
-def downvote_comment(request, comment_id):
-    return resolve_comment_vote(request, Vote.Choice.DOWN, comment_id)
+@asynchronous.login_required
+async def downvote_comment(request, comment_id):
+    return await resolve_comment_vote(request, Vote.Choice.DOWN, comment_id)
 
 
-def post_detail(request, post_id, post_slug):
+@asynchronous.login_required
+async def unvote_comment(request, comment_id):
+    return await resolve_comment_vote(request, None, comment_id)
 
-    post_query = Post.ranked.select_related("category", "user").prefetch_related(
-        Prefetch(
-            "comments", Comment.objects.select_related("user").select_related("reply")
-        )
-    )
 
-    if request.user.is_authenticated:
-        user_votes = Vote.objects.filter(user=request.user, object_id=post_id)
-        user_favs = Favourite.objects.filter(user=request.user, object_id=post_id)
-        post_query = post_query.annotate(
-            has_saved=Exists(user_favs, distinct=True),
-            upvoted=Exists(user_votes.filter(choice=Vote.Choice.UP), distinct=True,),
-            downvoted=Exists(
-                user_votes.filter(choice=Vote.Choice.DOWN), distinct=True,
-            ),
-        )
+@anonymous_cache
+def post_detail(request, post_id, post_slug, comment_id=None):
 
-    post = get_object_or_404(post_query, id=post_id)
+    post = get_object_or_404(
+        Post.objects.select_related("category", "user"), id=post_id
+    )
+    attach_viewer_state(request.user, [post])
+
+    sort = request.GET.get("sort")
+    if sort not in comments.SORTS:
+        sort = "best"
+    try:
+        limit = min(max(int(request.GET["limit"]), 1), MAX_COMMENT_BREADTH)
+    except (KeyError, ValueError):
+        limit = comments.DEFAULT_BREADTH
+    try:
+        tree = comments.load_comment_tree(
+            post,
+            request.user,
+            sort,
+            root=uuid.UUID(comment_id) if comment_id else None,
+            breadth=limit,
+        )
+    except (ValueError, Comment.DoesNotExist):
+        raise Http404("No such comment")
 
-    return render(request, "posts/post_detail.html", {"post": post})
+    return render(
+        request,
+        "posts/post_detail.html",
+        {
+            "post": post,
+            "comments": tree,
+            "comment_sort": sort,
+            "comment_sorts": comments.SORTS,
+            "more_limit": min(limit * 5, MAX_COMMENT_BREADTH),
+        },
+    )
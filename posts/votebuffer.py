@@ -0,0 +1,117 @@
+"""Write-behind buffering of votes.
+
+With ``VOTE_BUFFER`` on, the vote views hand votes to a per-process buffer
+instead of writing them. The buffer is keyed by user and target, so someone
+flipping their vote back and forth only leaves their last choice. It is
+written with ``VoteManager.cast_many``, one batch per vote table:
+
+* every ``VOTE_BUFFER_INTERVAL`` seconds, from a background thread
+* when a vote fills it to ``VOTE_BUFFER_SIZE``, from that request
+* when the process exits
+
+Until a vote is written, ``posts.viewer`` overlays it on the votes it loads,
+so the voter sees it straight away. Scores catch up at the next flush. The
+overlay only covers requests served by the process that took the vote.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+
+class VoteBuffer:
+    def __init__(self, interval=2.0, size=400):
+        self.interval = interval
+        self.size = size
+        self.pending = {}
+        # The batch being written, still overlaid until it's committed
+        self.writing = {}
+        self.lock = threading.Lock()
+        self.flushing = threading.Lock()
+        self.thread = None
+
+    def add(self, user_id, model, object_id, choice):
+        with self.lock:
+            self.pending[user_id, model, object_id] = choice
+            full = len(self.pending) >= self.size
+            if self.thread is None:
+                self.start()
+        if full:
+            self.flush()
+
+    def overlay(self, user_id, model, object_ids):
+        """``user_id``'s unwritten choices on ``object_ids``, ``None`` if retracted."""
+        choices = {}
+        with self.lock:
+            for votes in (self.writing, self.pending):
+                for object_id in object_ids:
+                    key = (user_id, model, object_id)
+                    if key in votes:
+                        choices[object_id] = votes[key]
+        return choices
+
+    def flush(self):
+        """Write the buffered votes, returning how many changed anything."""
+        with self.flushing:
+            with self.lock:
+                batch, self.pending = self.pending, {}
+                self.writing = batch
+            if not batch:
+                return 0
+            by_model = {}
+            for (user_id, model, object_id), choice in batch.items():
+                by_model.setdefault(model, {})[user_id, object_id] = choice
+            try:
+                with transaction.atomic():
+                    return sum(
+                        model.vote_model().objects.cast_many(votes)
+                        for model, votes in by_model.items()
+                    )
+            except Exception:
+                # Put the batch back under anything voted since
+                with self.lock:
+                    self.pending = {**batch, **self.pending}
+                raise
+            finally:
+                with self.lock:
+                    self.writing = {}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="vote-buffer", daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Writing buffered votes failed")
+            finally:
+                # This thread's connection, requests close their own
+                connection.close()
+
+
+buffer = None
+buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """This process's vote buffer, ``None`` unless ``VOTE_BUFFER`` is on."""
+    global buffer
+    if not getattr(settings, "VOTE_BUFFER", False):
+        return None
+    if buffer is None:
+        with buffer_lock:
+            if buffer is None:
+                buffer = VoteBuffer(
+                    interval=getattr(settings, "VOTE_BUFFER_INTERVAL", 2.0),
+                    size=getattr(settings, "VOTE_BUFFER_SIZE", 400),
+                )
+    return buffer
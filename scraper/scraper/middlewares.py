@@ -6,6 +6,7 @@
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest
 
 
 class ScraperSpiderMiddleware(object):
@@ -101,3 +102,17 @@ class ScraperDownloaderMiddleware(object):
 
     def spider_opened(self, spider):
         spider.logger.info('Spider opened: %s' % spider.name)
+
+
+class OfflineDownloaderMiddleware(object):
+    """Keeps offline crawls (-a offline=1) off the network.
+
+    Installed after HttpCacheMiddleware, so it only sees requests the cache
+    couldn't answer. Local file:// fixtures still load, everything else is
+    dropped.
+    """
+
+    def process_request(self, request, spider):
+        if getattr(spider, 'offline', False) and not request.url.startswith('file:'):
+            raise IgnoreRequest('Not in the HTTP cache: %s' % request.url)
+        return None
@@ -4,8 +4,92 @@
 #
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
+import os
+import sys
+import time
+from pathlib import Path
 
+from itemadapter import ItemAdapter
+from twisted.internet import threads
+from twisted.internet.defer import DeferredLock
+
+# The jeddit project lives in the directory above the scrapy project
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+
+
+def setup_django(settings_module):
+    if str(PROJECT_ROOT) not in sys.path:
+        sys.path.insert(0, str(PROJECT_ROOT))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
+
+    import django
+
+    django.setup()
+
+
+class DjangoPipeline(object):
+    """Writes scraped items straight into the jeddit database.
+
+    Items are buffered and handed to ``posts.ingest.Ingester`` once
+    ``DJANGO_BATCH_SIZE`` of them have built up or ``DJANGO_FLUSH_INTERVAL``
+    seconds have passed since the last write. Whatever is left is written when
+    the spider closes. Writes happen one at a time on a worker thread, and the
+    item that triggers a write waits for it, which holds the crawl back when
+    the database falls behind.
+    """
+
+    def __init__(self, settings_module, batch_size, flush_interval):
+        self.settings_module = settings_module
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.flushed = time.monotonic()
+        self.lock = DeferredLock()
+        self.ingester = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            settings_module=settings.get("DJANGO_SETTINGS_MODULE", "jeddit.settings"),
+            batch_size=settings.getint("DJANGO_BATCH_SIZE", 500),
+            flush_interval=settings.getfloat("DJANGO_FLUSH_INTERVAL", 5.0),
+        )
+
+    def open_spider(self, spider):
+        setup_django(self.settings_module)
+
+        from posts.ingest import Ingester
+
+        self.ingester = Ingester(batch_size=self.batch_size)
 
-class ScraperPipeline(object):
     def process_item(self, item, spider):
-        return item
+        self.buffer.append(ItemAdapter(item).asdict())
+        due = time.monotonic() - self.flushed >= self.flush_interval
+        if len(self.buffer) < self.batch_size and not due:
+            return item
+        return self.flush().addCallback(lambda _: item)
+
+    def close_spider(self, spider):
+        def report(_):
+            spider.logger.info(
+                "Wrote %d posts and %d comments, %d duplicates, %d skipped "
+                "(%.0f posts/s)",
+                self.ingester.created,
+                self.ingester.comments,
+                self.ingester.duplicates,
+                self.ingester.skipped,
+                self.ingester.rate,
+            )
+
+        return self.flush().addCallback(report)
+
+    def flush(self):
+        batch, self.buffer = self.buffer, []
+        self.flushed = time.monotonic()
+        return self.lock.run(threads.deferToThread, self.write, batch)
+
+    def write(self, batch):
+        for record in batch:
+            self.ingester.add(record)
+        self.ingester.flush()
@@ -2,28 +2,129 @@ import scrapy
 from posixpath import basename, dirname
 from urllib.parse import urlparse
 from functools import partial
+from pathlib import Path
+
+
+# Where the saved pages are, beside scrapy.cfg
+ROOT = Path(__file__).resolve().parents[2]
+
+# Saved front pages, crawl these instead of reddit with -a offline=1
+FIXTURES = {
+    subreddit: ROOT / f"quotes-{subreddit}.html"
+    for subreddit in ("programming", "gaming")
+}
+
+# Matches a thing div by one of its classes, they're padded with spaces
+COMMENT = 'div[contains(concat(" ", normalize-space(@class), " "), " comment ")]'
+
+
+def flag(value):
+    """A spider argument as a boolean, they arrive as strings from -a."""
+    return str(value).lower() not in ("0", "false", "no")
 
 
 class PostSpider(scrapy.Spider):
+    """Crawls subreddit listings and the comment pages of their posts.
+
+    Spider arguments:
+
+    * ``subreddits``: comma separated names, the defaults below otherwise
+    * ``pages``: how many listing pages to follow per subreddit
+    * ``comments``: set to 0 to skip the comment pages
+    * ``offline``: start from the saved ``FIXTURES``, and follow posts to
+      their saved ``comments-<id>.html`` pages where there are some; anything
+      else is only served from the HTTP cache, see
+      ``OfflineDownloaderMiddleware``
+
+    Posts are yielded before their comments, and comments before their
+    replies. Comment items carry ``type: "comment"``, the ``post`` they're on
+    and the ``parent`` they reply to, which is the post for top level
+    comments. Ids are reddit's fullnames (``t3_...`` posts, ``t1_...``
+    comments).
+    """
+
     name = "subreddits"
+    offline = False
+    subreddits = "programming,askreddit,linux"
+    pages = 1
+    comments = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # OfflineDownloaderMiddleware reads it as well
+        self.offline = flag(self.offline)
 
     def start_requests(self):
-        subreddits = ["programming", "askreddit", "linux"]
-        for subreddit in subreddits:
+        if self.offline:
+            pages = {name: path.as_uri() for name, path in FIXTURES.items()}
+        else:
+            pages = {
+                subreddit: f"http://old.reddit.com/r/{subreddit}/"
+                for subreddit in self.subreddits.split(",")
+            }
+        for subreddit, url in pages.items():
             parser = partial(self.parse, subreddit=subreddit)
-            yield scrapy.Request(
-                url=f"http://old.reddit.com/r/{subreddit}/", callback=parser
-            )
+            yield scrapy.Request(url=url, callback=parser)
 
-    def parse(self, response, subreddit=None):
+    def parse(self, response, subreddit=None, page=1):
         posts = response.xpath('//div[@id="siteTable"]/div[contains(@class, "thing")]')
-        # [TODO] Recursively crawl the subpage of each post
         for post in posts:
             info = post.xpath('div[@class="entry unvoted"]/div/p/a')
             anchor, user = info
             yield {
+                "id": post.attrib.get("data-fullname"),
                 "title": anchor.xpath("text()").get(),
                 "href": anchor.xpath("@href").get(),
                 "username": user.xpath("text()").get(),
                 "subreddit": subreddit,
             }
+            post_id = post.attrib.get("data-fullname")
+            permalink = post.attrib.get("data-permalink")
+            if self.follow_comments and permalink and post_id:
+                yield response.follow(
+                    self.comments_url(post_id, permalink),
+                    callback=self.parse_comments,
+                    cb_kwargs={"post_id": post_id},
+                )
+
+        following = response.css("span.next-button a::attr(href)").get()
+        if following and page < int(self.pages):
+            parser = partial(self.parse, subreddit=subreddit, page=page + 1)
+            yield response.follow(following, callback=parser)
+
+    def comments_url(self, post_id, permalink):
+        saved = ROOT / f"comments-{post_id}.html"
+        if self.offline and saved.exists():
+            return saved.as_uri()
+        # Permalinks are site relative, the offline fixtures aren't on reddit
+        return f"https://old.reddit.com{permalink}"
+
+    def parse_comments(self, response, post_id):
+        listing = response.xpath('//div[contains(@class, "nestedlisting")]')
+        yield from self.walk(listing.xpath(COMMENT), post_id, post_id)
+
+    def walk(self, comments, post_id, parent_id):
+        """Yield comments depth first, each one ahead of its replies."""
+        for comment in comments:
+            comment_id = comment.attrib.get("data-fullname")
+            if not comment_id:
+                continue
+            body = comment.xpath(
+                'div[contains(@class, "entry")]'
+                '//div[contains(@class, "usertext-body")]/div[@class="md"]//text()'
+            ).getall()
+            yield {
+                "type": "comment",
+                "id": comment_id,
+                "post": post_id,
+                "parent": parent_id,
+                # Deleted comments keep their place in the thread without an author
+                "username": comment.attrib.get("data-author") or "deleted",
+                "content": "".join(body).strip(),
+            }
+            replies = comment.xpath(f'div[@class="child"]/div/{COMMENT}')
+            yield from self.walk(replies, post_id, comment_id)
+
+    @property
+    def follow_comments(self):
+        return flag(self.comments)